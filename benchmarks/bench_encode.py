@@ -0,0 +1,72 @@
+"""Microbenchmark: encode time and file size of every output format at each encoder effort tier."""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+from PIL import Image, ImageFilter
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from config.settings import SUPPORTED_FORMATS
+from core.converter import ENCODER_EFFORTS, OutputSettings, _get_save_kwargs, _prepare_for_format
+
+def make_photo_image(width, height):
+    """
+    Returns a deterministic RGB image with the fine detail and noise of a photograph.
+    The synthetic PSD planes are smooth gradients, which every encoder compresses
+    trivially, so they would hide the differences between tiers.
+    """
+    fractal = Image.effect_mandelbrot((width, height), (-2.2, -1.2, 1.0, 1.2), 100)
+    noise = Image.effect_noise((width, height), 24).filter(ImageFilter.GaussianBlur(1))
+    gradient = Image.linear_gradient('L').resize((width, height))
+    return Image.merge('RGB', (
+        Image.blend(fractal, noise, 0.35),
+        Image.blend(gradient, noise, 0.25),
+        Image.blend(fractal.transpose(Image.Transpose.FLIP_LEFT_RIGHT), gradient, 0.5),
+    ))
+
+def _encode(image, output_settings, repeat):
+    """Returns the best encode time in milliseconds and the encoded size in bytes."""
+    prepared = _prepare_for_format(image, output_settings)
+    save_kwargs = _get_save_kwargs(output_settings)
+    best = None
+    for _ in range(repeat):
+        buffer = io.BytesIO()
+        start = time.perf_counter()
+        prepared.save(buffer, **save_kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, buffer.tell()
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--width', type=int, default=1600, help="image width")
+    arg_parser.add_argument('--height', type=int, default=1200, help="image height")
+    arg_parser.add_argument('--formats', nargs='+', choices=SUPPORTED_FORMATS, default=SUPPORTED_FORMATS)
+    arg_parser.add_argument('--quality', type=int, default=90, help="quality for lossy formats")
+    arg_parser.add_argument('--lossless', action='store_true', help="encode WebP losslessly")
+    arg_parser.add_argument('--repeat', type=int, default=3, help="timing rounds")
+    args = arg_parser.parse_args()
+
+    image = make_photo_image(args.width, args.height)
+    print(f"{'format':<6} {'effort':<9} {'encode ms':>10} {'size KB':>9} {'speed vs balanced':>18} "
+          f"{'size vs balanced':>17}")
+    for output_format in args.formats:
+        if output_format == 'bmp':
+            continue  # BMP has no encoder options
+        timings = {}
+        for effort in ENCODER_EFFORTS:
+            output_settings = OutputSettings(format=output_format, quality=args.quality, lossless=args.lossless,
+                                             effort=effort, color_management=False)
+            timings[effort] = _encode(image, output_settings, args.repeat)
+        balanced_ms, balanced_size = timings['balanced']
+        for effort, (elapsed_ms, size) in timings.items():
+            print(f"{output_format:<6} {effort:<9} {elapsed_ms:>10.1f} {size / 1024:>9.0f} "
+                  f"{balanced_ms / elapsed_ms:>17.2f}x {size / balanced_size - 1:>+16.1%}")
+
+if __name__ == "__main__":
+    main()
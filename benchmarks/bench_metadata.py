@@ -0,0 +1,66 @@
+"""Microbenchmark: creation date lookup via psd-tools versus the resource scanner."""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from xml.etree import ElementTree
+
+from dateutil import parser as date_parser
+from psd_tools import PSDImage
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from utils.metadata import XMP_RESOURCE_ID, get_file_creation_date_str
+from synthetic import make_xmp, write_psd
+
+def legacy_creation_date(psd_file_path):
+    """The previous lookup: full psd-tools parse, ElementTree DOM and dateutil."""
+    psd_image = PSDImage.open(psd_file_path)
+    xmp = psd_image.image_resources.get_data(XMP_RESOURCE_ID)
+    namespaces = {'photoshop': 'http://ns.adobe.com/photoshop/1.0/'}
+    root = ElementTree.fromstring(xmp.split(b'?>', 1)[1].rsplit(b'<?', 1)[0])
+    element = root.find(".//photoshop:DateCreated", namespaces)
+    return date_parser.parse(element.text).strftime("%Y-%m-%d_%H%M%S")
+
+def _time(function, paths, repeat):
+    """Returns the best per-file time in microseconds over several rounds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for path in paths:
+                function(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(paths) * 1e6
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--files', type=int, default=50, help="number of synthetic PSDs")
+    arg_parser.add_argument('--size', type=int, default=512, help="canvas width and height")
+    arg_parser.add_argument('--repeat', type=int, default=5, help="timing rounds")
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for index in range(args.files):
+            path = os.path.join(directory, f"bench_{index}.psd")
+            write_psd(path, args.size, args.size, xmp=make_xmp())
+            paths.append(path)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert legacy_creation_date(paths[0]) == get_file_creation_date_str(paths[0])
+        legacy = _time(legacy_creation_date, paths, args.repeat)
+        scanner = _time(get_file_creation_date_str, paths, args.repeat)
+
+    print(f"psd-tools + ElementTree + dateutil: {legacy:10.1f} us/file")
+    print(f"image resource scanner:             {scanner:10.1f} us/file")
+    print(f"speedup:                            {legacy / scanner:10.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Benchmark: direct LANCZOS resize versus box pre-reduction followed by LANCZOS."""
+
+import argparse
+import os
+import sys
+import time
+
+from PIL import Image, ImageChops, ImageStat
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from core.converter import RESIZE_REDUCING_GAP
+
+def _best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--width', type=int, default=6000)
+    arg_parser.add_argument('--height', type=int, default=4000)
+    arg_parser.add_argument('--scales', type=int, nargs='+', default=[5, 10, 25, 50, 75])
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    args = arg_parser.parse_args()
+
+    # A fractal has detail at every scale, which makes resampling errors visible
+    source = Image.effect_mandelbrot((args.width, args.height), (-2, -1.2, 1, 1.2), 200).convert('RGB')
+
+    print(f"reducing_gap={RESIZE_REDUCING_GAP}, {args.width}x{args.height} RGB")
+    print(f"{'scale':>6} {'direct s':>9} {'reduced s':>10} {'speedup':>8} {'mean diff':>10} {'max diff':>9}")
+    for scale in args.scales:
+        size = (max(1, args.width * scale // 100), max(1, args.height * scale // 100))
+        direct_time, direct = _best_time(
+            lambda: source.resize(size, Image.Resampling.LANCZOS), args.repeat)
+        reduced_time, reduced = _best_time(
+            lambda: source.resize(size, Image.Resampling.LANCZOS, reducing_gap=RESIZE_REDUCING_GAP), args.repeat)
+        difference = ImageChops.difference(direct, reduced)
+        mean_difference = max(ImageStat.Stat(difference).mean)
+        max_difference = max(high for _, high in difference.getextrema())
+        print(f"{scale:>5}% {direct_time:>9.3f} {reduced_time:>10.3f} {direct_time / reduced_time:>7.1f}x "
+              f"{mean_difference:>10.3f} {max_difference:>9}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Microbenchmark: time and peak memory of strip-streaming conversion against decoding the whole composite."""
+
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from core.streaming import STREAMABLE_FORMATS
+from synthetic import COMPRESSION_RLE, write_psd
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+def run_case(psd_path, output_dir, output_format, scale, streamed):
+    """Converts one file in this (fresh) process. Returns (seconds, peak RSS in MB)."""
+    from PIL import Image
+    import core.streaming
+    from core.converter import OutputSettings, convert_psd_to_image
+
+    Image.MAX_IMAGE_PIXELS = None
+    # Force either path whatever the canvas size
+    core.streaming.STREAM_MIN_PIXELS = 0 if streamed else float('inf')
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        output_path = convert_psd_to_image(psd_path, output_dir, OutputSettings(format=output_format, scale=scale))
+    if not output_path:
+        raise RuntimeError(f"Conversion of '{psd_path}' failed")
+    return time.perf_counter() - start, _peak_rss_mb()
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--width', type=int, default=6000, help="canvas width")
+    arg_parser.add_argument('--height', type=int, default=8000, help="canvas height")
+    arg_parser.add_argument('--formats', nargs='+', choices=STREAMABLE_FORMATS, default=['tiff', 'png'])
+    arg_parser.add_argument('--scale', type=int, default=50, help="output scale in percent")
+    args = arg_parser.parse_args()
+
+    # Linux carries the peak RSS of a parent over to spawned children, so the large
+    # file is written in a process of its own and every run starts from a small parent
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directory:
+        psd_path = os.path.join(directory, 'large.psd')
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            pool.submit(write_psd, psd_path, args.width, args.height, channels=4,
+                        compression=COMPRESSION_RLE).result()
+        megapixels = args.width * args.height / 1e6
+        print(f"{args.width}x{args.height} RGBA ({megapixels:.0f} MP), RLE, scale {args.scale}%")
+        print(f"{'format':<6} {'mode':<9} {'seconds':>8} {'peak RSS MB':>12}")
+        for output_format in args.formats:
+            for streamed in (False, True):
+                # A fresh process per run keeps peak RSS figures independent
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    seconds, peak = pool.submit(run_case, psd_path, directory, output_format, args.scale,
+                                                streamed).result()
+                mode = 'streamed' if streamed else 'in memory'
+                print(f"{output_format:<6} {mode:<9} {seconds:>8.2f} {peak or 0:>12.0f}")
+
+if __name__ == "__main__":
+    main()
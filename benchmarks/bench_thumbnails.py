@@ -0,0 +1,69 @@
+"""Microbenchmark: source list thumbnails from the embedded JPEG, a composite decode and the disk cache."""
+
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from core.thumbnails import ThumbnailService, decode_thumbnail, read_embedded_thumbnail
+from synthetic import write_psd
+
+def _time(function, paths, repeat):
+    """Returns the best per-file time in milliseconds over several rounds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for path in paths:
+                function(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(paths) * 1e3
+
+def _jpeg(width, height):
+    data = io.BytesIO()
+    Image.radial_gradient('L').resize((width, height)).convert('RGB').save(data, format='JPEG')
+    return data.getvalue()
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--files', type=int, default=20, help="number of synthetic PSDs")
+    arg_parser.add_argument('--size', type=int, default=2048, help="canvas width and height")
+    arg_parser.add_argument('--thumbnail-size', type=int, default=48, help="requested thumbnail size")
+    arg_parser.add_argument('--repeat', type=int, default=3, help="timing rounds")
+    args = arg_parser.parse_args()
+    size = (args.thumbnail_size, args.thumbnail_size)
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        thumbnail = (160, 160, _jpeg(160, 160))
+        for index in range(args.files):
+            path = os.path.join(directory, f"bench_{index}.psd")
+            write_psd(path, args.size, args.size, thumbnail=thumbnail)
+            paths.append(path)
+
+        cache_dir = os.path.join(directory, 'cache')
+        service = ThumbnailService(size, cache_dir)
+        embedded = _time(read_embedded_thumbnail, paths, args.repeat)
+        decoded = _time(lambda path: decode_thumbnail(path, size), paths, 1)
+        shutil.rmtree(cache_dir)
+        os.makedirs(cache_dir)
+        first = _time(service.get, paths, 1)
+        cached = _time(service.get, paths, args.repeat)
+
+    print(f"embedded thumbnail:        {embedded:10.2f} ms/file")
+    print(f"composite decode:          {decoded:10.2f} ms/file")
+    print(f"service, first request:    {first:10.2f} ms/file")
+    print(f"service, cached:           {cached:10.2f} ms/file")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""Benchmark suite: times each conversion stage on a synthetic PSD corpus.
+
+Usage:
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --output new.json --baseline results.json
+
+Each case (mode, bit depth, layers, XMP, canvas size) runs in a fresh process
+so its peak RSS is measured on its own. For every output format in
+SUPPORTED_FORMATS it reports per-stage time per file (scan, metadata, decode,
+resize, mode conversion, encode, write), throughput in files/s and MPix/s,
+and peak RSS.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import PIL
+from PIL import Image
+
+from config.settings import SUPPORTED_FORMATS
+from core.converter import (OutputSettings, RESIZE_REDUCING_GAP, _get_save_kwargs, _prepare_for_format,
+                            get_output_size)
+from core.scanner import iter_psd_files
+from utils.metadata import get_file_creation_date_str
+from synthetic import (COLOR_MODE_CMYK, COLOR_MODE_GRAYSCALE, COLOR_MODE_RGB, COMPRESSION_RAW, COMPRESSION_RLE,
+                       make_xmp, write_psd)
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# name: (color mode, channels, depth, layers, with XMP, compression)
+CASES = {
+    'rgb8': (COLOR_MODE_RGB, 3, 8, 0, True, COMPRESSION_RLE),
+    'rgba8-layers': (COLOR_MODE_RGB, 4, 8, 5, True, COMPRESSION_RLE),
+    'rgb8-raw-noxmp': (COLOR_MODE_RGB, 3, 8, 0, False, COMPRESSION_RAW),
+    'cmyk8': (COLOR_MODE_CMYK, 4, 8, 0, True, COMPRESSION_RLE),
+    'cmyka8-layers': (COLOR_MODE_CMYK, 5, 8, 3, True, COMPRESSION_RLE),
+    'gray8': (COLOR_MODE_GRAYSCALE, 1, 8, 0, True, COMPRESSION_RLE),
+    'graya8': (COLOR_MODE_GRAYSCALE, 2, 8, 0, False, COMPRESSION_RLE),
+    'rgb16': (COLOR_MODE_RGB, 3, 16, 0, True, COMPRESSION_RLE),
+}
+
+STAGES = ('scan', 'metadata', 'decode', 'resize', 'mode_conversion', 'encode', 'write')
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+def generate_case(case_name, size, file_count, work_dir):
+    """Writes one case's corpus and returns its directory."""
+    color_mode, channels, depth, layers, with_xmp, compression = CASES[case_name]
+    case_dir = os.path.join(work_dir, f"{case_name}-{size}")
+    os.makedirs(case_dir)
+    width, height = size, size * 3 // 4
+    for index in range(file_count):
+        write_psd(os.path.join(case_dir, f"file_{index}.psd"), width, height, color_mode, channels, depth,
+                  make_xmp() if with_xmp else None, compression, layers)
+    return case_dir
+
+def _decode(psd_path):
+    image = Image.open(psd_path)
+    image.load()
+    return image
+
+def run_case(case_name, size, case_dir, formats, scale):
+    """Times every stage on a generated corpus. Runs in its own process."""
+    color_mode, channels, depth, layers, with_xmp, _ = CASES[case_name]
+    output_dir = os.path.join(case_dir, 'out')
+    os.makedirs(output_dir)
+    width, height = size, size * 3 // 4
+
+    scan_time, psd_paths = _timed(lambda: sorted(iter_psd_files([case_dir])))
+    totals = {(output_format, stage): 0.0 for output_format in formats for stage in STAGES}
+    error = None
+    megapixels = width * height / 1e6
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for psd_path in psd_paths:
+            metadata_time, _ = _timed(get_file_creation_date_str, psd_path)
+            try:
+                decode_time, image = _timed(_decode, psd_path)
+            except Exception as e:
+                error = f"decode failed: {e}"
+                break
+
+            settings = OutputSettings(scale=scale)
+            target_size = get_output_size(image.size, settings)
+            resize_time, resized = _timed(
+                lambda: image.resize(target_size, Image.Resampling.LANCZOS, reducing_gap=RESIZE_REDUCING_GAP)
+                if target_size != image.size else image)
+
+            for output_format in formats:
+                settings.format = output_format
+                convert_time, prepared = _timed(_prepare_for_format, resized, settings)
+                buffer = io.BytesIO()
+                try:
+                    save_kwargs = _get_save_kwargs(settings)
+                    encode_time, _ = _timed(lambda: prepared.save(buffer, **save_kwargs))
+                except Exception as e:
+                    totals[(output_format, 'error')] = str(e)
+                    continue
+                output_path = os.path.join(output_dir, f"{os.path.basename(psd_path)}.{output_format}")
+                write_time, _ = _timed(_write_bytes, output_path, buffer.getvalue())
+
+                for stage, elapsed in (('scan', scan_time / len(psd_paths)), ('metadata', metadata_time),
+                                       ('decode', decode_time), ('resize', resize_time),
+                                       ('mode_conversion', convert_time), ('encode', encode_time),
+                                       ('write', write_time)):
+                    totals[(output_format, stage)] += elapsed
+
+    results = []
+    for output_format in formats:
+        result = {
+            'case': case_name,
+            'size': [width, height],
+            'mode': color_mode,
+            'channels': channels,
+            'depth': depth,
+            'layers': layers,
+            'xmp': with_xmp,
+            'format': output_format,
+            'files': len(psd_paths),
+            'error': error or totals.get((output_format, 'error')),
+        }
+        if not result['error']:
+            per_file = {stage: totals[(output_format, stage)] / len(psd_paths) for stage in STAGES}
+            total = sum(per_file.values())
+            result['stages_ms'] = {stage: round(seconds * 1000, 3) for stage, seconds in per_file.items()}
+            result['files_per_second'] = round(1 / total, 2)
+            result['mpix_per_second'] = round(megapixels / total, 2)
+        results.append(result)
+
+    peak_rss = _peak_rss_mb()
+    for result in results:
+        result['peak_rss_mb'] = peak_rss
+    return results
+
+def _write_bytes(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def _result_key(result):
+    return result['case'], tuple(result['size']), result['format']
+
+def print_results(results, baseline=None):
+    baseline_by_key = {_result_key(result): result for result in (baseline or [])}
+    header = f"{'case':<16} {'size':>10} {'format':<6} {'files/s':>9} {'MPix/s':>8} {'RSS MB':>7}"
+    header += "  slowest stage" + ("   vs baseline" if baseline else "")
+    print(header)
+    for result in results:
+        size = f"{result['size'][0]}x{result['size'][1]}"
+        if result['error']:
+            print(f"{result['case']:<16} {size:>10} {result['format']:<6}  {result['error']}")
+            continue
+        slowest = max(result['stages_ms'], key=result['stages_ms'].get)
+        line = (f"{result['case']:<16} {size:>10} {result['format']:<6} {result['files_per_second']:>9.2f} "
+                f"{result['mpix_per_second']:>8.2f} {result['peak_rss_mb'] or 0:>7.1f}  "
+                f"{slowest} ({result['stages_ms'][slowest]:.1f} ms)")
+        previous = baseline_by_key.get(_result_key(result))
+        if previous and not previous.get('error'):
+            line += f"   {result['files_per_second'] / previous['files_per_second']:.2f}x"
+        print(line)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Time each PSD conversion stage on a synthetic corpus.")
+    arg_parser.add_argument('--cases', nargs='+', choices=sorted(CASES), default=sorted(CASES))
+    arg_parser.add_argument('--sizes', nargs='+', type=int, default=[512, 2048], help="canvas widths")
+    arg_parser.add_argument('--formats', nargs='+', choices=SUPPORTED_FORMATS, default=SUPPORTED_FORMATS)
+    arg_parser.add_argument('--files', type=int, default=3, help="files per case")
+    arg_parser.add_argument('--scale', type=int, default=50, help="output scale in percent")
+    arg_parser.add_argument('--output', help="write results to this JSON file")
+    arg_parser.add_argument('--baseline', help="compare throughput against an earlier JSON results file")
+    args = arg_parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for case_name in args.cases:
+            for size in args.sizes:
+                case_dir = generate_case(case_name, size, args.files, work_dir)
+                # A fresh process per case keeps peak RSS figures independent
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                    results.extend(pool.submit(run_case, case_name, size, case_dir, args.formats,
+                                               args.scale).result())
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    if args.output:
+        report = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'pillow': PIL.__version__,
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'scale': args.scale,
+                'files_per_case': args.files,
+            },
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Deterministic synthetic PSD files for benchmarks."""
+
+import re
+import struct
+
+# PSD color mode numbers
+COLOR_MODE_GRAYSCALE = 1
+COLOR_MODE_RGB = 3
+COLOR_MODE_CMYK = 4
+
+# Color channels per color mode
+MODE_CHANNELS = {
+    COLOR_MODE_GRAYSCALE: 1,
+    COLOR_MODE_RGB: 3,
+    COLOR_MODE_CMYK: 4,
+}
+
+# Image data compression methods
+COMPRESSION_RAW = 0
+COMPRESSION_RLE = 1
+
+XMP_TEMPLATE = (
+    '<?xpacket begin="" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+    '<x:xmpmeta xmlns:x="adobe:ns:meta/">'
+    '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+    '<rdf:Description rdf:about=""'
+    ' xmlns:xmp="http://ns.adobe.com/xap/1.0/"'
+    ' xmlns:dc="http://purl.org/dc/elements/1.1/"'
+    ' xmlns:photoshop="http://ns.adobe.com/photoshop/1.0/">'
+    '<xmp:CreatorTool>Adobe Photoshop 25.0 (Windows)</xmp:CreatorTool>'
+    '<photoshop:DateCreated>{date}</photoshop:DateCreated>'
+    '<dc:format>application/vnd.adobe.photoshop</dc:format>'
+    '</rdf:Description></rdf:RDF></x:xmpmeta>'
+    '<?xpacket end="w"?>'
+)
+
+# Runs of three or more identical bytes, which PackBits stores as repeats
+_RUN_RE = re.compile(rb'(.)\1{2,}', re.DOTALL)
+
+def make_xmp(date='2021-03-04T05:06:07+01:00'):
+    """Returns an XMP packet carrying the given photoshop:DateCreated value."""
+    return XMP_TEMPLATE.format(date=date).encode('utf-8')
+
+def _resource_block(resource_id, data):
+    """Encodes one image resource block with an empty name."""
+    padding = b'\x00' if len(data) & 1 else b''
+    return b'8BIM' + struct.pack('>HHI', resource_id, 0, len(data)) + data + padding
+
+def make_thumbnail_resource(width, height, jpeg_data):
+    """Returns thumbnail resource data: the JPEG format header followed by the JPEG file."""
+    row_bytes = (width * 24 + 31) // 32 * 4
+    return struct.pack('>IIIIIIHH', 1, width, height, row_bytes, row_bytes * height, len(jpeg_data), 24, 1) + jpeg_data
+
+def _channel_plane(width, height, depth, seed):
+    """
+    Returns one deterministic channel in big-endian raw form: a flat band across
+    the top quarter (long runs for RLE) above a shifting gradient.
+    """
+    bytes_per_sample = depth // 8
+    max_value = (1 << depth) - 1
+    row = bytearray()
+    for x in range(width):
+        value = ((x * 255 // max(width - 1, 1)) + seed * 40) % 256
+        row += (value * max_value // 255).to_bytes(bytes_per_sample, 'big')
+    flat_row = ((seed * 60 + 30) % 256 * max_value // 255).to_bytes(bytes_per_sample, 'big') * width
+
+    plane = bytearray()
+    for y in range(height):
+        if y < height // 4:
+            plane += flat_row
+        else:
+            shift = (y * bytes_per_sample) % len(row)
+            plane += row[shift:] + row[:shift]
+    return bytes(plane)
+
+def packbits(row):
+    """Encodes one scanline with PackBits, as used by PSD RLE image data."""
+    encoded = bytearray()
+
+    def literal(data):
+        for start in range(0, len(data), 128):
+            chunk = data[start:start + 128]
+            encoded.append(len(chunk) - 1)
+            encoded.extend(chunk)
+
+    position = 0
+    for match in _RUN_RE.finditer(row):
+        literal(row[position:match.start()])
+        run_length = match.end() - match.start()
+        value = match.group(1)[0]
+        while run_length >= 3:
+            chunk = min(run_length, 128)
+            encoded.append(257 - chunk)
+            encoded.append(value)
+            run_length -= chunk
+        literal(row[match.end() - run_length:match.end()])
+        position = match.end()
+    literal(row[position:])
+    return bytes(encoded)
+
+def _encode_planes(planes, width, height, depth, compression, psb=False):
+    """Encodes channel planes as one image data block (without the compression field)."""
+    if compression == COMPRESSION_RAW:
+        return b''.join(planes)
+    row_size = width * depth // 8
+    counts = []
+    rows = []
+    for plane in planes:
+        for y in range(height):
+            encoded = packbits(plane[y * row_size:(y + 1) * row_size])
+            counts.append(len(encoded))
+            rows.append(encoded)
+    # PSB files store RLE row byte counts as 32-bit values
+    count_format = 'I' if psb else 'H'
+    return struct.pack(f'>{len(counts)}{count_format}', *counts) + b''.join(rows)
+
+def _crop_plane(plane, width, depth, rect):
+    """Returns the part of a full-canvas plane inside (top, left, bottom, right)."""
+    top, left, bottom, right = rect
+    bytes_per_sample = depth // 8
+    row_size = width * bytes_per_sample
+    return b''.join(
+        plane[y * row_size + left * bytes_per_sample:y * row_size + right * bytes_per_sample]
+        for y in range(top, bottom))
+
+def _layer_section(layer_count, width, height, depth, planes, channel_ids, compression):
+    """Builds the layer and mask information section with simple rectangular layers."""
+    records = b''
+    channel_data = b''
+    for index in range(layer_count):
+        # Layers are staggered, overlapping rectangles
+        rect = (
+            index * height // (layer_count * 2),
+            index * width // (layer_count * 2),
+            height - index * height // (layer_count * 4),
+            width - index * width // (layer_count * 4),
+        )
+        layer_height, layer_width = rect[2] - rect[0], rect[3] - rect[1]
+        name = f"Layer {index + 1}".encode('ascii')
+        pascal_name = bytes([len(name)]) + name
+        pascal_name += b'\x00' * (-len(pascal_name) % 4)
+        extra = struct.pack('>II', 0, 0) + pascal_name
+
+        channel_info = b''
+        for channel_id, plane in zip(channel_ids, planes):
+            cropped = _crop_plane(plane, width, depth, rect)
+            data = struct.pack('>H', compression) + _encode_planes(
+                [cropped], layer_width, layer_height, depth, compression)
+            channel_info += struct.pack('>hI', channel_id, len(data))
+            channel_data += data
+
+        records += struct.pack('>4iH', *rect, len(channel_ids)) + channel_info
+        records += b'8BIMnorm' + struct.pack('>BBBBI', 255, 0, 0, 0, len(extra)) + extra
+
+    layer_info = struct.pack('>h', layer_count) + records + channel_data
+    layer_info += b'\x00' * (len(layer_info) & 1)
+    body = struct.pack('>I', len(layer_info)) + layer_info + struct.pack('>I', 0)
+    return struct.pack('>I', len(body)) + body
+
+def write_psd(path, width, height, color_mode=COLOR_MODE_RGB, channels=3, depth=8, xmp=None,
+              compression=COMPRESSION_RAW, layers=0, icc=None, thumbnail=None, psb=False):
+    """
+    Writes a PSD with a merged composite and optional rectangular layers.
+    Channels beyond those of the color mode are written as an alpha channel.
+    icc is an optional embedded ICC profile, thumbnail optional (width, height, jpeg_data).
+    psb writes the large document format (merged composite only).
+    """
+    if psb and layers:
+        raise ValueError("layers aren't supported in PSB files")
+    resources = b''
+    if thumbnail:
+        resources += _resource_block(1036, make_thumbnail_resource(*thumbnail))
+    if icc:
+        resources += _resource_block(1039, icc)
+    if xmp:
+        resources += _resource_block(1060, xmp)
+
+    planes = [_channel_plane(width, height, depth, channel) for channel in range(channels)]
+    color_channels = MODE_CHANNELS.get(color_mode, channels)
+    channel_ids = list(range(min(channels, color_channels)))
+    if channels > color_channels:
+        channel_ids.append(-1)  # Transparency mask
+
+    with open(path, 'wb') as f:
+        f.write(b'8BPS' + struct.pack('>H6xHIIHH', 2 if psb else 1, channels, height, width, depth, color_mode))
+        f.write(struct.pack('>I', 0))  # color mode data
+        f.write(struct.pack('>I', len(resources)) + resources)
+        if layers:
+            f.write(_layer_section(layers, width, height, depth, planes[:len(channel_ids)],
+                                   channel_ids, compression))
+        else:
+            # Layer and mask information; its length field is 8 bytes in PSB files
+            f.write(struct.pack('>Q' if psb else '>I', 0))
+        f.write(struct.pack('>H', compression))
+        f.write(_encode_planes(planes, width, height, depth, compression, psb))
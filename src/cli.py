@@ -0,0 +1,328 @@
+"""Headless command-line entry point with JSON-lines progress output.
+
+Run from the repository root with ``python -m src.cli`` (or ``python src/cli.py``).
+Progress events are written to stdout as one JSON object per line; the
+converter's human-readable log goes to stderr.
+"""
+
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+
+# Add the src directory to the Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config.settings import (DEFAULT_OUTPUT_SETTINGS, SUPPORTED_FORMATS, MAX_WORKERS, MEMORY_BUDGET_MB, SKIP_UNCHANGED,
+                             PIPELINE_PREFETCH, DEDUP_MODE, BATCH_JOURNAL, BATCH_RETRIES, LONGEST_FIRST,
+                             QUEUE_TASK_SIZE,
+                             QUEUE_LEASE_SECONDS, QUEUE_POLL_INTERVAL, WATCH_SETTLE_SECONDS, WATCH_POLL_INTERVAL)
+from core.batch import BatchControl, convert_batch, get_default_worker_count
+from core.cache import ConversionCache
+from core.color import RENDERING_INTENTS
+from core.converter import ENCODER_EFFORTS, OutputSettings
+from core.dedup import DEDUP_MODES
+from core.flatten import parse_matte_color
+from core.journal import BatchJournal
+from core.planner import BatchPlan
+from core.scanner import iter_psd_files
+from core.taskqueue import QueueWorker, create_task_queue, get_queue_status
+from core.watcher import FolderWatcher
+from utils.metrics import AggregateSink, JsonLinesSink, MultiSink
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="psd-converter",
+        description="Convert PSD files to images without a GUI, reporting progress as JSON lines.")
+    parser.add_argument('sources', nargs='*', help="PSD files or folders to convert")
+    parser.add_argument('-o', '--output-dir', help="directory for the converted images")
+    parser.add_argument('-f', '--format', choices=SUPPORTED_FORMATS, default=DEFAULT_OUTPUT_SETTINGS['format'],
+                        help="output image format")
+    parser.add_argument('-q', '--quality', type=int, default=DEFAULT_OUTPUT_SETTINGS['quality'],
+                        help="output quality for lossy formats (1-100)")
+    parser.add_argument('-s', '--scale', type=int, default=DEFAULT_OUTPUT_SETTINGS['scale'],
+                        help="output scale in percent")
+    parser.add_argument('--max-size', type=int, default=DEFAULT_OUTPUT_SETTINGS['max_size'],
+                        help="limit the longest output side to this many pixels")
+    parser.add_argument('--lossless', action='store_true', default=DEFAULT_OUTPUT_SETTINGS['lossless'],
+                        help="use lossless compression where supported")
+    parser.add_argument('--matte', default=DEFAULT_OUTPUT_SETTINGS['matte_color'], type=parse_matte_color,
+                        metavar='COLOR',
+                        help="background for transparency in JPEG and BMP output, e.g. white or '#202020'")
+    parser.add_argument('--no-color-management', dest='color_management', action='store_false',
+                        default=DEFAULT_OUTPUT_SETTINGS['color_management'],
+                        help="don't convert embedded color profiles (e.g. CMYK, Adobe RGB) to sRGB")
+    parser.add_argument('--intent', choices=sorted(RENDERING_INTENTS),
+                        default=DEFAULT_OUTPUT_SETTINGS['rendering_intent'],
+                        help="rendering intent for color profile conversion")
+    parser.add_argument('--embed-profile', action='store_true', default=DEFAULT_OUTPUT_SETTINGS['embed_profile'],
+                        help="embed the sRGB profile in PNG, JPEG and WebP output")
+    parser.add_argument('--layers', dest='export_layers', action='store_true',
+                        default=DEFAULT_OUTPUT_SETTINGS['export_layers'],
+                        help="export each visible top-level layer or group, cropped to its bounds, "
+                             "into a folder per file instead of the composite")
+    parser.add_argument('--layer-name', dest='layer_names', action='append',
+                        default=DEFAULT_OUTPUT_SETTINGS['layer_names'], metavar='PATTERN',
+                        help="only export layers whose name matches PATTERN, e.g. 'icon_*' (repeatable)")
+    parser.add_argument('--effort', choices=ENCODER_EFFORTS, default=None,
+                        help="encoder speed/size trade-off (default: the files earlier versions wrote, i.e. "
+                             "'smallest' PNG and 'balanced' JPEG, WebP and TIFF); 'fast' encodes several times "
+                             "faster for somewhat larger files")
+    parser.add_argument('--no-optimize', dest='optimize', action='store_false',
+                        default=DEFAULT_OUTPUT_SETTINGS['optimize'],
+                        help="don't optimize output file size (without --effort)")
+    parser.add_argument('-w', '--workers', type=int, default=MAX_WORKERS,
+                        help="number of worker processes (default: one per CPU core)")
+    parser.add_argument('--memory-budget', type=int, default=MEMORY_BUDGET_MB, metavar='MB',
+                        help="limit the estimated decoded size of files converted at once")
+    parser.add_argument('--prefetch', type=int, default=PIPELINE_PREFETCH, metavar='N',
+                        help="read N files ahead into memory and write outputs on a separate thread, "
+                             "overlapping slow storage with conversion")
+    parser.add_argument('--dedup', choices=DEDUP_MODES, default=DEDUP_MODE,
+                        help="convert byte-identical PSDs once and create the other copies' outputs as hardlinks, "
+                             "reflinks or copies")
+    parser.add_argument('--no-skip-unchanged', dest='skip_unchanged', action='store_false', default=SKIP_UNCHANGED,
+                        help="convert files even if they were already converted with the same settings")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue an interrupted batch into the same output directory, converting only the files "
+                             "it didn't finish")
+    parser.add_argument('--retries', type=int, default=BATCH_RETRIES, metavar='N',
+                        help="convert a failed file up to N more times before reporting it as failed")
+    parser.add_argument('--no-longest-first', dest='longest_first', action='store_false', default=LONGEST_FIRST,
+                        help="convert files in the order they are found instead of the most expensive first")
+    parser.add_argument('--plan-file', metavar='PATH',
+                        help="write each file's plan position and predicted and actual seconds to this JSON-lines "
+                             "file, for tuning the cost model")
+    parser.add_argument('--detailed-output', action='store_true',
+                        default=DEFAULT_OUTPUT_SETTINGS['detailed_output'], help="log details of each conversion")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep running and convert PSDs as they are added to or changed in the source folders, "
+                             "rewriting their outputs in place")
+    parser.add_argument('--settle', type=float, default=WATCH_SETTLE_SECONDS, metavar='SECONDS',
+                        help="with --watch, wait until a file is unchanged this long before converting it")
+    parser.add_argument('--poll', type=float, nargs='?', const=WATCH_POLL_INTERVAL, default=None, metavar='SECONDS',
+                        help="with --watch, scan the folders at an interval instead of using inotify "
+                             "(needed for network shares written by other machines)")
+    parser.add_argument('--queue', metavar='DIR',
+                        help="instead of converting, write the files into a task queue in DIR (on a shared file "
+                             "system) for --worker processes on any number of hosts")
+    parser.add_argument('--worker', metavar='DIR',
+                        help="convert tasks from the queue in DIR until it is drained; the output directory and "
+                             "settings come from the queue")
+    parser.add_argument('--queue-status', metavar='DIR', help="report the progress of the queue in DIR")
+    parser.add_argument('--metrics', action='store_true',
+                        help="time each conversion stage and add p50/p95 per stage to the summary")
+    parser.add_argument('--metrics-file', metavar='PATH',
+                        help="append per-file stage timings and counters to this JSON-lines file (implies --metrics)")
+    return parser
+
+def _open_event_stream():
+    """
+    Returns a stream on the original stdout for JSON events and points file
+    descriptor 1 at stderr, so log output from this and worker processes
+    can't interleave with the events.
+    """
+    sys.stdout.flush()
+    event_stream = os.fdopen(os.dup(sys.stdout.fileno()), 'w', buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    return event_stream
+
+def _emit(stream, event, **fields):
+    stream.write(json.dumps(dict(event=event, **fields)) + "\n")
+
+def run(args):
+    """Runs a batch for parsed arguments. Returns the process exit code."""
+    output_settings = OutputSettings(
+        format=args.format,
+        quality=args.quality,
+        scale=args.scale,
+        lossless=args.lossless,
+        optimize=args.optimize,
+        effort=args.effort,
+        max_size=args.max_size,
+        matte_color=args.matte,
+        color_management=args.color_management,
+        rendering_intent=args.intent,
+        embed_profile=args.embed_profile,
+        export_layers=args.export_layers,
+        layer_names=args.layer_names,
+        detailed_output=args.detailed_output)
+    max_workers = args.workers or get_default_worker_count()
+    if args.queue_status:
+        _emit(_open_event_stream(), 'status', queue=args.queue_status, **get_queue_status(args.queue_status))
+        return 0
+    if args.queue:
+        return run_coordinator(args, output_settings)
+    if args.worker:
+        return run_worker(args, max_workers)
+    if args.watch:
+        return run_watch(args, output_settings, max_workers)
+    memory_budget = args.memory_budget * 1024 * 1024 if args.memory_budget else None
+
+    aggregate = AggregateSink() if args.metrics or args.metrics_file else None
+    metrics_sink = aggregate
+
+    events = _open_event_stream()
+    control = BatchControl()
+    # Stop cleanly between files on Ctrl+C or a termination request
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: control.cancel())
+
+    _emit(events, 'start', output_dir=args.output_dir, workers=max_workers, settings=vars(output_settings))
+    counts = {'converted': 0, 'skipped': 0, 'failed': 0}
+    plan = BatchPlan([output_settings], args.longest_first) if args.longest_first or args.plan_file else None
+    start_time = time.perf_counter()
+
+    def on_file_done(result, completed, discovered):
+        if not result.success:
+            status = 'failed'
+        else:
+            status = 'skipped' if result.skipped else 'converted'
+        counts[status] += 1
+        _emit(events, 'file', path=result.psd_path, status=status, outputs=result.output_paths,
+              error=result.error, completed=completed, discovered=discovered)
+
+    try:
+        os.makedirs(args.output_dir, exist_ok=True)
+        if args.metrics_file:
+            metrics_sink = MultiSink(aggregate, JsonLinesSink(args.metrics_file))
+        cache = ConversionCache(args.output_dir, output_settings) if args.skip_unchanged else None
+        journal = BatchJournal(args.output_dir, output_settings, resume=args.resume) \
+            if BATCH_JOURNAL or args.resume else None
+        try:
+            results = convert_batch(iter_psd_files(args.sources), args.output_dir, output_settings,
+                                    max_workers=max_workers, callback=on_file_done, cache=cache, control=control,
+                                    memory_budget=memory_budget, metrics_sink=metrics_sink,
+                                    prefetch=args.prefetch, dedup=args.dedup, journal=journal,
+                                    retries=max(0, args.retries), plan=plan)
+        finally:
+            if cache:
+                cache.close()
+            if journal:
+                journal.close()
+            if metrics_sink:
+                metrics_sink.close()
+    except Exception as e:
+        _emit(events, 'error', message=str(e))
+        return 2
+
+    if aggregate:
+        counts['stages'] = aggregate.summary()
+    if plan:
+        counts['plan'] = plan.summary()
+        if args.plan_file:
+            _write_plan_file(args.plan_file, plan)
+    _emit(events, 'summary', total=len(results), cancelled=control.is_cancelled,
+          elapsed_seconds=round(time.perf_counter() - start_time, 3), **counts)
+    if control.is_cancelled:
+        return 130
+    return 1 if counts['failed'] else 0
+
+def run_watch(args, output_settings, max_workers):
+    """Watches the source folders until interrupted. Returns the process exit code."""
+    events = _open_event_stream()
+    folders = [path for path in args.sources if os.path.isdir(path)]
+    if len(folders) != len(args.sources):
+        _emit(events, 'error', message="--watch needs source folders")
+        return 2
+
+    control = BatchControl()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: control.cancel())
+
+    _emit(events, 'start', output_dir=args.output_dir, workers=max_workers, settings=vars(output_settings),
+          watch=True)
+    counts = {'converted': 0, 'failed': 0}
+
+    def on_file_done(result):
+        status = 'converted' if result.success else 'failed'
+        counts[status] += 1
+        _emit(events, 'file', path=result.psd_path, status=status, outputs=result.output_paths, error=result.error)
+
+    watcher = FolderWatcher(folders, args.output_dir, output_settings, max_workers, settle_seconds=args.settle,
+                            poll_interval=args.poll or WATCH_POLL_INTERVAL, use_inotify=args.poll is None,
+                            callback=on_file_done)
+    try:
+        os.makedirs(args.output_dir, exist_ok=True)
+        watcher.run(control)
+    except Exception as e:
+        _emit(events, 'error', message=str(e))
+        return 2
+    _emit(events, 'summary', total=counts['converted'] + counts['failed'], cancelled=True, **counts)
+    return 0
+
+def _write_plan_file(path, plan):
+    with open(path, 'w', encoding='utf-8') as f:
+        for psd_path, position, predicted, actual in plan.report():
+            f.write(json.dumps({'path': psd_path, 'position': position, 'predicted_seconds': round(predicted, 4),
+                                'actual_seconds': None if actual is None else round(actual, 4)}) + "\n")
+
+def run_coordinator(args, output_settings):
+    """Writes the sources into a task queue. Returns the process exit code."""
+    events = _open_event_stream()
+    try:
+        tasks, files = create_task_queue(args.queue, iter_psd_files(args.sources), args.output_dir, output_settings,
+                                         task_size=QUEUE_TASK_SIZE, lease_seconds=QUEUE_LEASE_SECONDS)
+    except Exception as e:
+        _emit(events, 'error', message=str(e))
+        return 2
+    _emit(events, 'queued', queue=args.queue, output_dir=args.output_dir, tasks=tasks, files=files,
+          settings=vars(output_settings))
+    return 0
+
+def run_worker(args, max_workers):
+    """Converts tasks of a queue until it is drained or the worker is stopped. Returns the process exit code."""
+    events = _open_event_stream()
+    control = BatchControl()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: control.cancel())
+
+    aggregate = AggregateSink() if args.metrics or args.metrics_file else None
+    counts = {'converted': 0, 'skipped': 0, 'failed': 0}
+    start_time = time.perf_counter()
+
+    def on_file_done(result):
+        if not result.success:
+            status = 'failed'
+        else:
+            status = 'skipped' if result.skipped else 'converted'
+        counts[status] += 1
+        _emit(events, 'file', path=result.psd_path, status=status, outputs=result.output_paths, error=result.error)
+
+    metrics_sink = aggregate
+    try:
+        if args.metrics_file:
+            metrics_sink = MultiSink(aggregate, JsonLinesSink(args.metrics_file))
+        try:
+            worker = QueueWorker(args.worker, max_workers=max_workers, poll_interval=QUEUE_POLL_INTERVAL,
+                                 memory_budget=args.memory_budget * 1024 * 1024 if args.memory_budget else None,
+                                 metrics_sink=metrics_sink, prefetch=args.prefetch, retries=max(0, args.retries))
+            _emit(events, 'start', queue=args.worker, worker=worker.worker_id, output_dir=worker.output_dir,
+                  workers=max_workers)
+            total = worker.run(control, on_file_done)
+        finally:
+            if metrics_sink:
+                metrics_sink.close()
+    except Exception as e:
+        _emit(events, 'error', message=str(e))
+        return 2
+
+    if aggregate:
+        counts['stages'] = aggregate.summary()
+    _emit(events, 'summary', total=total, cancelled=control.is_cancelled,
+          elapsed_seconds=round(time.perf_counter() - start_time, 3), **counts)
+    if control.is_cancelled:
+        return 130
+    return 1 if counts['failed'] else 0
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not (args.worker or args.queue_status) and not (args.sources and args.output_dir):
+        parser.error("the sources and -o/--output-dir are required")
+    return run(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -21,12 +21,49 @@ DEFAULT_OUTPUT_SETTINGS = {
     'scale': 100,
     'lossless': False,
     'optimize': True,
+    'effort': None,  # Encoder speed/size tier: 'fast', 'balanced' or 'smallest' (None for the optimize default)
+    'max_size': None,
+    'matte_color': (255, 255, 255),  # Background for transparency in JPEG and BMP output
+    'color_management': True,  # Convert embedded color profiles to sRGB
+    'rendering_intent': 'perceptual',
+    'embed_profile': False,  # Embed the sRGB profile in PNG, JPEG and WebP output
+    'export_layers': False,  # Export each top-level layer or group to its own file instead of the composite
+    'layer_names': None,  # Name patterns of the layers to export (None for all)
     'detailed_output': False
 }
 
 # Supported output formats
 SUPPORTED_FORMATS = ['png', 'jpg', 'webp', 'bmp', 'tiff']
 
+# Batch processing settings
+MAX_WORKERS = None  # None uses one worker process per CPU core
+MEMORY_BUDGET_MB = None  # Limit on the estimated decoded size of files converted at once (None for no limit)
+SKIP_UNCHANGED = True  # Skip files already converted with the same settings
+PIPELINE_PREFETCH = 0  # Files read ahead into memory while others convert, for slow (network) storage; 0 disables
+DEDUP_MODE = None  # 'hardlink', 'reflink' or 'copy' converts identical files once and links the outputs; None disables
+BATCH_JOURNAL = True  # Record each file's state in the output directory so an interrupted batch can be resumed
+BATCH_RETRIES = 1  # Times a failed file is converted again before it is reported as failed
+LONGEST_FIRST = True  # Dispatch the files predicted to take longest first, so large files don't finish last
+# (ordered within a window of the next 64 scanned files, core.planner.PLAN_WINDOW)
+
+# Distributed queue settings (see core/taskqueue.py)
+QUEUE_TASK_SIZE = 64  # Files per task claimed by a worker
+QUEUE_LEASE_SECONDS = 60.0  # A task whose worker sends no heartbeat this long is handed to another worker
+QUEUE_POLL_INTERVAL = 5.0  # Seconds an idle worker waits before looking for tasks again
+
+# Watch-folder settings
+WATCH_SETTLE_SECONDS = 2.0  # A file is converted once its size and modification time are unchanged this long
+WATCH_POLL_INTERVAL = 10.0  # Seconds between folder scans when inotify isn't used (e.g. network shares)
+
+# Progress log settings
+LOG_UPDATE_INTERVAL_MS = 50  # How often queued log lines are flushed to the window
+LOG_MAX_LINES = 5000  # Oldest lines are dropped beyond this
+
+# Source list thumbnail settings
+THUMBNAIL_SIZE = 48  # Largest side of the thumbnails shown next to source files, in pixels
+THUMBNAIL_CACHE_DIR = None  # None uses the per-user cache directory
+THUMBNAIL_CACHE_MAX_MB = 64  # Least recently used thumbnails are removed beyond this
+
 # Application settings
 APP_TITLE = "PSD to Image Converter"
 APP_GEOMETRY = "800x600" 
\ No newline at end of file
@@ -0,0 +1,351 @@
+"""Parallel batch conversion of PSD files using a process pool."""
+
+import itertools
+import os
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+# Add the src directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.converter import as_recipe, collect_errors, convert_psd_to_images, format_errors
+from core.dedup import Deduplicator
+from core.journal import DONE, FAILED
+from core.memory import MemoryScheduler, estimate_memory_bytes
+from core.naming import reset_output_name_allocators
+from core.pipeline import iter_pipelined
+from core.result import ConversionResult
+from utils.metrics import FileMetrics
+
+class BatchControl:
+    """Class to pause, resume and cancel a running batch from another thread."""
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    @property
+    def is_paused(self):
+        return not self._resumed.is_set()
+
+    @property
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def pause(self):
+        """Stops starting new files; files already being converted finish."""
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def cancel(self):
+        """Stops the batch after the files already being converted."""
+        self._cancelled.set()
+        self._resumed.set()
+
+    def wait_until_resumed(self, timeout=None):
+        """Blocks while paused. Returns False once the batch is cancelled."""
+        self._resumed.wait(timeout)
+        return not self.is_cancelled
+
+def _convert_one(psd_path, output_dir, recipe, output_paths=None, collect_metrics=False):
+    """Worker entry point: converts one file to every recipe variant, naming it after its creation date."""
+    metrics = FileMetrics() if collect_metrics else None
+    with collect_errors() as errors:
+        try:
+            if metrics is None:
+                results = convert_psd_to_images(psd_path, output_dir, recipe, output_paths=output_paths)
+            else:
+                with metrics.stage('total'):
+                    results = convert_psd_to_images(psd_path, output_dir, recipe, output_paths=output_paths,
+                                                    metrics=metrics)
+        except Exception as e:
+            return ConversionResult(psd_path, False, str(e), metrics=metrics and metrics.stages)
+    output_paths = [output_path or None for output_path in results]
+    success = all(results)
+    return ConversionResult(psd_path, success, None if success else format_errors(errors) or "Conversion failed",
+                            output_paths=output_paths, metrics=metrics and metrics.stages)
+
+def _iter_work(psd_paths, cache, journal=None, max_attempts=1):
+    """
+    Yields a skipped ConversionResult or a (psd_path, output_paths) work item per file.
+    Changed files keep their previous output path so they are rewritten in place.
+    In a resumed batch, files the journal records as done are skipped, and files that
+    already failed max_attempts times are reported as failed again without a retry.
+    """
+    for psd_path in psd_paths:
+        if journal is not None:
+            entry = journal.plan(psd_path)
+            if entry is not None and entry.state == DONE and all(
+                    output_path is None or os.path.exists(output_path) for output_path in entry.output_paths):
+                yield ConversionResult(psd_path, True, output_paths=entry.output_paths, skipped=True)
+                continue
+            if entry is not None and entry.state == FAILED and entry.attempts >= max_attempts:
+                yield ConversionResult(psd_path, False, entry.error, output_paths=entry.output_paths, skipped=True)
+                continue
+
+        previous_outputs = None
+        if cache is not None:
+            try:
+                up_to_date, previous_outputs = cache.check(psd_path)
+            except OSError:
+                # Let the converter report unreadable files
+                up_to_date, previous_outputs = False, None
+            if up_to_date:
+                yield ConversionResult(psd_path, True, output_paths=previous_outputs, skipped=True)
+                continue
+        yield psd_path, previous_outputs
+
+def get_default_worker_count():
+    """Returns the default number of worker processes (one per CPU core)."""
+    return os.cpu_count() or 1
+
+def iter_convert_batch(psd_paths, output_dir, output_settings, max_workers=None, cache=None, control=None,
+                       memory_budget=None, metrics_sink=None, prefetch=0, dedup=None, journal=None, retries=0,
+                       plan=None):
+    """
+    Converts the given PSD files across a pool of worker processes.
+    output_settings may be a single OutputSettings or a recipe (a list of them);
+    every variant of a recipe is produced from one decode of the file.
+    psd_paths may be a lazy iterable (such as a folder scan); files are submitted
+    as they arrive, so conversion starts before discovery finishes.
+    Files the ConversionCache reports as up to date are skipped.
+    An optional BatchControl pauses or cancels the batch between files.
+    With a memory_budget (in bytes), files are only started while the sum of their
+    estimated decoded sizes fits the budget; a file larger than the budget runs alone.
+    With a metrics_sink (see utils.metrics), every file's stage timings and counters
+    are collected in the workers and recorded to the sink.
+    With prefetch > 0, files are read that many files ahead into memory on a reader
+    thread and the workers' encoded output is written on a writer thread, so slow
+    reads and writes overlap with conversion (see core.pipeline). Recipes with a
+    layer export variant don't use the pipeline.
+    With dedup set to a mode in core.dedup.DEDUP_MODES ('hardlink', 'reflink' or
+    'copy'), byte-identical files are converted once and the outputs of the first
+    copy are linked or copied for the others; duplicates of files a cancelled batch never
+    reached are reported as skipped.
+    Failed files are converted again up to `retries` more times, after the other
+    files, on a fresh worker pool. With a BatchJournal, every file's state is
+    recorded as the batch runs, and a resumed journal skips files already done.
+    With a BatchPlan (see core.planner), files are dispatched most expensive first
+    and their actual conversion times are recorded against the predictions.
+    Yields a ConversionResult for each file in completion order.
+    """
+    if max_workers is None:
+        max_workers = get_default_worker_count()
+    # Pick up output files added or removed since an earlier batch in this process
+    reset_output_name_allocators()
+    recipe = as_recipe(output_settings)
+
+    work = _iter_work(psd_paths, cache, journal, retries + 1)
+    deduplicator = Deduplicator(dedup) if dedup else None
+    if deduplicator is not None:
+        work = deduplicator.filter_work(work, output_dir, recipe)
+    if plan is not None:
+        work = plan.order(work)
+    for result in _run_with_retries(work, output_dir, recipe, max(1, max_workers), control, memory_budget,
+                                    metrics_sink is not None or plan is not None, prefetch, retries, journal):
+        duplicates = deduplicator.resolve(result, output_dir, recipe) if deduplicator is not None else []
+        for finished in [result] + duplicates:
+            if cache is not None and finished.success and not finished.skipped:
+                cache.record(finished.psd_path, finished.output_paths)
+            if journal is not None:
+                journal.finish(finished)
+            if plan is not None:
+                plan.record(finished)
+            if metrics_sink is not None and finished.metrics:
+                metrics_sink.record(finished.psd_path, finished.metrics)
+            yield finished
+    # Their journal entries stay pending, so a resumed batch converts them
+    if deduplicator is not None:
+        yield from deduplicator.drain()
+
+def _run_with_retries(work, output_dir, recipe, max_workers, control=None, memory_budget=None,
+                      collect_metrics=False, prefetch=0, retries=0, journal=None):
+    """
+    Runs work items, holding back the results of failed files while they have retries
+    left. Retries run as another pass once the current one is done, so a worker pool
+    broken by a crashing file is replaced. Yields results in completion order.
+    """
+    attempts = {}
+
+    def track(items):
+        for item in items:
+            if not isinstance(item, ConversionResult):
+                attempts[item[0]] = attempts.get(item[0], 0) + 1
+                if journal is not None:
+                    journal.start(item[0])
+            yield item
+
+    while True:
+        failed = []
+        for result in _run_work(track(work), output_dir, recipe, max_workers, control, memory_budget,
+                                collect_metrics, prefetch):
+            cancelled = control is not None and control.is_cancelled
+            if result.success or result.skipped or attempts.get(result.psd_path, 0) > retries or cancelled:
+                yield result
+                continue
+            print(f"  Will retry '{os.path.basename(result.psd_path)}' "
+                  f"(attempt {attempts[result.psd_path]} of {retries + 1} failed)")
+            if journal is not None:
+                journal.finish(result)
+            # Variants already written are rewritten in place rather than getting new names
+            failed.append((result.psd_path, result.output_paths or None))
+        if not failed:
+            return
+        work = failed
+
+def _run_work(work, output_dir, recipe, max_workers, control=None, memory_budget=None, collect_metrics=False,
+              prefetch=0):
+    """Runs work items and yields results in completion order."""
+    work = iter(work)
+    if control is not None and not control.wait_until_resumed():
+        return
+
+    # Look ahead so a single file doesn't pay for starting a process pool
+    lookahead = []
+    for item in work:
+        if isinstance(item, ConversionResult):
+            yield item
+            continue
+        lookahead.append(item)
+        if len(lookahead) > 1:
+            break
+    work = itertools.chain(lookahead, work)
+
+    # Layer exports write a folder of files per variant, which the pipeline's writer doesn't handle
+    layer_export = any(output_settings.export_layers for output_settings in recipe)
+    if prefetch and len(lookahead) > 1 and not layer_export:
+        # A single compute thread still overlaps conversion with reading and writing
+        executor_class = ProcessPoolExecutor if max_workers > 1 else ThreadPoolExecutor
+        with executor_class(max_workers=max_workers) as executor:
+            yield from iter_pipelined(work, output_dir, recipe, executor, max_workers, control, memory_budget,
+                                      collect_metrics, prefetch, write_depth=max_workers + 1)
+        return
+
+    if max_workers == 1 or len(lookahead) <= 1:
+        for item in work:
+            if isinstance(item, ConversionResult):
+                yield item
+            else:
+                if control is not None and not control.wait_until_resumed():
+                    break
+                yield _convert_one(item[0], output_dir, recipe, item[1], collect_metrics)
+        return
+
+    os.makedirs(output_dir, exist_ok=True)
+    # Without a budget, keep two files per worker submitted so the scan and
+    # conversion overlap; with one, only admit what is actually running
+    scheduler = MemoryScheduler(memory_budget, max_workers if memory_budget else max_workers * 2)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        run = _PoolRun(executor, output_dir, recipe, scheduler, control, collect_metrics)
+        for item in work:
+            if isinstance(item, ConversionResult):
+                yield item
+                continue
+            if control is not None:
+                yield from _drain_while_paused(run, control)
+                if control.is_cancelled:
+                    break
+            cost = estimate_memory_bytes(item[0], recipe) if memory_budget else 0
+            scheduler.add(item, cost)
+            run.submit_admissible()
+            # Block once enough files are queued to pick from; otherwise just
+            # report finished files promptly even while the scan is slow
+            yield from run.collect(block=scheduler.pending_count >= max_workers)
+            run.submit_admissible()
+
+        while run.futures or scheduler.pending_count:
+            if control is not None:
+                yield from _drain_while_paused(run, control)
+                if control.is_cancelled:
+                    run.cancel_pending()
+            run.submit_admissible()
+            if not run.futures:
+                break
+            yield from run.collect()
+
+class _PoolRun:
+    """Class to hold the submitted files of a batch running on a process pool."""
+    def __init__(self, executor, output_dir, recipe, scheduler, control, collect_metrics=False):
+        self.executor = executor
+        self.output_dir = output_dir
+        self.recipe = recipe
+        self.scheduler = scheduler
+        self.control = control
+        self.collect_metrics = collect_metrics
+        self.futures = {}
+
+    def submit_admissible(self):
+        """Submits queued files while the memory scheduler admits them."""
+        while self.control is None or not (self.control.is_paused or self.control.is_cancelled):
+            entry = self.scheduler.pop_admissible()
+            if entry is None:
+                return
+            (psd_path, output_paths), cost = entry
+            future = self.executor.submit(_convert_one, psd_path, self.output_dir, self.recipe, output_paths,
+                                          self.collect_metrics)
+            self.futures[future] = (psd_path, cost)
+
+    def collect(self, block=True, timeout=None):
+        """Yields results of finished files, first waiting for one to finish if block is set."""
+        if not self.futures:
+            return
+        if block:
+            done, _ = wait(self.futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        else:
+            done = [future for future in self.futures if future.done()]
+        for future in done:
+            psd_path, cost = self.futures.pop(future)
+            self.scheduler.release(cost)
+            yield _future_result(future, psd_path)
+
+    def cancel_pending(self):
+        """Drops queued files and submitted files that haven't started yet."""
+        self.scheduler.clear()
+        for future in list(self.futures):
+            if future.cancel():
+                _, cost = self.futures.pop(future)
+                self.scheduler.release(cost)
+
+def _drain_while_paused(run, control):
+    """Yields results of running files while the batch is paused."""
+    while control.is_paused:
+        if run.futures:
+            yield from run.collect(timeout=0.1)
+        else:
+            control.wait_until_resumed(0.1)
+
+def _future_result(future, psd_path):
+    """Returns a worker's result, or a failed result if the worker process died."""
+    try:
+        return future.result()
+    except Exception as e:
+        # The worker process itself died (e.g. out of memory)
+        return ConversionResult(psd_path, False, str(e))
+
+def convert_batch(psd_paths, output_dir, output_settings, max_workers=None, callback=None, cache=None, control=None,
+                  memory_budget=None, metrics_sink=None, prefetch=0, dedup=None, journal=None, retries=0,
+                  plan=None):
+    """
+    Converts the given PSD files in parallel.
+    Calls callback(result, completed, total) after each file finishes, where total
+    is the number of files discovered so far when psd_paths is a lazy scan.
+    Returns the list of ConversionResult objects in completion order.
+    """
+    discovered = [0]
+
+    def count_discovered(paths):
+        for psd_path in paths:
+            discovered[0] += 1
+            yield psd_path
+
+    results = []
+    for result in iter_convert_batch(count_discovered(psd_paths), output_dir, output_settings,
+                                     max_workers, cache, control, memory_budget, metrics_sink, prefetch,
+                                     dedup, journal, retries, plan):
+        results.append(result)
+        if callback:
+            callback(result, len(results), discovered[0])
+    return results
@@ -0,0 +1,157 @@
+"""Persistent manifest of converted files for incremental batch runs."""
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+
+# Add the src directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.converter import as_recipe
+
+CACHE_FILENAME = ".psd_converter_cache.sqlite"
+
+# Output settings that don't affect the produced file
+_IGNORED_SETTINGS = ('detailed_output',)
+
+# Number of recorded conversions between commits
+_COMMIT_INTERVAL = 100
+
+def settings_fingerprint(output_settings):
+    """Returns a stable hash of the output settings that affect the produced file."""
+    fields = {key: value for key, value in vars(output_settings).items() if key not in _IGNORED_SETTINGS}
+    encoded = json.dumps(fields, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+def _name_key(output_settings):
+    """Returns the output settings deciding an output's name and kind, which rewriting it in place keeps."""
+    return json.dumps([output_settings.format.lower(), output_settings.name_suffix, bool(output_settings.export_layers)])
+
+def file_content_hash(path, chunk_size=1024 * 1024):
+    """Returns the SHA-256 hex digest of a file, read in large chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ConversionCache:
+    """
+    SQLite manifest stored in the output directory.
+    Maps a source file and a recipe variant (by index) to the output file produced for
+    it and the hash of the output settings it was produced with. A file converted with
+    other settings is converted again, and its output is rewritten in place as long as
+    its format and name suffix are unchanged.
+    output_settings may be a recipe, in which case every variant is tracked separately.
+    """
+    def __init__(self, output_dir, output_settings, use_content_hash=False):
+        self.path = os.path.join(output_dir, CACHE_FILENAME)
+        recipe = as_recipe(output_settings)
+        self.settings_hashes = [settings_fingerprint(variant) for variant in recipe]
+        self.name_keys = [_name_key(variant) for variant in recipe]
+        self.use_content_hash = use_content_hash
+        self._signatures = {}
+        self._pending = 0
+
+        os.makedirs(output_dir, exist_ok=True)
+        self._connection = sqlite3.connect(self.path)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS conversions ("
+            " source_path TEXT NOT NULL,"
+            " variant INTEGER NOT NULL,"
+            " settings_hash TEXT NOT NULL,"
+            " name_key TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " content_hash TEXT,"
+            " output_path TEXT NOT NULL,"
+            " PRIMARY KEY (source_path, variant))")
+        self._connection.commit()
+
+    def _signature(self, psd_path):
+        """Returns (size, mtime_ns, content_hash) of the source file."""
+        stat = os.stat(psd_path)
+        content_hash = file_content_hash(psd_path) if self.use_content_hash else None
+        return stat.st_size, stat.st_mtime_ns, content_hash
+
+    def check(self, psd_path):
+        """
+        Checks whether the source file was already converted with these settings.
+        Returns (up_to_date, previous_output_paths) with one previous output path,
+        or None, per recipe variant. Previous output paths are returned for changed
+        files and changed settings too, so they can be rewritten in place.
+        """
+        source_path = os.path.abspath(psd_path)
+        signature = self._signature(source_path)
+        self._signatures[source_path] = signature
+
+        rows = {row[0]: row[1:] for row in self._connection.execute(
+            "SELECT variant, settings_hash, name_key, size, mtime_ns, content_hash, output_path FROM conversions"
+            " WHERE source_path = ?", (source_path,))}
+        if any(variant >= len(self.settings_hashes) for variant in rows):
+            # Up-to-date files are skipped without being recorded again, so drop these here
+            self._delete_dropped_variants(source_path, len(self.settings_hashes))
+        up_to_date = True
+        previous_outputs = []
+        for variant, (settings_hash, name_key) in enumerate(zip(self.settings_hashes, self.name_keys)):
+            row = rows.get(variant)
+            # An output of another format or name suffix isn't reused; the variant gets a new name
+            if row is None or row[1] != name_key or not os.path.exists(row[5]):
+                up_to_date = False
+                previous_outputs.append(None)
+                continue
+
+            recorded_hash, _, size, mtime_ns, content_hash, output_path = row
+            previous_outputs.append(output_path)
+            if recorded_hash != settings_hash:
+                up_to_date = False
+            elif self.use_content_hash and content_hash:
+                # Content hashes survive copies and touches that change the mtime
+                up_to_date = up_to_date and size == signature[0] and content_hash == signature[2]
+            else:
+                up_to_date = up_to_date and (size, mtime_ns) == signature[:2]
+        return up_to_date, previous_outputs
+
+    def record(self, psd_path, output_paths):
+        """Records a successful conversion of the source file, one output path per recipe variant."""
+        source_path = os.path.abspath(psd_path)
+        signature = self._signatures.pop(source_path, None) or self._signature(source_path)
+        for variant, output_path in enumerate(output_paths):
+            self._connection.execute(
+                "INSERT OR REPLACE INTO conversions"
+                " (source_path, variant, settings_hash, name_key, size, mtime_ns, content_hash, output_path)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (source_path, variant, self.settings_hashes[variant], self.name_keys[variant]) + signature
+                + (os.path.abspath(output_path),))
+        self._delete_dropped_variants(source_path, len(output_paths))
+
+    def _delete_dropped_variants(self, source_path, variant_count):
+        """Deletes the rows of variants of a longer recipe used before."""
+        self._connection.execute("DELETE FROM conversions WHERE source_path = ? AND variant >= ?",
+                                 (source_path, variant_count))
+        self._pending += 1
+        if self._pending >= _COMMIT_INTERVAL:
+            self._connection.commit()
+            self._pending = 0
+
+    def discard(self, psd_path):
+        """Forgets the signature taken by check() for a file that won't be recorded."""
+        self._signatures.pop(os.path.abspath(psd_path), None)
+
+    def commit(self):
+        """Commits outstanding records, e.g. between files in a long-running watch."""
+        self._connection.commit()
+        self._pending = 0
+
+    def close(self):
+        """Commits outstanding records and closes the database."""
+        self._connection.commit()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,100 @@
+"""ICC color management with cached transforms."""
+
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+from PIL import ImageCms
+
+# Number of built transforms kept; batches rarely use more than a few distinct profiles
+TRANSFORM_CACHE_SIZE = 16
+
+RENDERING_INTENTS = {
+    'perceptual': ImageCms.Intent.PERCEPTUAL,
+    'relative': ImageCms.Intent.RELATIVE_COLORIMETRIC,
+    'saturation': ImageCms.Intent.SATURATION,
+    'absolute': ImageCms.Intent.ABSOLUTE_COLORIMETRIC,
+}
+
+# Modes a transform to sRGB is built for, and the mode it produces
+_OUTPUT_MODES = {
+    'CMYK': 'RGB',
+    'RGB': 'RGB',
+    'RGBA': 'RGBA',
+}
+
+_srgb_profile = None
+_srgb_profile_bytes = None
+_transforms = OrderedDict()
+_transforms_lock = threading.Lock()
+
+def get_srgb_profile():
+    """Returns the built-in sRGB profile, created once per process."""
+    global _srgb_profile
+    if _srgb_profile is None:
+        _srgb_profile = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB'))
+    return _srgb_profile
+
+def get_srgb_profile_bytes():
+    """Returns the built-in sRGB profile as ICC data for embedding in output files."""
+    global _srgb_profile_bytes
+    if _srgb_profile_bytes is None:
+        _srgb_profile_bytes = get_srgb_profile().tobytes()
+    return _srgb_profile_bytes
+
+def _build_transform(icc_profile, mode, rendering_intent):
+    """
+    Builds a transform from an embedded profile to sRGB. Returns None if the profile
+    already is sRGB, or can't be used, in which case the image is converted without it.
+    """
+    try:
+        source_profile = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+        if mode != 'CMYK' and ImageCms.getProfileDescription(source_profile).strip().startswith('sRGB'):
+            return None
+        return ImageCms.buildTransform(source_profile, get_srgb_profile(), mode, _OUTPUT_MODES[mode],
+                                       RENDERING_INTENTS[rendering_intent])
+    except (ImageCms.PyCMSError, OSError) as e:
+        print(f"  Ignoring unusable embedded color profile: {e}")
+        return None
+
+def get_transform(icc_profile, mode, rendering_intent='perceptual'):
+    """
+    Returns the transform from an embedded ICC profile to sRGB for an image mode,
+    or None if no conversion is needed. Building a transform costs far more than
+    applying it, so built transforms are kept in an LRU cache keyed by the profile
+    hash, mode and rendering intent.
+    """
+    key = (hashlib.sha1(icc_profile).hexdigest(), mode, rendering_intent)
+    with _transforms_lock:
+        if key in _transforms:
+            _transforms.move_to_end(key)
+            return _transforms[key]
+
+    transform = _build_transform(icc_profile, mode, rendering_intent)
+    with _transforms_lock:
+        _transforms[key] = transform
+        while len(_transforms) > TRANSFORM_CACHE_SIZE:
+            _transforms.popitem(last=False)
+    return transform
+
+def clear_transform_cache():
+    """Drops every transform cached by get_transform, so the next conversions build theirs again."""
+    with _transforms_lock:
+        _transforms.clear()
+
+def convert_to_srgb(image, rendering_intent='perceptual'):
+    """
+    Converts an image with an embedded ICC profile to sRGB. CMYK images become 'RGB'.
+    Images without a profile, already in sRGB or in other modes are returned unchanged.
+    The returned image carries no embedded profile, so a stale one isn't written out.
+    """
+    icc_profile = image.info.get('icc_profile')
+    if not icc_profile or image.mode not in _OUTPUT_MODES:
+        return image
+    transform = get_transform(icc_profile, image.mode, rendering_intent)
+    if transform is None:
+        return image
+    converted = ImageCms.applyTransform(image, transform)
+    converted.info.pop('icc_profile', None)
+    return converted
@@ -1,13 +1,64 @@
 """Core functionality for PSD to image conversion."""
 
+import contextlib
+import io
 import os
 import sys
+import threading
 from PIL import Image, UnidentifiedImageError
 
 # Add the src directory to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from utils.metadata import get_file_creation_date_str
+from core.color import convert_to_srgb, get_srgb_profile_bytes
+from core.flatten import DEFAULT_MATTE_COLOR, flatten_alpha, has_alpha, parse_matte_color, to_8bit
+from core.layers import ICC_PROFILE_RESOURCE_ID, get_layer_filename_base, open_layered_psd, render_layers, select_layers
+from core.naming import allocate_directory, create_temp_path, get_output_name_allocator
+from utils.metadata import XMP_RESOURCE_ID, get_creation_date_str, get_file_creation_date_str
+from utils.metrics import NULL_METRICS
+
+# Large downscales first shrink the image by an integer factor with a box filter
+# (Image.reduce) while staying at least this many times the target size, then
+# finish with LANCZOS on the smaller image. At 3.0 the result is identical to a
+# direct LANCZOS resize for scales of 25% and up, and within a mean of 0.05 and a
+# maximum of 4 code values below that (see benchmarks/bench_resize.py), while a
+# 10% scale runs about 4x faster.
+RESIZE_REDUCING_GAP = 3.0
+
+# Encoder parameters per format for each effort tier, trading encode time for file size.
+# Measured on a 1600x1200 photographic image (see benchmarks/bench_encode.py), 'balanced'
+# PNG encodes about 10x faster than 'smallest' (the previous default) for a 10% larger
+# file, and 'fast' about 3x faster again for another 15%.
+ENCODER_EFFORTS = ('fast', 'balanced', 'smallest')
+ENCODER_EFFORT_PARAMS = {
+    'png': {
+        'fast': {'compress_level': 3},
+        'balanced': {'compress_level': 6},
+        'smallest': {'optimize': True},  # compress_level 9 plus a search over filter strategies
+    },
+    'webp': {
+        'fast': {'method': 0},
+        'balanced': {'method': 4},
+        'smallest': {'method': 6},
+    },
+    'jpeg': {
+        'fast': {'optimize': False, 'subsampling': '4:2:0'},
+        'balanced': {'optimize': True, 'subsampling': '4:2:0'},
+        'smallest': {'optimize': True, 'progressive': True, 'subsampling': '4:2:0'},
+    },
+    'tiff': {
+        'fast': {'compression': 'raw'},
+        'balanced': {'compression': 'tiff_lzw'},
+        'smallest': {'compression': 'tiff_adobe_deflate'},
+    },
+}
+
+# Tier used per format when no effort is chosen, by the optimize setting: the one that
+# writes the same file as earlier versions, which only had optimize on or off
+DEFAULT_EFFORTS = {
+    True: {'png': 'smallest', 'jpeg': 'balanced', 'webp': 'balanced', 'tiff': 'balanced'},
+    False: {'png': 'balanced', 'jpeg': 'fast', 'webp': 'balanced', 'tiff': 'fast'},
+}
 
 class OutputSettings:
     """Class to hold output settings for image conversion."""
@@ -17,90 +68,513 @@ class OutputSettings:
         self.scale = kwargs.get('scale', 100)
         self.lossless = kwargs.get('lossless', False)
         self.optimize = kwargs.get('optimize', True)
+        # Encoder speed/size tier: 'fast', 'balanced' or 'smallest' (see ENCODER_EFFORT_PARAMS).
+        # None keeps the encoding earlier versions used with optimize on or off (see DEFAULT_EFFORTS).
+        self.effort = kwargs.get('effort', None)
         self.detailed_output = kwargs.get('detailed_output', False)
+        # Longest output side in pixels, applied after scale (None for no limit)
+        self.max_size = kwargs.get('max_size', None)
+        # Appended to the output filename, e.g. '_thumb', to tell recipe variants apart
+        self.name_suffix = kwargs.get('name_suffix', '')
+        # Background that transparency is flattened onto for formats without alpha (JPEG, BMP)
+        self.matte_color = parse_matte_color(kwargs.get('matte_color', DEFAULT_MATTE_COLOR))
+        # Convert embedded ICC profiles (e.g. CMYK, Adobe RGB) to sRGB, except for TIFF which keeps them
+        self.color_management = kwargs.get('color_management', True)
+        self.rendering_intent = kwargs.get('rendering_intent', 'perceptual')
+        # Embed the sRGB profile in PNG, JPEG and WebP output
+        self.embed_profile = kwargs.get('embed_profile', False)
+        # Export each visible top-level layer or group, cropped to its bounds, into a folder per file
+        self.export_layers = kwargs.get('export_layers', False)
+        # Name patterns of the layers to export, e.g. ['icon_*'] (None for all)
+        self.layer_names = kwargs.get('layer_names', None)
+
+def as_recipe(output_settings):
+    """Returns the output settings as a recipe (a list of OutputSettings)."""
+    if isinstance(output_settings, (list, tuple)):
+        return list(output_settings)
+    return [output_settings]
+
+# Errors reported by the conversion steps running on each thread (see collect_errors)
+_reported_errors = threading.local()
+
+def report_error(psd_path, error):
+    """Logs a failed conversion step and keeps its message for the file's ConversionResult."""
+    print(f"  Error converting '{os.path.basename(psd_path)}': {error}")
+    messages = getattr(_reported_errors, 'messages', None)
+    if messages is not None:
+        messages.append(str(error))
+
+@contextlib.contextmanager
+def collect_errors():
+    """
+    Collects the messages of errors reported on this thread while the block runs, e.g.
+    around converting one file. The steps report an error and return False or None, so
+    this is how callers learn why a file failed. Yields the list of messages.
+    """
+    previous = getattr(_reported_errors, 'messages', None)
+    _reported_errors.messages = messages = []
+    try:
+        yield messages
+    finally:
+        _reported_errors.messages = previous
+
+def format_errors(messages):
+    """Returns the distinct collected error messages as one string, or None if there are none."""
+    return "; ".join(dict.fromkeys(messages)) or None
+
+def open_psd_image(psd_path, source=None):
+    """
+    Opens the composite of a PSD file with Pillow, from source (a file object) when given.
+    Pillow's PSD plugin rejects 16-bit files, so their composite is read with psd-tools
+    instead, which scales it down to 8 bits. Raises UnidentifiedImageError for files
+    neither can read.
+    """
+    try:
+        return Image.open(source or psd_path)
+    except UnidentifiedImageError:
+        if source is not None:
+            source.seek(0)
+        try:
+            psd = open_layered_psd(psd_path, source)
+        except Exception:
+            psd = None
+        if psd is None or psd.depth != 16:
+            raise
+    image = psd.topil()
+    if image is None:
+        raise UnidentifiedImageError(f"'{psd_path}' has no composite image")
+    # Image resources in the form Pillow keeps them, for the XMP creation date and color profile
+    image.resources = [(resource_id, resource.name, resource.data)
+                       for resource_id, resource in psd.image_resources.items()]
+    if ICC_PROFILE_RESOURCE_ID in psd.image_resources:
+        image.info['icc_profile'] = psd.image_resources.get_data(ICC_PROFILE_RESOURCE_ID)
+    return image
+
+def load_psd(psd_path, metrics=NULL_METRICS, source=None):
+    """
+    Opens a PSD file once and returns (creation_date_str, image).
+    The XMP creation date is taken from the image resources Pillow reads while
+    opening the file, and the composite is decoded lazily from the same handle.
+    source is an optional file object to read instead of psd_path.
+    """
+    with metrics.stage('open'):
+        image = open_psd_image(psd_path, source)
+    with metrics.stage('metadata') as stage:
+        xmp_metadata = None
+        for resource_id, _, data in getattr(image, 'resources', []):
+            if resource_id == XMP_RESOURCE_ID:
+                xmp_metadata = data
+                break
+        stage.count(bytes_read=len(xmp_metadata or b''))
+        return get_creation_date_str(psd_path, xmp_metadata), image
+
+def get_output_size(size, output_settings):
+    """Returns the output (width, height) for an image size after scale and max_size."""
+    width, height = size
+    if output_settings.scale != 100:
+        width = int(width * output_settings.scale / 100)
+        height = int(height * output_settings.scale / 100)
+    if output_settings.max_size and max(width, height) > output_settings.max_size:
+        ratio = output_settings.max_size / max(width, height)
+        width = int(width * ratio)
+        height = int(height * ratio)
+    return max(1, width), max(1, height)
+
+def _pick_resize_source(intermediates, target_size):
+    """
+    Picks the image to resample a variant from. A downscaled intermediate is only
+    reused when it is at least twice the target size in both dimensions, which
+    keeps the LANCZOS output within a few code values of resampling the original.
+    """
+    original = intermediates[0]
+    for image in intermediates:
+        if image.size == target_size:
+            return image
+    candidates = [
+        image for image in intermediates
+        if image.width >= target_size[0] * 2 and image.height >= target_size[1] * 2
+    ]
+    if not candidates:
+        return original
+    return min(candidates, key=lambda image: image.width * image.height)
 
-def convert_psd_to_image(psd_path, output_dir, output_settings, filename_base):
+def convert_psd_to_image(psd_path, output_dir, output_settings, filename_base=None, output_path=None,
+                         metrics=None):
     """
     Converts a single PSD file to the specified image format.
     Handles filename collisions by appending a counter.
+    When filename_base is omitted, the PSD creation date is read from the same open file.
+    When output_path is given, that file is overwritten instead of allocating a new name.
+    Returns the output path on success, False otherwise.
+    """
+    return convert_psd_to_images(psd_path, output_dir, [output_settings], filename_base, [output_path],
+                                 metrics)[0]
+
+def convert_psd_to_images(psd_path, output_dir, recipe, filename_base=None, output_paths=None, metrics=None):
+    """
+    Converts a single PSD file to every variant of a recipe (a list of OutputSettings)
+    from one decode. Variants are produced largest first so smaller sizes can be
+    resampled from already downscaled intermediates.
+    Variants with export_layers set produce a folder of layer images instead (see
+    export_psd_layers), and PSB files and very large canvases are converted in strips
+    (see core.streaming); the composite is only decoded if other variants need it.
+    Stage timings and counters are added to metrics (a FileMetrics) when given.
+    Returns a list with the output path, or False, for each variant.
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+    results = [False] * len(recipe)
+    if output_paths is None:
+        output_paths = [None] * len(recipe)
+
+    layer_indexes = [index for index, output_settings in enumerate(recipe) if output_settings.export_layers]
+    if layer_indexes:
+        if filename_base is None:
+            filename_base = get_file_creation_date_str(psd_path, metrics)
+        layer_results = export_psd_layers(psd_path, output_dir, [recipe[index] for index in layer_indexes],
+                                          filename_base, [output_paths[index] for index in layer_indexes], metrics)
+        for index, result in zip(layer_indexes, layer_results):
+            results[index] = result
+        if len(layer_indexes) == len(recipe):
+            return results
+
+    # core.streaming builds on this module, so it is imported on first use
+    from core.streaming import get_streamed_variants
+    streamed_indexes = get_streamed_variants(psd_path, recipe)
+    if streamed_indexes:
+        if filename_base is None:
+            filename_base = get_file_creation_date_str(psd_path, metrics)
+        for index in streamed_indexes:
+            results[index] = _stream_variant(psd_path, output_dir, recipe[index], filename_base,
+                                             output_paths[index], metrics)
+    composite_indexes = [index for index in range(len(recipe))
+                         if index not in layer_indexes and index not in streamed_indexes]
+    if not composite_indexes:
+        return results
+
+    filename_base, image = decode_psd(psd_path, recipe, filename_base, metrics=metrics)
+    if image is None:
+        return results
+    try:
+        # Ensure output directory exists
+        os.makedirs(output_dir, exist_ok=True)
+    except Exception as e:
+        report_error(psd_path, e)
+        return results
+
+    composite_recipe = [recipe[index] for index in composite_indexes]
+    for position, variant in iter_variants(psd_path, image, composite_recipe, metrics):
+        if variant is not None:
+            index = composite_indexes[position]
+            results[index] = _save_variant(variant, psd_path, output_dir, recipe[index],
+                                           filename_base, output_paths[index], metrics)
+    return results
+
+def export_psd_layers(psd_path, output_dir, recipe, filename_base, output_paths=None, metrics=NULL_METRICS):
+    """
+    Exports the selected top-level layers and groups of a PSD file as separate images,
+    each cropped to its bounding box, for every variant of a recipe. The file is parsed
+    once with psd-tools and every layer any variant needs is rendered once, with
+    independent layers rendered in parallel (see core.layers).
+    Each variant's images go into a folder named after the file; an output path given
+    for a variant is that folder, whose layer images are overwritten. A variant without
+    any visible layer to export fails with the reason and gets no folder.
+    Returns a list with the folder path, or False, for each variant.
+    """
+    results = [False] * len(recipe)
+    if output_paths is None:
+        output_paths = [None] * len(recipe)
+    try:
+        with metrics.stage('open'):
+            psd = open_layered_psd(psd_path)
+        selections = [select_layers(psd, output_settings.layer_names) for output_settings in recipe]
+        layers = {index: layer for selection in selections for index, layer in selection}
+        with metrics.stage('render_layers', layers=len(layers)):
+            rendered = render_layers(psd, layers)
+    except FileNotFoundError:
+        report_error(psd_path, f"PSD file not found at '{psd_path}'")
+        return results
+    except Exception as e:
+        report_error(psd_path, e)
+        return results
+
+    for variant_index, output_settings in enumerate(recipe):
+        selection = [(index, layer) for index, layer in selections[variant_index] if rendered[index] is not None]
+        if not selection:
+            # Fails the variant rather than leaving an empty folder that looks like a successful export
+            if output_settings.layer_names:
+                report_error(psd_path, f"No visible layers match {', '.join(output_settings.layer_names)}")
+            else:
+                report_error(psd_path, "No visible layers to export")
+            continue
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+            layer_dir = output_paths[variant_index]
+            if layer_dir:
+                os.makedirs(layer_dir, exist_ok=True)
+            else:
+                layer_dir = allocate_directory(output_dir, f"{filename_base}{output_settings.name_suffix}")
+        except Exception as e:
+            report_error(psd_path, e)
+            continue
+
+        saved = True
+        extension = output_settings.format.lower()
+        for index, layer in selection:
+            image = rendered[index]
+            layer_filename_base = get_layer_filename_base(index, layer)
+            output_path = os.path.join(layer_dir, f"{layer_filename_base}.{extension}")
+            for _, variant in iter_variants(psd_path, image, [output_settings], metrics):
+                if variant is None or not _save_variant(variant, psd_path, layer_dir, output_settings,
+                                                        layer_filename_base, output_path, metrics):
+                    saved = False
+        results[variant_index] = layer_dir if saved else False
+    return results
+
+def convert_psd_to_encoded(psd_path, data, recipe, filename_base=None, metrics=None):
+    """
+    Decodes a PSD file from its already read bytes and encodes every recipe variant
+    in memory, leaving the write to the caller (see core.pipeline).
+    Returns (filename_base, encoded) with the encoded bytes, or None, for each variant.
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+    encoded = [None] * len(recipe)
+
+    filename_base, image = decode_psd(psd_path, recipe, filename_base, io.BytesIO(data), metrics)
+    if image is None:
+        return filename_base, encoded
+    for index, variant in iter_variants(psd_path, image, recipe, metrics):
+        if variant is None:
+            continue
+        try:
+            encoded[index] = encode_variant(variant, recipe[index], metrics)
+        except Exception as e:
+            report_error(psd_path, e)
+    return filename_base, encoded
+
+def decode_psd(psd_path, recipe, filename_base=None, source=None, metrics=NULL_METRICS):
+    """
+    Decode step: opens and decodes a PSD file, from source (a file object holding its
+    bytes) when given. The creation date is read when filename_base is None.
+    Returns (filename_base, image), or (filename_base, None) after reporting an error.
     """
+    detailed_output = any(output_settings.detailed_output for output_settings in recipe)
     try:
         # Open the PSD file
-        image = Image.open(psd_path)
+        if filename_base is None:
+            filename_base, image = load_psd(psd_path, metrics, source)
+        else:
+            with metrics.stage('open'):
+                image = open_psd_image(psd_path, source)
+        with metrics.stage('decode') as stage:
+            image.load()
+            if metrics.enabled:
+                stage.count(bytes_read=os.path.getsize(psd_path), pixels=image.width * image.height)
         
-        if output_settings.detailed_output:
+        if detailed_output:
             print(f"  Original image size: {image.width}x{image.height}")
             print(f"  Image mode: {image.mode}")
+        return filename_base, image
 
-        # Apply scaling if needed
-        if output_settings.scale != 100:
-            new_width = int(image.width * output_settings.scale / 100)
-            new_height = int(image.height * output_settings.scale / 100)
-            image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            if output_settings.detailed_output:
-                print(f"  Scaled to: {new_width}x{new_height}")
+    except FileNotFoundError:
+        report_error(psd_path, f"PSD file not found at '{psd_path}'")
+    except UnidentifiedImageError:
+        report_error(psd_path, "Cannot identify image file; it might be corrupted or not a valid PSD")
+    except Exception as e:
+        report_error(psd_path, e)
+    return filename_base, None
 
-        # Ensure output directory exists
-        os.makedirs(output_dir, exist_ok=True)
+def iter_variants(psd_path, image, recipe, metrics=NULL_METRICS):
+    """
+    Transform step: yields (index, variant) with the scaled image of each recipe variant.
+    A variant that can't be produced is yielded as (index, None) after reporting the error.
+    """
+    intermediates = [image]
+    target_sizes = [get_output_size(image.size, output_settings) for output_settings in recipe]
+    order = sorted(range(len(recipe)), key=lambda index: target_sizes[index][0] * target_sizes[index][1], reverse=True)
+    for index in order:
+        output_settings = recipe[index]
+        try:
+            # Apply scaling if needed
+            target_size = target_sizes[index]
+            source = _pick_resize_source(intermediates, target_size)
+            if source.size != target_size:
+                with metrics.stage('resize', pixels=target_size[0] * target_size[1]):
+                    variant = source.resize(target_size, Image.Resampling.LANCZOS,
+                                            reducing_gap=RESIZE_REDUCING_GAP)
+                intermediates.append(variant)
+                if output_settings.detailed_output:
+                    print(f"  Scaled to: {target_size[0]}x{target_size[1]}")
+            else:
+                variant = source
+        except Exception as e:
+            report_error(psd_path, e)
+            variant = None
+        yield index, variant
 
-        # Handle filename collisions
-        base_output_filename = f"{filename_base}.{output_settings.format.lower()}"
-        output_path = os.path.join(output_dir, base_output_filename)
-        
-        counter = 1
-        while os.path.exists(output_path):
-            new_filename_base = f"{filename_base}_{counter}"
-            output_filename_with_counter = f"{new_filename_base}.{output_settings.format.lower()}"
-            output_path = os.path.join(output_dir, output_filename_with_counter)
-            counter += 1
-        
-        final_output_filename = os.path.basename(output_path)
+def encode_variant(image, output_settings, metrics=NULL_METRICS):
+    """Encode step: returns a scaled variant encoded in the output format as bytes."""
+    with metrics.stage('mode_conversion'):
+        image = _prepare_for_format(image, output_settings)
+    buffer = io.BytesIO()
+    with metrics.stage('encode', pixels=image.width * image.height) as stage:
+        image.save(buffer, **_get_save_kwargs(output_settings), **_get_profile_kwargs(image, output_settings))
+        stage.count(bytes_written=buffer.tell())
+    return buffer.getvalue()
 
-        print(f"  Converting '{os.path.basename(psd_path)}' to '{final_output_filename}' as {output_settings.format.upper()}...")
+def write_encoded_variant(data, psd_path, output_dir, output_settings, filename_base, output_path=None,
+                          metrics=NULL_METRICS):
+    """Write step: writes an encoded variant. Returns the output path on success, False otherwise."""
+    def write(path):
+        with metrics.stage('write', bytes_written=len(data)):
+            with open(path, 'wb') as f:
+                f.write(data)
+    return _write_variant(psd_path, output_dir, output_settings, filename_base, output_path, write)
 
-        # Handle transparency and color modes
-        if output_settings.format.lower() in ['png', 'webp']:
-            if image.mode in ('P', 'PA') and 'transparency' in image.info:
-                image = image.convert("RGBA")
-                if output_settings.detailed_output:
-                    print("  Converted palette image with transparency to RGBA")
-            elif image.mode not in ('RGBA', 'LA'):
-                pass
-
-        elif output_settings.format.lower() in ['jpg', 'jpeg']:
-            if image.mode in ['RGBA', 'LA', 'P', 'PA']:
-                background = Image.new("RGB", image.size, (255, 255, 255))
-                try:
-                    background.paste(image, mask=image.split()[-1] if image.mode in ['RGBA', 'LA', 'PA'] else None)
-                except IndexError:
-                    background.paste(image)
-                image = background
-                if output_settings.detailed_output:
-                    print("  Converted image with transparency to RGB with white background")
-            elif image.mode == 'CMYK':
-                image = image.convert('RGB')
-                if output_settings.detailed_output:
-                    print("  Converted CMYK to RGB")
+def _save_variant(image, psd_path, output_dir, output_settings, filename_base, output_path=None,
+                  metrics=NULL_METRICS):
+    """Encodes and writes one already scaled variant. Returns the output path on success, False otherwise."""
+    def save(path):
+        with metrics.stage('mode_conversion'):
+            prepared = _prepare_for_format(image, output_settings)
 
         # Save the image with appropriate settings
         save_kwargs = _get_save_kwargs(output_settings)
-        image.save(output_path, **save_kwargs)
+        save_kwargs.update(_get_profile_kwargs(prepared, output_settings))
+        with metrics.stage('encode', pixels=prepared.width * prepared.height) as stage:
+            prepared.save(path, **save_kwargs)
+            if metrics.enabled:
+                stage.count(bytes_written=os.path.getsize(path))
+    return _write_variant(psd_path, output_dir, output_settings, filename_base, output_path, save)
+
+def _stream_variant(psd_path, output_dir, output_settings, filename_base, output_path=None,
+                    metrics=NULL_METRICS):
+    """Converts one variant in strips straight from the file. Returns the output path on success, False otherwise."""
+    from core.streaming import stream_psd_to_file
+    def write(path):
+        stream_psd_to_file(psd_path, path, output_settings, metrics)
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+    except Exception as e:
+        report_error(psd_path, e)
+        return False
+    return _write_variant(psd_path, output_dir, output_settings, filename_base, output_path, write)
+
+def _write_variant(psd_path, output_dir, output_settings, filename_base, output_path, write):
+    """
+    Calls write(path) to produce a variant in a temporary file, then moves it to its
+    output path in one rename, so an interrupted conversion never leaves a truncated
+    output behind (or a placeholder that later conversions would treat as taken).
+    A new output name is only claimed once the file is complete.
+    Returns the output path on success, False otherwise.
+    """
+    temp_path = None
+    reserved_path = None
+    try:
+        print(f"  Converting '{os.path.basename(psd_path)}' to {output_settings.format.upper()}...")
+
+        temp_path = create_temp_path(os.path.dirname(output_path) if output_path else output_dir)
+        write(temp_path)
+
+        if output_path is None:
+            # Handle filename collisions; the allocator reserves the name with an
+            # exclusive create so parallel workers never write to the same file
+            filename_base = f"{filename_base}{output_settings.name_suffix}"
+            allocator = get_output_name_allocator(output_dir)
+            output_path = allocator.allocate(filename_base, output_settings.format.lower())
+            reserved_path = output_path
+        # Replacing also breaks hardlinks to the outputs of duplicates (see core.dedup)
+        # instead of rewriting them too
+        os.replace(temp_path, output_path)
+        temp_path = None
+        reserved_path = None
         
         if output_settings.detailed_output:
             file_size = os.path.getsize(output_path) / 1024  # Size in KB
             print(f"  Saved file size: {file_size:.1f} KB")
             
         print(f"  Successfully converted and saved to '{output_path}'")
-        return True
+        return output_path
 
-    except FileNotFoundError:
-        print(f"  Error: PSD file not found at '{psd_path}'")
-    except UnidentifiedImageError:
-        print(f"  Error: Cannot identify image file. '{psd_path}' might be corrupted or not a valid PSD.")
     except Exception as e:
-        print(f"  Error converting '{os.path.basename(psd_path)}': {e}")
+        report_error(psd_path, e)
+
+    # Don't leave a placeholder or partial file behind for a failed conversion
+    for path in (temp_path, reserved_path):
+        if path and os.path.exists(path):
+            os.remove(path)
     return False
 
+def _prepare_for_format(image, output_settings):
+    """Handles transparency and color modes for the output format. Returns a new image if converted."""
+    format_lower = output_settings.format.lower()
+    if output_settings.color_management and format_lower != 'tiff':
+        converted = convert_to_srgb(image, output_settings.rendering_intent)
+        if converted is not image and output_settings.detailed_output:
+            print(f"  Converted embedded color profile to sRGB ({output_settings.rendering_intent} intent)")
+        image = converted
+
+    if format_lower in ['png', 'webp']:
+        if image.mode == 'PA' or (image.mode == 'P' and 'transparency' in image.info):
+            image = image.convert("RGBA")
+            if output_settings.detailed_output:
+                print("  Converted palette image with transparency to RGBA")
+        elif image.mode == 'CMYK':
+            # Neither format stores CMYK
+            image = image.convert('RGB')
+            if output_settings.detailed_output:
+                print("  Converted CMYK to RGB")
+        elif format_lower == 'webp':
+            image = to_8bit(image)
+
+    elif format_lower in ['jpg', 'jpeg', 'bmp']:
+        # Neither format stores alpha; Pillow's BMP writer would silently drop it
+        if has_alpha(image):
+            image = flatten_alpha(image, output_settings.matte_color)
+            if output_settings.detailed_output:
+                print(f"  Flattened transparency onto matte color {parse_matte_color(output_settings.matte_color)}")
+        else:
+            image = to_8bit(image)
+
+        writable_modes = ('L', 'RGB') if format_lower in ['jpg', 'jpeg'] else ('1', 'L', 'P', 'RGB')
+        if image.mode not in writable_modes:
+            if output_settings.detailed_output:
+                print(f"  Converted {image.mode} to RGB")
+            image = image.convert('RGB')
+    return image
+
+def _get_profile_kwargs(image, output_settings):
+    """
+    Get the color profile save parameter for a prepared image. Color managed RGB
+    output is sRGB, so it gets the sRGB profile or none instead of the source profile.
+    """
+    format_lower = output_settings.format.lower()
+    if not output_settings.color_management or format_lower not in ['png', 'jpg', 'jpeg', 'webp']:
+        return {}
+    if image.mode not in ('RGB', 'RGBA', 'P', 'PA'):
+        # Grayscale keeps its own profile where the format embeds it
+        return {}
+    return {'icc_profile': get_srgb_profile_bytes() if output_settings.embed_profile else None}
+
+def get_effort(output_settings, format_name=None):
+    """
+    Returns the effort tier a format is encoded with: the one chosen in the output
+    settings or, without one, the default tier for the format (see DEFAULT_EFFORTS).
+    format_name defaults to the output format; formats without tiers get 'balanced'.
+    """
+    if output_settings.effort is None:
+        format_name = format_name or output_settings.format.lower()
+        format_name = 'jpeg' if format_name == 'jpg' else format_name
+        return DEFAULT_EFFORTS[bool(output_settings.optimize)].get(format_name, 'balanced')
+    if output_settings.effort not in ENCODER_EFFORTS:
+        raise ValueError(f"Unsupported encoder effort '{output_settings.effort}'")
+    return output_settings.effort
+
+def _get_effort_params(format_name, output_settings):
+    """Get the encoder parameters of the output settings' effort tier for a format."""
+    return ENCODER_EFFORT_PARAMS[format_name][get_effort(output_settings, format_name)]
+
 def _get_save_kwargs(output_settings):
     """Get the appropriate save parameters based on output format."""
     format_lower = output_settings.format.lower()
@@ -110,18 +584,18 @@ def _get_save_kwargs(output_settings):
             'format': 'WEBP',
             'quality': output_settings.quality,
             'lossless': output_settings.lossless,
-            'optimize': output_settings.optimize
+            **_get_effort_params('webp', output_settings)
         }
     elif format_lower in ['jpg', 'jpeg']:
         return {
             'format': 'JPEG',
             'quality': output_settings.quality,
-            'optimize': output_settings.optimize
+            **_get_effort_params('jpeg', output_settings)
         }
     elif format_lower == 'png':
         return {
             'format': 'PNG',
-            'optimize': output_settings.optimize
+            **_get_effort_params('png', output_settings)
         }
     elif format_lower == 'bmp':
         return {
@@ -130,7 +604,7 @@ def _get_save_kwargs(output_settings):
     elif format_lower == 'tiff':
         return {
             'format': 'TIFF',
-            'compression': 'tiff_lzw' if output_settings.optimize else None
+            **_get_effort_params('tiff', output_settings)
         }
     else:
         raise ValueError(f"Unsupported output format '{output_settings.format}'") 
\ No newline at end of file
@@ -0,0 +1,208 @@
+"""Detection of byte-identical source files, so each content is converted only once."""
+
+import errno
+import hashlib
+import os
+import shutil
+import sys
+
+# Add the src directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.cache import file_content_hash
+from core.converter import report_error
+from core.naming import allocate_directory, create_temp_path, get_output_name_allocator
+from core.result import ConversionResult
+from utils.metadata import get_file_creation_date_str
+
+# Ways the outputs of a duplicate are created from the outputs of its original
+DEDUP_MODES = ('hardlink', 'reflink', 'copy')
+
+# Bytes hashed from each end of a file before hashing it whole. The start holds the
+# PSD header and image resources (including XMP document IDs), so most different
+# files of equal size are told apart without reading their image data.
+PARTIAL_HASH_BYTES = 64 * 1024
+
+# ioctl request cloning a file's extents on Linux (Btrfs, XFS and others)
+_FICLONE = 0x40049409
+
+def partial_hash(path, size):
+    """Returns a SHA-256 digest of the first and last PARTIAL_HASH_BYTES of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        digest.update(f.read(PARTIAL_HASH_BYTES))
+        if size > PARTIAL_HASH_BYTES * 2:
+            f.seek(-PARTIAL_HASH_BYTES, os.SEEK_END)
+            digest.update(f.read(PARTIAL_HASH_BYTES))
+        elif size > PARTIAL_HASH_BYTES:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def _reflink(source_path, target_path):
+    import fcntl
+    with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+        fcntl.ioctl(target.fileno(), _FICLONE, source.fileno())
+
+def link_file(source_path, target_path, mode):
+    """
+    Creates target_path with the contents of source_path as a hardlink, reflink or copy,
+    replacing any existing file. Hardlinks and reflinks fall back to a copy where the
+    file system doesn't support them. Returns the mode actually used.
+    """
+    # Named like every other temporary output, so remove_temp_files finds any left behind
+    temp_path = create_temp_path(os.path.dirname(target_path) or '.')
+    try:
+        if mode == 'hardlink':
+            # A link can't replace the empty placeholder; its name is unique either way
+            os.remove(temp_path)
+            try:
+                os.link(source_path, temp_path)
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                    raise
+                mode = 'copy'
+        elif mode == 'reflink':
+            try:
+                _reflink(source_path, temp_path)
+            except (OSError, ImportError):
+                mode = 'copy'
+        if mode == 'copy':
+            shutil.copyfile(source_path, temp_path)
+        # Replacing in one step leaves no partial file behind and breaks any earlier link
+        os.replace(temp_path, target_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return mode
+
+class Deduplicator:
+    """
+    Class to find files in a batch with the same content as an earlier one.
+    Candidates are narrowed by file size, then a partial hash, then a full hash;
+    hashes are only computed once two files share a size, so unique files cost a
+    single stat. Work items of duplicates are held back and, once the first copy
+    is converted, its outputs are linked or copied for them (see materialize).
+    """
+    def __init__(self, mode='hardlink'):
+        if mode not in DEDUP_MODES:
+            raise ValueError(f"Unsupported dedup mode '{mode}'")
+        self.mode = mode
+        self._by_size = {}  # size -> paths of distinct contents
+        self._partial_hashes = {}
+        self._full_hashes = {}
+        self._waiting = {}  # original path -> [(duplicate path, previous output paths)]
+        self._results = {}  # original path -> ConversionResult
+
+    def _partial_hash(self, path, size):
+        if path not in self._partial_hashes:
+            self._partial_hashes[path] = partial_hash(path, size)
+        return self._partial_hashes[path]
+
+    def _full_hash(self, path):
+        if path not in self._full_hashes:
+            self._full_hashes[path] = file_content_hash(path)
+        return self._full_hashes[path]
+
+    def find_original(self, psd_path):
+        """Returns an earlier file of the batch with the same content, or None after registering this one."""
+        size = os.path.getsize(psd_path)
+        candidates = self._by_size.setdefault(size, [])
+        for candidate in candidates:
+            if self._partial_hash(candidate, size) != self._partial_hash(psd_path, size):
+                continue
+            if self._full_hash(candidate) == self._full_hash(psd_path):
+                return candidate
+        candidates.append(psd_path)
+        return None
+
+    def filter_work(self, work, output_dir, recipe):
+        """
+        Passes work items (see core.batch) through, holding back duplicates of earlier files.
+        A duplicate of a file that is already converted is materialized right away.
+        """
+        for item in work:
+            if isinstance(item, ConversionResult):
+                yield item
+                continue
+            psd_path, previous_outputs = item
+            try:
+                original = self.find_original(psd_path)
+            except OSError:
+                # Let the converter report unreadable files
+                original = None
+            if original is None:
+                yield item
+            elif original in self._results:
+                yield self.materialize(self._results[original], psd_path, previous_outputs, output_dir, recipe)
+            else:
+                self._waiting.setdefault(original, []).append((psd_path, previous_outputs))
+
+    def resolve(self, result, output_dir, recipe):
+        """Returns results for the duplicates held back for a converted file."""
+        if result.skipped:
+            return []
+        self._results[result.psd_path] = result
+        return [self.materialize(result, psd_path, previous_outputs, output_dir, recipe)
+                for psd_path, previous_outputs in self._waiting.pop(result.psd_path, [])]
+
+    def drain(self):
+        """
+        Returns skipped results for the duplicates still held back once the batch stops,
+        whose original was never converted because the batch was cancelled.
+        """
+        results = [ConversionResult(psd_path, False, f"Not converted: the batch was cancelled before "
+                                                     f"'{os.path.basename(original)}', which it duplicates",
+                                    skipped=True)
+                   for original, duplicates in self._waiting.items() for psd_path, _ in duplicates]
+        self._waiting.clear()
+        return results
+
+    def materialize(self, original, psd_path, previous_outputs, output_dir, recipe):
+        """
+        Creates the outputs of a duplicate from the outputs of its original's ConversionResult.
+        Outputs are named after the duplicate, as converting it would have, or replace
+        its previous outputs in place. Returns the duplicate's ConversionResult.
+        """
+        if not original.success:
+            return ConversionResult(psd_path, False, f"Duplicate of '{original.psd_path}', which failed to convert")
+        filename_base = None
+        output_paths = []
+        # A name allocated for the output being created, removed again if creating it fails
+        allocated = None
+        try:
+            for index, output_settings in enumerate(recipe):
+                source = original.output_paths[index] if index < len(original.output_paths) else None
+                if not source:
+                    output_paths.append(None)
+                    continue
+                target = previous_outputs[index] if previous_outputs else None
+                if target is None:
+                    if filename_base is None:
+                        filename_base = get_file_creation_date_str(psd_path)
+                    name = f"{filename_base}{output_settings.name_suffix}"
+                    if os.path.isdir(source):
+                        target = allocate_directory(output_dir, name)
+                    else:
+                        extension = os.path.splitext(source)[1][1:]
+                        target = get_output_name_allocator(output_dir).allocate(name, extension)
+                    allocated = target
+
+                mode = self.mode
+                if os.path.isdir(source):
+                    os.makedirs(target, exist_ok=True)
+                    for entry in os.scandir(source):
+                        mode = link_file(entry.path, os.path.join(target, entry.name), self.mode)
+                else:
+                    mode = link_file(source, target, self.mode)
+                print(f"  '{os.path.basename(psd_path)}' is a duplicate; created '{target}' as a {mode}")
+                output_paths.append(target)
+                allocated = None
+        except Exception as e:
+            report_error(psd_path, e)
+            # Don't leave a placeholder or partly linked directory behind under a name of its own
+            if allocated and os.path.isdir(allocated):
+                shutil.rmtree(allocated, ignore_errors=True)
+            elif allocated and os.path.exists(allocated):
+                os.remove(allocated)
+            return ConversionResult(psd_path, False, str(e), output_paths=output_paths)
+        return ConversionResult(psd_path, all(output_paths), output_paths=output_paths)
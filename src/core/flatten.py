@@ -0,0 +1,61 @@
+"""Flattening of transparent and high bit depth images for formats without alpha."""
+
+from PIL import Image, ImageColor
+
+DEFAULT_MATTE_COLOR = (255, 255, 255)
+
+# Modes Pillow blends onto an 'RGB' or 'L' image directly, using their own alpha band as the mask
+_BLENDABLE_MODES = ('RGBA', 'LA')
+
+# Modes with an alpha band
+_ALPHA_MODES = ('RGBA', 'LA', 'PA', 'RGBa', 'La')
+
+# 16-bit grayscale modes, which Pillow can only scale down after widening to 'I'
+_WIDE_GRAYSCALE_MODES = ('I;16B', 'I;16L', 'I;16N')
+
+def parse_matte_color(value):
+    """Returns an (r, g, b) tuple for a color name, '#rrggbb' string or sequence of three values."""
+    if isinstance(value, str):
+        return ImageColor.getrgb(value)[:3]
+    return tuple(value)[:3]
+
+def has_alpha(image):
+    """Returns whether the image has an alpha band, palette transparency or a transparent color key."""
+    return image.mode in _ALPHA_MODES or 'transparency' in image.info
+
+def to_8bit(image):
+    """
+    Scales 16-bit grayscale images, such as the rows the streaming reader decodes from
+    16-bit PSDs, down to 8-bit 'L'. An 'I' image is taken to hold 16-bit values too.
+    Other images are returned unchanged.
+    """
+    if image.mode in _WIDE_GRAYSCALE_MODES:
+        image = image.convert('I')
+    if image.mode in ('I;16', 'I'):
+        # point() keeps integer modes, so the scaled values (outside 0-255 only if the
+        # image holds more than 16 bits) are clamped when narrowing to 'L' afterwards
+        return image.point(lambda value: value / 256).convert('L')
+    return image
+
+def flatten_alpha(image, matte_color=DEFAULT_MATTE_COLOR):
+    """
+    Composites an image with transparency onto a solid matte color.
+    The image is blended through its own alpha band in a single paste, without
+    splitting it into separate band images. Grayscale images on a gray matte stay
+    grayscale ('L'); everything else becomes 'RGB'. Images without transparency are
+    returned unchanged.
+    """
+    image = to_8bit(image)
+    if not has_alpha(image):
+        return image
+    if image.mode not in _BLENDABLE_MODES:
+        # Palette transparency, color keys and premultiplied alpha become a plain alpha band
+        image = image.convert('LA' if image.mode == 'La' else 'RGBA')
+
+    red, green, blue = parse_matte_color(matte_color)
+    if image.mode == 'LA' and red == green == blue:
+        background = Image.new('L', image.size, red)
+    else:
+        background = Image.new('RGB', image.size, (red, green, blue))
+    background.paste(image, mask=image)
+    return background
@@ -0,0 +1,144 @@
+"""Write-ahead journal of a batch, so an interrupted batch can be resumed."""
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+# Add the src directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.cache import settings_fingerprint
+from core.converter import as_recipe
+from core.naming import remove_temp_files
+
+JOURNAL_FILENAME = ".psd_converter_journal.sqlite"
+
+# Per-file states
+PENDING = 'pending'
+IN_PROGRESS = 'in_progress'
+DONE = 'done'
+FAILED = 'failed'
+
+# Number of skipped files recorded between commits; every other change is committed at once
+_COMMIT_INTERVAL = 100
+
+class JournalEntry:
+    """Class to hold the journaled state of one file."""
+    def __init__(self, state, attempts, error, output_paths):
+        self.state = state
+        self.attempts = attempts
+        self.error = error
+        self.output_paths = output_paths
+
+class BatchJournal:
+    """
+    SQLite journal stored in the output directory. Records the batch plan (every file
+    in the order it was found) and the state of each file: pending, in progress, done
+    or failed with its error and number of attempts. A file is marked in progress
+    before it is handed to a worker, so after a crash the journal shows which files
+    never finished.
+    A new batch starts the journal over; with resume, the files of the previous batch
+    keep their state (see core.batch for how resumed files are handled). Resuming with
+    different output settings starts over too.
+    """
+    def __init__(self, output_dir, output_settings, resume=False):
+        self.path = os.path.join(output_dir, JOURNAL_FILENAME)
+        fingerprints = [settings_fingerprint(variant) for variant in as_recipe(output_settings)]
+        self.settings_hash = hashlib.sha256(json.dumps(fingerprints).encode('utf-8')).hexdigest()
+        self._pending = 0
+
+        os.makedirs(output_dir, exist_ok=True)
+        self._connection = sqlite3.connect(self.path)
+        # The write-ahead log makes the commit per state change cheap
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS batch (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " position INTEGER PRIMARY KEY,"
+            " source_path TEXT NOT NULL UNIQUE,"
+            " state TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " error TEXT,"
+            " output_paths TEXT,"
+            " updated REAL NOT NULL)")
+
+        row = self._connection.execute("SELECT value FROM batch WHERE key = 'settings_hash'").fetchone()
+        if resume and row is not None and row[0] != self.settings_hash:
+            print("  The journaled batch used different output settings; starting over")
+            resume = False
+        self.resume = resume
+        if resume:
+            removed = remove_temp_files(output_dir)
+            if removed:
+                print(f"  Removed {removed} partial output file(s) of the interrupted batch")
+        else:
+            self._connection.execute("DELETE FROM files")
+            self._connection.execute("INSERT OR REPLACE INTO batch VALUES ('settings_hash', ?)", (self.settings_hash,))
+            self._connection.execute("INSERT OR REPLACE INTO batch VALUES ('started', ?)", (str(time.time()),))
+        self._connection.commit()
+
+    def plan(self, psd_path):
+        """
+        Adds a file to the batch plan as pending. Returns the JournalEntry of a file
+        the resumed batch already knows, or None for a new one.
+        """
+        source_path = os.path.abspath(psd_path)
+        row = self._connection.execute(
+            "SELECT state, attempts, error, output_paths FROM files WHERE source_path = ?",
+            (source_path,)).fetchone()
+        if row is not None:
+            state, attempts, error, output_paths = row
+            return JournalEntry(state, attempts, error, json.loads(output_paths) if output_paths else [])
+        self._connection.execute(
+            "INSERT INTO files (source_path, state, updated) VALUES (?, ?, ?)",
+            (source_path, PENDING, time.time()))
+        return None
+
+    def start(self, psd_path):
+        """Marks a file as in progress and counts the attempt, before it is converted."""
+        self._connection.execute(
+            "UPDATE files SET state = ?, attempts = attempts + 1, updated = ? WHERE source_path = ?",
+            (IN_PROGRESS, time.time(), os.path.abspath(psd_path)))
+        self.commit()
+
+    def finish(self, result):
+        """Records the outcome of a file from its ConversionResult."""
+        self._connection.execute(
+            "UPDATE files SET state = ?, error = ?, output_paths = ?, updated = ? WHERE source_path = ?",
+            (DONE if result.success else FAILED, result.error, json.dumps(result.output_paths), time.time(),
+             os.path.abspath(result.psd_path)))
+        if result.skipped and result.success:
+            self._pending += 1
+            if self._pending < _COMMIT_INTERVAL:
+                return
+        self.commit()
+
+    def counts(self):
+        """Returns the number of files per state."""
+        return dict(self._connection.execute("SELECT state, COUNT(*) FROM files GROUP BY state").fetchall())
+
+    def failures(self):
+        """Returns (source path, attempts, error) of every failed file, in plan order."""
+        return self._connection.execute(
+            "SELECT source_path, attempts, error FROM files WHERE state = ? ORDER BY position",
+            (FAILED,)).fetchall()
+
+    def commit(self):
+        self._connection.commit()
+        self._pending = 0
+
+    def close(self):
+        """Commits outstanding changes and closes the database."""
+        self._connection.commit()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,72 @@
+"""Rendering of top-level layers and groups with psd-tools, for per-layer export."""
+
+import fnmatch
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+ICC_PROFILE_RESOURCE_ID = 1039
+
+# Threads rendering the layers of one file. Most compositing time is spent in
+# numpy, which releases the GIL, so layers render in parallel inside a worker process.
+LAYER_RENDER_WORKERS = 4
+
+# Characters that aren't safe in file names on every platform
+_UNSAFE_NAME_RE = re.compile(r'[^\w\-. ]+')
+
+def open_layered_psd(psd_path, source=None):
+    """
+    Parses a PSD file with psd-tools, from source (a file object) when given.
+    psd-tools is imported here because it takes a noticeable time to import and
+    is only needed for layer export.
+    """
+    from psd_tools import PSDImage
+    if source is not None:
+        return PSDImage.open(source)
+    return PSDImage.open(psd_path)
+
+def _is_empty(layer):
+    left, top, right, bottom = layer.bbox
+    return right <= left or bottom <= top
+
+def select_layers(psd, layer_names=None):
+    """
+    Returns (index, layer) for the top-level layers and groups to export, in document order.
+    layer_names is an optional list of name patterns (e.g. 'icon_*'); None selects every layer.
+    Hidden layers and layers without pixels are left out, so they are never composited.
+    """
+    selected = []
+    for index, layer in enumerate(psd):
+        if not layer.is_visible() or _is_empty(layer):
+            continue
+        if layer_names and not any(fnmatch.fnmatchcase(layer.name, pattern) for pattern in layer_names):
+            continue
+        selected.append((index, layer))
+    return selected
+
+def render_layers(psd, layers, max_workers=LAYER_RENDER_WORKERS):
+    """
+    Composites layers (a dict of index -> layer from one parsed PSD) cropped to their
+    bounding boxes, rendering independent layers on a thread pool. Returns a dict of
+    index -> image, with None for layers that render no pixels. The document's color
+    profile is attached to every image so it is color managed like the composite.
+    """
+    icc_profile = None
+    if ICC_PROFILE_RESOURCE_ID in psd.image_resources:
+        icc_profile = psd.image_resources.get_data(ICC_PROFILE_RESOURCE_ID)
+
+    def render(layer):
+        image = layer.composite()
+        if image is not None and icc_profile:
+            image.info['icc_profile'] = icc_profile
+        return image
+
+    indexes = list(layers)
+    if len(indexes) <= 1 or max_workers <= 1:
+        return {index: render(layers[index]) for index in indexes}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(indexes))) as executor:
+        return dict(zip(indexes, executor.map(render, [layers[index] for index in indexes])))
+
+def get_layer_filename_base(index, layer):
+    """Returns the output name of a layer: its position, to keep names unique and ordered, and its name."""
+    name = _UNSAFE_NAME_RE.sub('_', layer.name).strip(' .')
+    return f"{index:02d}_{name}" if name else f"{index:02d}_layer"
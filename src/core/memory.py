@@ -0,0 +1,111 @@
+"""Decoded-size estimates and memory-budgeted admission of batch work."""
+
+import os
+import sys
+from collections import deque
+
+# Add the src directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.converter import get_output_size
+from core.streaming import estimate_streaming_bytes, get_streamed_indexes
+from utils.metadata import read_psd_header
+
+def estimate_memory_bytes(psd_path, recipe):
+    """
+    Estimates the peak memory needed to convert a file from its PSD header alone.
+    Counts the decoded composite twice (Pillow decodes channel planes before merging
+    them) plus a resized buffer and a format conversion buffer per recipe variant.
+    Variants converted in strips (see core.streaming) only count their strip buffers.
+    Returns 0 if the header can't be read; the converter reports such files.
+    """
+    try:
+        header = read_psd_header(psd_path)
+    except (OSError, ValueError):
+        return 0
+
+    streamed_indexes = get_streamed_indexes(header, recipe)
+    if streamed_indexes:
+        streamed = estimate_streaming_bytes(header, [recipe[index] for index in streamed_indexes])
+        if len(streamed_indexes) == len(recipe):
+            return streamed
+        recipe = [output_settings for index, output_settings in enumerate(recipe) if index not in streamed_indexes]
+    else:
+        streamed = 0
+
+    # Pillow stores multi-channel 8-bit images at 4 bytes per pixel
+    bytes_per_pixel = (1 if header.channels == 1 else 4) * max(1, header.depth // 8)
+    composite = header.width * header.height * bytes_per_pixel
+
+    variants = 0
+    for output_settings in recipe:
+        width, height = get_output_size((header.width, header.height), output_settings)
+        variants += width * height * 4 * 2
+    return max(streamed, composite * 2 + variants)
+
+class MemoryScheduler:
+    """
+    Admits queued work items while their estimated footprint fits a memory budget.
+    Items larger than the whole budget run alone. Smaller items may overtake a
+    queued item that doesn't fit yet, but only a limited number of times so it
+    isn't starved.
+    """
+    def __init__(self, budget_bytes=None, max_running=1):
+        self.budget_bytes = budget_bytes
+        self.max_running = max_running
+        self.running = 0
+        self.running_bytes = 0
+        self._pending = deque()
+        self._overtaken = 0
+
+    @property
+    def pending_count(self):
+        return len(self._pending)
+
+    def add(self, item, cost):
+        self._pending.append((item, cost))
+
+    def clear(self):
+        """Drops all items that haven't been admitted yet."""
+        self._pending.clear()
+        self._overtaken = 0
+
+    def _fits(self, cost):
+        if self.running >= self.max_running:
+            return False
+        if self.budget_bytes is None or self.running == 0:
+            return True
+        return self.running_bytes + cost <= self.budget_bytes
+
+    def pop_admissible(self):
+        """Returns the next (item, cost) that fits the budget, or None."""
+        if not self._pending:
+            return None
+
+        head_item, head_cost = self._pending[0]
+        if self._fits(head_cost):
+            self._pending.popleft()
+            self._overtaken = 0
+            return self._admit(head_item, head_cost)
+
+        oversized = self.budget_bytes is not None and head_cost > self.budget_bytes
+        if oversized or self._overtaken >= self.max_running:
+            # Let running items drain so the head item can start
+            return None
+        for index in range(1, len(self._pending)):
+            item, cost = self._pending[index]
+            if self._fits(cost):
+                del self._pending[index]
+                self._overtaken += 1
+                return self._admit(item, cost)
+        return None
+
+    def _admit(self, item, cost):
+        self.running += 1
+        self.running_bytes += cost
+        return item, cost
+
+    def release(self, cost):
+        """Marks an admitted item as finished."""
+        self.running -= 1
+        self.running_bytes -= cost
@@ -0,0 +1,118 @@
+"""Allocation of unique output file names."""
+
+import os
+import secrets
+import threading
+
+# Outputs are written under a temporary name like '.psd_converter_1234_9f86d081.tmp' and
+# renamed into place once complete, so a crash never leaves a truncated output
+TEMP_PREFIX = '.psd_converter_'
+TEMP_SUFFIX = '.tmp'
+
+_allocators = {}
+_allocators_lock = threading.Lock()
+
+def create_temp_path(directory):
+    """Creates an empty, uniquely named temporary file in directory. Returns its path."""
+    while True:
+        path = os.path.join(directory, f"{TEMP_PREFIX}{os.getpid()}_{secrets.token_hex(4)}{TEMP_SUFFIX}")
+        # Unlike tempfile.mkstemp (0600), the umask applies, as for any other output file
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+        except FileExistsError:
+            continue
+        os.close(fd)
+        return path
+
+def remove_temp_files(directory):
+    """
+    Removes temporary files left in directory and its subfolders by conversions that
+    were interrupted. Only call this while no other batch writes to the directory.
+    Returns the number of files removed.
+    """
+    removed = 0
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.startswith(TEMP_PREFIX) and filename.endswith(TEMP_SUFFIX):
+                try:
+                    os.remove(os.path.join(root, filename))
+                    removed += 1
+                except OSError:
+                    pass
+    return removed
+
+def reserve_path(path):
+    """Atomically creates an empty placeholder file. Returns False if the path is taken."""
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    os.close(fd)
+    return True
+
+def allocate_directory(parent_dir, name):
+    """Creates the directory '<name>', or '<name>_<n>' if that is taken, in parent_dir. Returns its path."""
+    counter = 0
+    while True:
+        dirname = name if counter == 0 else f"{name}_{counter}"
+        path = os.path.join(parent_dir, dirname)
+        try:
+            os.mkdir(path)
+            return path
+        except FileExistsError:
+            counter += 1
+
+class OutputNameAllocator:
+    """
+    Hands out unique file names in one output directory.
+    The directory is listed once; after that, taken names and the next counter
+    for each base name are tracked in memory, so allocating a name costs a
+    single exclusive create instead of an os.path.exists probe per candidate.
+    The exclusive create also keeps other processes writing to the same
+    directory from ever receiving the same name.
+    """
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+        self._taken = None
+        self._next_counter = {}
+
+    def allocate(self, filename_base, extension):
+        """
+        Reserves '<base>.<ext>', or '<base>_<n>.<ext>' if that is taken, by creating
+        an empty placeholder file. Returns the reserved path.
+        """
+        with self._lock:
+            if self._taken is None:
+                self._taken = set(os.listdir(self.output_dir))
+
+            key = (filename_base, extension)
+            counter = self._next_counter.get(key, 0)
+            while True:
+                if counter == 0:
+                    filename = f"{filename_base}.{extension}"
+                else:
+                    filename = f"{filename_base}_{counter}.{extension}"
+                counter += 1
+                if filename in self._taken:
+                    continue
+                # Another process may have created the name since the listing
+                self._taken.add(filename)
+                path = os.path.join(self.output_dir, filename)
+                if reserve_path(path):
+                    self._next_counter[key] = counter
+                    return path
+
+def get_output_name_allocator(output_dir):
+    """Returns the allocator shared by all conversions in this process for the directory."""
+    key = os.path.abspath(output_dir)
+    with _allocators_lock:
+        allocator = _allocators.get(key)
+        if allocator is None:
+            allocator = _allocators[key] = OutputNameAllocator(output_dir)
+        return allocator
+
+def reset_output_name_allocators():
+    """Forgets all directory listings, e.g. before a new batch picks up external changes."""
+    with _allocators_lock:
+        _allocators.clear()
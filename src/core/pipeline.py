@@ -0,0 +1,235 @@
+"""Pipelined batch conversion that overlaps reading, conversion and writing."""
+
+import os
+import sys
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Add the src directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.converter import (collect_errors, convert_psd_to_encoded, convert_psd_to_images, format_errors,
+                            report_error, write_encoded_variant)
+from core.memory import MemoryScheduler, estimate_memory_bytes
+from core.result import ConversionResult
+from core.streaming import get_streamed_variants
+from utils.metrics import NULL_METRICS, FileMetrics
+
+def _read_file(psd_path, recipe, collect_metrics=False):
+    """
+    Reader stage: reads a whole PSD file into memory. Returns (data, stages).
+    data is None for files converted in strips (see core.streaming), which are
+    read strip by strip in the compute stage instead of whole.
+    """
+    if get_streamed_variants(psd_path, recipe):
+        return None, []
+    metrics = FileMetrics() if collect_metrics else NULL_METRICS
+    with metrics.stage('read') as stage:
+        with open(psd_path, 'rb') as f:
+            data = f.read()
+        stage.count(bytes_read=len(data))
+    return data, metrics.stages
+
+def _compute_one(psd_path, data, recipe, collect_metrics=False):
+    """
+    Compute stage entry point: decodes a read file and encodes every recipe variant in memory.
+    Returns (filename_base, encoded, stages, errors).
+    """
+    metrics = FileMetrics() if collect_metrics else NULL_METRICS
+    with collect_errors() as errors, metrics.stage('total'):
+        filename_base, encoded = convert_psd_to_encoded(psd_path, data, recipe, metrics=metrics)
+    return filename_base, encoded, metrics.stages, errors
+
+def _convert_from_disk(psd_path, output_dir, recipe, output_paths, collect_metrics=False):
+    """
+    Compute stage entry point for files converted in strips: converts and writes them.
+    Returns (results, stages, errors).
+    """
+    metrics = FileMetrics() if collect_metrics else NULL_METRICS
+    with collect_errors() as errors, metrics.stage('total'):
+        results = convert_psd_to_images(psd_path, output_dir, recipe, output_paths=output_paths, metrics=metrics)
+    return results, metrics.stages, errors
+
+def _write_outputs(psd_path, output_dir, recipe, filename_base, encoded, output_paths, collect_metrics=False):
+    """Writer stage: writes the encoded variants of a file. Returns (results, stages, errors)."""
+    metrics = FileMetrics() if collect_metrics else NULL_METRICS
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    with collect_errors() as errors:
+        for index, data in enumerate(encoded):
+            if data is None:
+                results.append(False)
+                continue
+            output_path = output_paths[index] if output_paths else None
+            results.append(write_encoded_variant(data, psd_path, output_dir, recipe[index], filename_base,
+                                                 output_path, metrics))
+    return results, metrics.stages, errors
+
+def _finished(psd_path, results, stages, errors):
+    """Returns the ConversionResult of a file from its per-variant results."""
+    output_paths = [output_path or None for output_path in results]
+    success = all(results)
+    return ConversionResult(psd_path, success, None if success else format_errors(errors) or "Conversion failed",
+                            output_paths=output_paths, metrics=stages)
+
+class PipelineRun:
+    """
+    Class to hold the files moving through a pipelined batch.
+    A reader thread reads up to `prefetch` files ahead into memory, the compute
+    executor decodes, scales and encodes them, and a writer thread writes the
+    encoded bytes. Each hand-off is bounded, so at most about prefetch files,
+    one file per compute worker and write_depth encoded files are held in memory.
+    Files converted in strips (see core.streaming) skip the reader and writer; their
+    compute worker reads and writes them itself.
+    """
+    def __init__(self, compute_executor, output_dir, recipe, scheduler, control=None, collect_metrics=False,
+                 prefetch=2, write_depth=2):
+        self.compute_executor = compute_executor
+        self.output_dir = output_dir
+        self.recipe = recipe
+        self.scheduler = scheduler
+        self.control = control
+        self.collect_metrics = collect_metrics
+        self.prefetch = max(1, prefetch)
+        self.write_depth = max(1, write_depth)
+        self._reader = ThreadPoolExecutor(max_workers=1)
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._reads = deque()  # ((psd_path, output_paths), cost, future), in file order
+        self._computes = {}  # future -> ((psd_path, output_paths), cost, stages)
+        self._writes = {}  # future -> ((psd_path, output_paths), stages, errors of the compute stage)
+        self._direct = {}  # future -> ((psd_path, output_paths), cost, stages) for files converted in strips
+
+    @property
+    def busy(self):
+        """Whether any file is being read, converted or written."""
+        return bool(self._reads or self._computes or self._writes or self._direct)
+
+    def _stopped(self):
+        return self.control is not None and (self.control.is_paused or self.control.is_cancelled)
+
+    def can_read(self):
+        """Whether another file may be read ahead."""
+        return not self._stopped() and len(self._reads) + self.scheduler.pending_count < self.prefetch
+
+    def read(self, item):
+        """Starts reading a (psd_path, output_paths) work item."""
+        cost = estimate_memory_bytes(item[0], self.recipe) if self.scheduler.budget_bytes else 0
+        future = self._reader.submit(_read_file, item[0], self.recipe, self.collect_metrics)
+        self._reads.append((item, cost, future))
+
+    def advance(self):
+        """Moves finished files to their next stage and yields results of fully written files."""
+        # Read files queue for compute in file order
+        while self._reads and self._reads[0][2].done():
+            item, cost, future = self._reads.popleft()
+            try:
+                data, stages = future.result()
+            except Exception as e:
+                report_error(item[0], e)
+                yield ConversionResult(item[0], False, str(e))
+                continue
+            self.scheduler.add((item, data, stages), cost)
+
+        for future in [future for future in self._computes if future.done()]:
+            item, cost, stages = self._computes.pop(future)
+            self.scheduler.release(cost)
+            try:
+                filename_base, encoded, compute_stages, compute_errors = future.result()
+            except Exception as e:
+                # The worker process itself died (e.g. out of memory)
+                yield ConversionResult(item[0], False, str(e), metrics=stages)
+                continue
+            write = self._writer.submit(_write_outputs, item[0], self.output_dir, self.recipe, filename_base,
+                                        encoded, item[1], self.collect_metrics)
+            self._writes[write] = (item, stages + compute_stages, compute_errors)
+
+        for future in [future for future in self._direct if future.done()]:
+            item, cost, stages = self._direct.pop(future)
+            self.scheduler.release(cost)
+            try:
+                results, compute_stages, errors = future.result()
+            except Exception as e:
+                yield ConversionResult(item[0], False, str(e), metrics=stages)
+                continue
+            yield _finished(item[0], results, stages + compute_stages, errors)
+
+        for future in [future for future in self._writes if future.done()]:
+            item, stages, compute_errors = self._writes.pop(future)
+            try:
+                results, write_stages, write_errors = future.result()
+            except Exception as e:
+                yield ConversionResult(item[0], False, str(e), metrics=stages)
+                continue
+            yield _finished(item[0], results, stages + write_stages, compute_errors + write_errors)
+
+        # Encoded files waiting for the writer apply backpressure to compute
+        while not self._stopped() and len(self._writes) < self.write_depth:
+            entry = self.scheduler.pop_admissible()
+            if entry is None:
+                break
+            (item, data, stages), cost = entry
+            if data is None:
+                future = self.compute_executor.submit(_convert_from_disk, item[0], self.output_dir, self.recipe,
+                                                      item[1], self.collect_metrics)
+                self._direct[future] = (item, cost, stages)
+                continue
+            future = self.compute_executor.submit(_compute_one, item[0], data, self.recipe, self.collect_metrics)
+            self._computes[future] = (item, cost, stages)
+
+    def wait(self, timeout=None):
+        """Blocks until a read, conversion or write finishes."""
+        futures = list(self._computes) + list(self._writes) + list(self._direct)
+        if self._reads:
+            futures.append(self._reads[0][2])
+        if futures:
+            wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+
+    def cancel_pending(self):
+        """Drops files that are read ahead or queued; files being converted or written finish."""
+        for _, _, future in self._reads:
+            future.cancel()
+        self._reads.clear()
+        self.scheduler.clear()
+
+    def shutdown(self):
+        self._reader.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+
+def iter_pipelined(work, output_dir, recipe, compute_executor, max_workers, control=None, memory_budget=None,
+                   collect_metrics=False, prefetch=2, write_depth=2):
+    """
+    Runs work items (see core.batch) through the read, compute and write stages.
+    compute_executor runs the decode, scale and encode steps; a process pool uses
+    every core, while a single thread still overlaps them with reading and writing.
+    Yields a ConversionResult for each file in completion order.
+    """
+    scheduler = MemoryScheduler(memory_budget, max_workers)
+    run = PipelineRun(compute_executor, output_dir, recipe, scheduler, control, collect_metrics, prefetch,
+                      write_depth)
+    work = iter(work)
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and run.can_read():
+                item = next(work, None)
+                if item is None:
+                    exhausted = True
+                elif isinstance(item, ConversionResult):
+                    yield item
+                else:
+                    run.read(item)
+
+            if control is not None and control.is_cancelled:
+                run.cancel_pending()
+                exhausted = True
+            yield from run.advance()
+
+            if run.busy:
+                # Wake up periodically so pause and cancel take effect promptly
+                run.wait(timeout=0.1 if control is not None else None)
+            elif exhausted and not scheduler.pending_count:
+                break
+            elif control is not None and control.is_paused:
+                control.wait_until_resumed(0.1)
+    finally:
+        run.shutdown()
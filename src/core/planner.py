@@ -0,0 +1,188 @@
+"""Cost model and longest-first ordering of batch work, with predicted against actual times."""
+
+import heapq
+import itertools
+import os
+import statistics
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the src directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.converter import get_effort, get_output_size
+from core.result import ConversionResult
+from utils.metadata import read_psd_header
+
+# Seconds per MB of decoded source data (width x height x channels x bytes per channel)
+DECODE_SECONDS_PER_MB = 0.0055
+
+# Seconds per output megapixel to encode, per format and effort tier
+ENCODE_SECONDS_PER_MEGAPIXEL = {
+    'png': {'fast': 0.042, 'balanced': 0.068, 'smallest': 0.085},
+    'jpg': {'fast': 0.004, 'balanced': 0.007, 'smallest': 0.016},
+    'webp': {'fast': 0.091, 'balanced': 0.256, 'smallest': 2.586},
+    'tiff': {'fast': 0.037, 'balanced': 0.071, 'smallest': 0.028},
+    'bmp': {'fast': 0.002, 'balanced': 0.002, 'smallest': 0.002},
+}
+
+# Encode rate for formats missing from the table
+DEFAULT_ENCODE_SECONDS_PER_MEGAPIXEL = 0.07
+
+_FORMAT_ALIASES = {'jpeg': 'jpg', 'tif': 'tiff'}
+
+# Fixed seconds per file: opening it, reading metadata and creating the outputs
+FILE_OVERHEAD_SECONDS = 0.01
+
+# Files held back to pick the most expensive from. Ordering only applies within this
+# window: the first file is dispatched once this many are scanned, so conversion starts
+# while the scan continues, but a large file found late in a long scan still starts only
+# about PLAN_WINDOW files before the end.
+PLAN_WINDOW = 64
+
+# Threads reading PSD headers to cost files, so slow (network) storage isn't read serially
+PLAN_THREADS = 4
+
+# Top-level metric stages that together make up a file's conversion time (see core.pipeline)
+_TIMED_STAGES = ('read', 'total', 'write')
+
+def estimate_seconds(header, recipe):
+    """Predicts the seconds needed to convert a file to every recipe variant from its PSDHeader."""
+    decoded_mb = header.width * header.height * header.channels * max(1, header.depth // 8) / 1e6
+    seconds = FILE_OVERHEAD_SECONDS + decoded_mb * DECODE_SECONDS_PER_MB
+    for output_settings in recipe:
+        width, height = get_output_size((header.width, header.height), output_settings)
+        output_format = output_settings.format.lower()
+        rates = ENCODE_SECONDS_PER_MEGAPIXEL.get(_FORMAT_ALIASES.get(output_format, output_format), {})
+        rate = rates.get(get_effort(output_settings), rates.get('balanced', DEFAULT_ENCODE_SECONDS_PER_MEGAPIXEL))
+        seconds += width * height / 1e6 * rate
+    return seconds
+
+def estimate_file_seconds(psd_path, recipe):
+    """Predicts the seconds needed to convert a file. Returns 0 if its header can't be read."""
+    try:
+        return estimate_seconds(read_psd_header(psd_path), recipe)
+    except (OSError, ValueError):
+        # Unreadable files fail quickly; the converter reports them
+        return 0.0
+
+def get_actual_seconds(result):
+    """Returns the wall time a file's conversion took, from its metrics, or None without metrics."""
+    stages = [stage for stage in result.metrics if stage['stage'] in _TIMED_STAGES]
+    if not stages:
+        return None
+    return sum(stage['wall_seconds'] for stage in stages)
+
+class BatchPlan:
+    """
+    Class to order the work of a batch by predicted cost, most expensive first, and
+    to compare the predictions with the actual conversion times afterwards.
+    Each file is costed from its header alone (see estimate_seconds), read on a small
+    thread pool. Dispatching the largest files first lets the many small ones fill in
+    around them at the end, so no worker is still busy with a large file while the
+    others sit idle. Workers take the next file from the shared queue of the process
+    pool as soon as they finish, so the order only decides what is taken first.
+    Files are ordered within a sliding window of the next `window` scanned files, not
+    across the whole batch, so conversion starts before the scan finishes.
+    With longest_first off, files keep their discovery order and are only costed.
+    """
+    def __init__(self, recipe, longest_first=True, window=PLAN_WINDOW):
+        self.recipe = recipe
+        self.longest_first = longest_first
+        self.window = max(1, window)
+        self.entries = {}  # psd_path -> [position, predicted seconds (or its future), actual seconds]
+
+    def order(self, work):
+        """
+        Passes work items (see core.batch) through in plan order; skipped results pass
+        through at once. self.window files are held back, and each file scanned past
+        them dispatches the most expensive one held; the rest follow most expensive
+        first once the scan ends.
+        """
+        sequence = itertools.count()
+        costing = deque()  # (future, item) in discovery order
+        buffer = []  # heap of (-predicted seconds, sequence, item)
+
+        def collect(block):
+            while costing and (block or costing[0][0].done()):
+                future, item = costing.popleft()
+                heapq.heappush(buffer, (-future.result(), next(sequence), item))
+
+        def dispatch():
+            # Every held file is compared, so wait for the headers still being read
+            collect(block=True)
+            predicted, _, item = heapq.heappop(buffer)
+            self.entries[item[0]] = [len(self.entries), -predicted, None]
+            return item
+
+        executor = ThreadPoolExecutor(max_workers=PLAN_THREADS)
+        try:
+            for item in work:
+                if isinstance(item, ConversionResult):
+                    yield item
+                    continue
+                future = executor.submit(estimate_file_seconds, item[0], self.recipe)
+                if not self.longest_first:
+                    self.entries[item[0]] = [len(self.entries), future, None]
+                    yield item
+                    continue
+                costing.append((future, item))
+                collect(block=False)
+                while len(buffer) + len(costing) > self.window:
+                    yield dispatch()
+            while buffer or costing:
+                yield dispatch()
+        finally:
+            # Also when the batch stops early: drop the headers not read yet
+            for future, _ in costing:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def record(self, result):
+        """Records the actual conversion time of a planned file from its ConversionResult."""
+        entry = self.entries.get(result.psd_path)
+        if entry is not None and not result.skipped:
+            entry[2] = get_actual_seconds(result)
+
+    def report(self):
+        """Returns (psd_path, position, predicted seconds, actual seconds or None) per planned file, in plan order."""
+        for entry in self.entries.values():
+            if not isinstance(entry[1], float):
+                entry[1] = entry[1].result()
+        return sorted(((psd_path,) + tuple(entry) for psd_path, entry in self.entries.items()),
+                      key=lambda row: row[1])
+
+    def summary(self):
+        """
+        Returns totals of the predicted and actual times of the files converted so far.
+        'scale' is the factor the cost model is off by overall (multiply the rates by it
+        to calibrate); 'median_error' is the median relative error of single files.
+        """
+        timed = [(predicted, actual) for _, _, predicted, actual in self.report() if actual is not None]
+        predicted_total = sum(predicted for predicted, _ in timed)
+        actual_total = sum(actual for _, actual in timed)
+        errors = [abs(predicted - actual) / actual for predicted, actual in timed if actual > 0]
+        return {
+            'files': len(self.entries),
+            'timed_files': len(timed),
+            'predicted_seconds': round(predicted_total, 3),
+            'actual_seconds': round(actual_total, 3),
+            'scale': round(actual_total / predicted_total, 3) if predicted_total > 0 else None,
+            'median_error': round(statistics.median(errors), 3) if errors else None,
+        }
+
+    def format_summary(self, limit=5):
+        """Returns log lines with the summary and the files the model mispredicted most."""
+        summary = self.summary()
+        if not summary['timed_files']:
+            return []
+        lines = [f"  {summary['timed_files']} files: predicted {summary['predicted_seconds']:.1f}s, "
+                 f"actual {summary['actual_seconds']:.1f}s (scale {summary['scale']}, "
+                 f"median error {summary['median_error'] or 0:.0%})"]
+        rows = [row for row in self.report() if row[3] is not None]
+        rows.sort(key=lambda row: abs(row[3] - row[2]), reverse=True)
+        for psd_path, position, predicted, actual in rows[:limit]:
+            lines.append(f"  #{position + 1} {os.path.basename(psd_path)}: "
+                         f"predicted {predicted:.2f}s, actual {actual:.2f}s")
+        return lines
@@ -0,0 +1,18 @@
+"""Outcome of converting a single file in a batch."""
+
+class ConversionResult:
+    """Class to hold the outcome of converting a single PSD file."""
+    def __init__(self, psd_path, success, error=None, output_paths=None, skipped=False, metrics=None):
+        self.psd_path = psd_path
+        self.success = success
+        self.error = error
+        # One output path (or None) per recipe variant
+        self.output_paths = output_paths or []
+        self.skipped = skipped
+        # Stage timings and counters, when the batch collects metrics
+        self.metrics = metrics or []
+
+    @property
+    def output_path(self):
+        """The first output path produced for the file."""
+        return next((path for path in self.output_paths if path), None)
@@ -0,0 +1,47 @@
+"""Streaming discovery of PSD files in source files and folders."""
+
+import os
+
+# Photoshop document and large document format extensions
+PSD_EXTENSIONS = ('.psd', '.psb')
+
+def is_psd_path(path):
+    """Checks whether the path has a Photoshop document extension."""
+    return path.lower().endswith(PSD_EXTENSIONS)
+
+def iter_psd_files(source_paths):
+    """
+    Yields PSD/PSB file paths from the given files and folders as they are discovered.
+    Folders are walked recursively with os.scandir, without following directory symlinks.
+    """
+    for path in source_paths:
+        if os.path.isfile(path):
+            if is_psd_path(path):
+                yield path
+        else:
+            yield from _scan_directory(path)
+
+def _scan_directory(directory):
+    """Walks a directory tree depth-first, yielding each folder's files before its subfolders."""
+    pending = [directory]
+    while pending:
+        current = pending.pop()
+        files = []
+        subdirectories = []
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.append(entry.path)
+                        elif is_psd_path(entry.name) and entry.is_file():
+                            files.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"  Could not scan folder '{current}': {e}")
+            continue
+
+        # The directory handle is closed before handing files to the caller
+        yield from files
+        pending.extend(reversed(subdirectories))
@@ -0,0 +1,430 @@
+"""Strip-streaming conversion of large PSD/PSB composites with bounded memory."""
+
+import copy
+import math
+import os
+import struct
+import sys
+import zlib
+from array import array
+from itertools import accumulate
+
+from PIL import Image, ImageChops
+
+# Add the src directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.converter import _get_effort_params, _get_profile_kwargs, _prepare_for_format, get_effort, get_output_size
+from core.flatten import to_8bit
+from utils.metadata import PSD_HEADER_SIZE, _read_header, read_image_resources, read_psd_header
+from utils.metrics import NULL_METRICS
+
+# Files this large, and all PSB files (which Pillow can't open), are converted in
+# strips. 64 megapixels (8192x8192) stays below Pillow's decompression bomb limit,
+# where decoding the whole composite at once would still be attempted.
+STREAM_MIN_PIXELS = 64 * 1024 * 1024
+
+# Source rows decoded at once. Peak memory is about this many rows of the source
+# width per channel (plus the resampling margin), whatever the canvas height.
+STREAM_STRIP_ROWS = 512
+
+# Output formats that can be written a strip at a time
+STREAMABLE_FORMATS = ('tiff', 'png', 'bmp')
+
+ICC_PROFILE_RESOURCE_ID = 1039
+
+_COMPRESSION_RAW = 0
+_COMPRESSION_RLE = 1
+
+# PSD color mode -> Pillow mode of the color channels
+_COLOR_MODES = {1: 'L', 3: 'RGB', 4: 'CMYK'}
+
+# Radius of the LANCZOS filter in source pixels at a scale of 1
+_LANCZOS_SUPPORT = 3.0
+
+# zlib levels of the strip-compressed formats per effort tier. TIFF strips are
+# always Deflate-compressed, the only TIFF codec available without libtiff.
+_TIFF_DEFLATE_LEVELS = {'fast': 1, 'balanced': 6, 'smallest': 9}
+
+# Outputs at least this large (before compression) are written as BigTIFF
+_BIGTIFF_THRESHOLD = 2 ** 32 - 2 ** 26
+
+def is_streaming_candidate(header):
+    """
+    Returns whether the composite of a file is converted in strips, from its PSDHeader:
+    PSB files and canvases of STREAM_MIN_PIXELS or more in a color mode and bit depth
+    the strip reader supports (grayscale, RGB or CMYK at 8 or 16 bits).
+    """
+    if header.color_mode not in _COLOR_MODES or header.depth not in (8, 16):
+        return False
+    return header.version == 2 or header.width * header.height >= STREAM_MIN_PIXELS
+
+def get_streamed_indexes(header, recipe):
+    """
+    Returns the indexes of the recipe variants converted in strips, from a PSDHeader:
+    for streaming candidates, the variants in STREAMABLE_FORMATS, and for PSB files,
+    which Pillow can't open at all, every variant (others then report the error).
+    Layer exports always parse the layers with psd-tools instead.
+    """
+    if not is_streaming_candidate(header):
+        return []
+    return [index for index, output_settings in enumerate(recipe)
+            if not output_settings.export_layers
+            and (header.version == 2 or output_settings.format.lower() in STREAMABLE_FORMATS)]
+
+def get_streamed_variants(psd_path, recipe):
+    """Returns the indexes of the recipe variants of a file converted in strips; [] if its header can't be read."""
+    try:
+        header = read_psd_header(psd_path)
+    except (OSError, ValueError):
+        return []
+    return get_streamed_indexes(header, recipe)
+
+def _get_strip_rows(source_height, output_height):
+    """Returns the number of output rows produced per strip."""
+    return max(1, int(STREAM_STRIP_ROWS * output_height / source_height))
+
+def estimate_streaming_bytes(header, recipe):
+    """Estimates the peak memory of converting recipe variants in strips from a PSDHeader (see core.memory)."""
+    channels = len(_COLOR_MODES[header.color_mode]) + 1
+    # RLE row offsets are kept for every row of every channel
+    peak = header.channels * header.height * 8
+    for output_settings in recipe:
+        width, height = get_output_size((header.width, header.height), output_settings)
+        scale_y = header.height / height
+        source_rows = min(STREAM_STRIP_ROWS, header.height) + 2 * (_LANCZOS_SUPPORT * max(scale_y, 1.0) + 1)
+        # Decoded bands, the merged strip and its resized copy
+        strip = header.width * source_rows * channels * max(1, header.depth // 8) * 2
+        strip += width * _get_strip_rows(header.height, height) * 4 * 2
+        peak = max(peak, header.channels * header.height * 8 + int(strip))
+    return peak
+
+class MergedImageReader:
+    """
+    Class to read rows of the merged composite of an open PSD/PSB file, raw or RLE
+    compressed, without reading the layers. Channels are stored one after another,
+    so each strip is read with one seek per channel; for RLE data the per-row byte
+    counts give the offset of every row.
+    Like Pillow, an RGB file with exactly four channels has an alpha channel, and so
+    does a grayscale file with exactly two (which Pillow reads as opaque 'L'); other
+    extra channels (saved selections, spot colors) are ignored.
+    """
+    def __init__(self, fp):
+        self.fp = fp
+        header = _read_header(fp)
+        if header.color_mode not in _COLOR_MODES or header.depth not in (8, 16):
+            raise ValueError(f"Unsupported color mode {header.color_mode} at {header.depth} bits for streaming")
+        self.width = header.width
+        self.height = header.height
+        self.depth = header.depth
+        self.mode = _COLOR_MODES[header.color_mode]
+        if self.mode == 'RGB' and header.channels == 4:
+            self.mode = 'RGBA'
+        elif self.mode == 'L' and header.channels == 2:
+            self.mode = 'LA'
+        self.channels = len(self.mode)
+        if header.channels < self.channels:
+            raise ValueError(f"Expected {self.channels} channels, found {header.channels}")
+        self.row_bytes = self.width * self.depth // 8
+        self.bytes_read = 0
+
+        fp.seek(0)
+        self.icc_profile = read_image_resources(fp, (ICC_PROFILE_RESOURCE_ID,)).get(ICC_PROFILE_RESOURCE_ID)
+        fp.seek(PSD_HEADER_SIZE)
+        (color_mode_length,) = struct.unpack('>I', fp.read(4))
+        fp.seek(color_mode_length, os.SEEK_CUR)
+        (resources_length,) = struct.unpack('>I', fp.read(4))
+        fp.seek(resources_length, os.SEEK_CUR)
+        # The layer and mask section length is 8 bytes in PSB files
+        if header.version == 2:
+            (layers_length,) = struct.unpack('>Q', fp.read(8))
+        else:
+            (layers_length,) = struct.unpack('>I', fp.read(4))
+        fp.seek(layers_length, os.SEEK_CUR)
+
+        (self.compression,) = struct.unpack('>H', fp.read(2))
+        if self.compression == _COMPRESSION_RAW:
+            self._data_start = fp.tell()
+        elif self.compression == _COMPRESSION_RLE:
+            self._row_offsets = self._read_row_offsets(header)
+        else:
+            raise ValueError("ZIP-compressed image data isn't supported")
+
+    def _read_row_offsets(self, header):
+        """Reads the RLE byte count table. Returns the file offsets of each used channel's rows (plus its end)."""
+        count_type = 'I' if header.version == 2 else 'H'
+        row_count = header.channels * header.height
+        table_start = self.fp.tell()
+        position = table_start + row_count * array(count_type).itemsize
+        offsets = []
+        for _ in range(self.channels):
+            counts = array(count_type)
+            counts.frombytes(self.fp.read(header.height * counts.itemsize))
+            if len(counts) < header.height:
+                raise ValueError("Truncated RLE byte counts")
+            if sys.byteorder == 'little':
+                counts.byteswap()
+            channel_offsets = array('q', accumulate(counts, initial=position))
+            offsets.append(channel_offsets)
+            position = channel_offsets[-1]
+        return offsets
+
+    def _read_band(self, channel, top, bottom):
+        row_count = bottom - top
+        if self.compression == _COMPRESSION_RLE:
+            start = self._row_offsets[channel][top]
+            length = self._row_offsets[channel][bottom] - start
+            decoder = 'packbits'
+        else:
+            start = self._data_start + (channel * self.height + top) * self.row_bytes
+            length = row_count * self.row_bytes
+            decoder = 'raw'
+        self.fp.seek(start)
+        data = self.fp.read(length)
+        if len(data) < length:
+            raise ValueError("Truncated image data")
+        self.bytes_read += length
+        if self.depth == 16:
+            return to_8bit(Image.frombytes('I;16B', (self.width, row_count), data, decoder, 'I;16B'))
+        return Image.frombytes('L', (self.width, row_count), data, decoder, 'L')
+
+    def read_rows(self, top, bottom):
+        """Returns rows top to bottom (exclusive) of the composite as an 8-bit image."""
+        bands = [self._read_band(channel, top, bottom) for channel in range(self.channels)]
+        if self.mode == 'CMYK':
+            # Photoshop stores CMYK inverted (0 is full ink)
+            bands = [ImageChops.invert(band) for band in bands]
+        image = bands[0] if self.mode == 'L' else Image.merge(self.mode, bands)
+        if self.icc_profile:
+            image.info['icc_profile'] = self.icc_profile
+        return image
+
+def _png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+class PngStripWriter:
+    """
+    Class to write a PNG a strip of rows at a time. Rows go through one zlib stream
+    (unfiltered) and compressed data is written as it comes out, so only the
+    compressor's window is held in memory.
+    """
+    COLOR_TYPES = {'L': 0, 'RGB': 2, 'LA': 4, 'RGBA': 6}
+
+    def __init__(self, fp, width, height, mode, level=6, icc_profile=None):
+        if mode not in self.COLOR_TYPES:
+            raise ValueError(f"Cannot write mode {mode} as PNG")
+        self.fp = fp
+        self.row_size = width * len(mode)
+        fp.write(b'\x89PNG\r\n\x1a\n')
+        fp.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, self.COLOR_TYPES[mode], 0, 0, 0)))
+        if icc_profile:
+            fp.write(_png_chunk(b'iCCP', b'ICC Profile\x00\x00' + zlib.compress(icc_profile)))
+        self._compressor = zlib.compressobj(level)
+
+    def write(self, image):
+        data = image.tobytes()
+        # Each row starts with its filter type; 0 is none
+        rows = b''.join(b'\x00' + data[offset:offset + self.row_size]
+                        for offset in range(0, len(data), self.row_size))
+        self._write_idat(self._compressor.compress(rows))
+
+    def _write_idat(self, data):
+        if data:
+            self.fp.write(_png_chunk(b'IDAT', data))
+
+    def close(self):
+        self._write_idat(self._compressor.flush())
+        self.fp.write(_png_chunk(b'IEND', b''))
+
+class BmpStripWriter:
+    """
+    Class to write a BMP a strip of rows at a time. The image is stored top-down
+    (negative height), so rows are written in the order they are produced.
+    """
+    def __init__(self, fp, width, height, mode):
+        if mode not in ('L', 'RGB'):
+            raise ValueError(f"Cannot write mode {mode} as BMP")
+        self.fp = fp
+        self.mode = mode
+        bits = 8 if mode == 'L' else 24
+        self.row_size = width * bits // 8
+        # Rows are padded to a multiple of 4 bytes
+        self.padding = b'\x00' * (-self.row_size % 4)
+        palette = bytes(value for gray in range(256) for value in (gray, gray, gray, 0)) if mode == 'L' else b''
+        data_offset = 14 + 40 + len(palette)
+        data_size = (self.row_size + len(self.padding)) * height
+        if data_offset + data_size > 0xFFFFFFFF:
+            raise ValueError("Image is too large for BMP (4 GB limit); use TIFF or PNG")
+        fp.write(b'BM' + struct.pack('<IHHI', data_offset + data_size, 0, 0, data_offset))
+        fp.write(struct.pack('<IiiHHIIiiII', 40, width, -height, 1, bits, 0, data_size, 2835, 2835,
+                             256 if mode == 'L' else 0, 0))
+        fp.write(palette)
+
+    def write(self, image):
+        data = image.tobytes('raw', 'BGR') if self.mode == 'RGB' else image.tobytes()
+        if self.padding:
+            data = b''.join(data[offset:offset + self.row_size] + self.padding
+                            for offset in range(0, len(data), self.row_size))
+        self.fp.write(data)
+
+    def close(self):
+        pass
+
+class TiffStripWriter:
+    """
+    Class to write a Deflate-compressed TIFF a strip at a time. Strips are written as
+    they are produced and the directory (IFD) with their offsets follows them at the
+    end. Outputs that may pass 4 GB are written as BigTIFF.
+    """
+    # mode -> (PhotometricInterpretation, ExtraSamples)
+    LAYOUTS = {'L': (1, None), 'LA': (1, 2), 'RGB': (2, None), 'RGBA': (2, 2), 'CMYK': (5, None)}
+
+    _SHORT, _LONG, _UNDEFINED, _LONG8 = 3, 4, 7, 16
+    _TYPE_FORMATS = {_SHORT: 'H', _LONG: 'I', _UNDEFINED: 'B', _LONG8: 'Q'}
+
+    def __init__(self, fp, width, height, mode, level=6, icc_profile=None):
+        if mode not in self.LAYOUTS:
+            raise ValueError(f"Cannot write mode {mode} as TIFF")
+        self.fp = fp
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.level = level
+        self.icc_profile = icc_profile
+        self.bigtiff = width * height * len(mode) >= _BIGTIFF_THRESHOLD
+        self.rows_per_strip = None
+        self.strip_offsets = []
+        self.strip_byte_counts = []
+        self._start = fp.tell()
+        if self.bigtiff:
+            fp.write(b'II+\x00' + struct.pack('<HHQ', 8, 0, 0))
+        else:
+            fp.write(b'II*\x00' + struct.pack('<I', 0))
+
+    def write(self, image):
+        # Every strip but the last has the height of the first
+        if self.rows_per_strip is None:
+            self.rows_per_strip = image.height
+        data = zlib.compress(image.tobytes(), self.level)
+        offset = self.fp.tell() - self._start
+        if not self.bigtiff and offset + len(data) > 0xFFFFFFFF:
+            raise ValueError("TIFF output passed 4 GB")
+        self.strip_offsets.append(offset)
+        self.strip_byte_counts.append(len(data))
+        self.fp.write(data)
+
+    def close(self):
+        photometric, extra_samples = self.LAYOUTS[self.mode]
+        offset_type = self._LONG8 if self.bigtiff else self._LONG
+        entries = [
+            (256, self._LONG, [self.width]),
+            (257, self._LONG, [self.height]),
+            (258, self._SHORT, [8] * len(self.mode)),
+            (259, self._SHORT, [8]),  # Adobe Deflate
+            (262, self._SHORT, [photometric]),
+            (273, offset_type, self.strip_offsets),
+            (277, self._SHORT, [len(self.mode)]),
+            (278, self._LONG, [self.rows_per_strip or self.height]),
+            (279, offset_type, self.strip_byte_counts),
+            (284, self._SHORT, [1]),  # Chunky (interleaved) samples
+        ]
+        if extra_samples:
+            entries.append((338, self._SHORT, [extra_samples]))  # Unassociated alpha
+        if self.icc_profile:
+            entries.append((34675, self._UNDEFINED, self.icc_profile))
+        self._write_ifd(entries)
+
+    def _write_ifd(self, entries):
+        if self.bigtiff:
+            count_format, entry_format, offset_format, inline_size = '<Q', '<HHQ', '<Q', 8
+        else:
+            count_format, entry_format, offset_format, inline_size = '<H', '<HHI', '<I', 4
+        # The IFD starts on a word boundary
+        position = self.fp.tell() - self._start
+        self.fp.write(b'\x00' * (position & 1))
+        ifd_offset = position + (position & 1)
+        entry_size = struct.calcsize(entry_format) + inline_size
+        data_offset = ifd_offset + struct.calcsize(count_format) + len(entries) * entry_size + inline_size
+
+        directory = struct.pack(count_format, len(entries))
+        values = b''
+        for tag, value_type, value in entries:
+            if isinstance(value, bytes):
+                data = value
+            else:
+                data = struct.pack(f'<{len(value)}{self._TYPE_FORMATS[value_type]}', *value)
+            directory += struct.pack(entry_format, tag, value_type, len(value))
+            if len(data) <= inline_size:
+                directory += data.ljust(inline_size, b'\x00')
+            else:
+                directory += struct.pack(offset_format, data_offset + len(values))
+                values += data + b'\x00' * (len(data) & 1)
+        directory += struct.pack(offset_format, 0)  # No further IFD
+        self.fp.write(directory + values)
+
+        # Point the header at the IFD
+        self.fp.seek(self._start + (8 if self.bigtiff else 4))
+        self.fp.write(struct.pack(offset_format, ifd_offset))
+        self.fp.seek(0, os.SEEK_END)
+
+def _create_writer(fp, width, height, image, output_settings):
+    """Returns the strip writer for the output format, set up from the first prepared strip."""
+    format_lower = output_settings.format.lower()
+    if format_lower == 'png':
+        profile = _get_profile_kwargs(image, output_settings).get('icc_profile', image.info.get('icc_profile'))
+        level = _get_effort_params('png', output_settings).get('compress_level', 9)
+        return PngStripWriter(fp, width, height, image.mode, level, profile)
+    if format_lower == 'bmp':
+        return BmpStripWriter(fp, width, height, image.mode)
+    return TiffStripWriter(fp, width, height, image.mode, _TIFF_DEFLATE_LEVELS[get_effort(output_settings, 'tiff')],
+                           image.info.get('icc_profile'))
+
+def stream_psd_to_file(psd_path, output_path, output_settings, metrics=NULL_METRICS):
+    """
+    Converts the composite of a PSD/PSB file to a TIFF, PNG or BMP file in horizontal
+    strips of STREAM_STRIP_ROWS source rows, so memory follows the canvas width rather
+    than its size. Each strip is resampled with LANCZOS together with the neighboring
+    rows the filter reaches, which gives the same output as resizing the whole image
+    up to rounding: within one code value for opaque images and for alpha, and within
+    two of the premultiplied color of transparent ones. Colors are stored unpremultiplied,
+    so those of nearly transparent pixels can differ by more (up to 255 / alpha).
+    """
+    format_lower = output_settings.format.lower()
+    if format_lower not in STREAMABLE_FORMATS:
+        raise ValueError(f"{output_settings.format.upper()} output isn't supported for files this large; "
+                         f"use TIFF, PNG or BMP")
+    # Format preparation runs per strip; report it once instead
+    strip_settings = copy.copy(output_settings)
+    strip_settings.detailed_output = False
+
+    with open(psd_path, 'rb') as source, open(output_path, 'wb') as target:
+        reader = MergedImageReader(source)
+        source_size = (reader.width, reader.height)
+        width, height = get_output_size(source_size, output_settings)
+        strip_rows = _get_strip_rows(reader.height, height)
+        scale_y = reader.height / height
+        margin = _LANCZOS_SUPPORT * max(scale_y, 1.0) + 1
+        if output_settings.detailed_output:
+            print(f"  Streaming {reader.width}x{reader.height} {reader.mode} to {width}x{height} "
+                  f"in strips of {STREAM_STRIP_ROWS} rows")
+
+        with metrics.stage('stream', pixels=reader.width * reader.height) as stage:
+            writer = None
+            for output_top in range(0, height, strip_rows):
+                output_bottom = min(height, output_top + strip_rows)
+                if (width, height) == source_size:
+                    strip = reader.read_rows(output_top, output_bottom)
+                else:
+                    source_top = output_top * scale_y
+                    source_bottom = output_bottom * scale_y
+                    top = max(0, int(source_top - margin))
+                    bottom = min(reader.height, math.ceil(source_bottom + margin))
+                    strip = reader.read_rows(top, bottom).resize(
+                        (width, output_bottom - output_top), Image.Resampling.LANCZOS,
+                        box=(0, source_top - top, reader.width, source_bottom - top))
+                strip = _prepare_for_format(strip, strip_settings)
+                if writer is None:
+                    writer = _create_writer(target, width, height, strip, output_settings)
+                writer.write(strip)
+            writer.close()
+            stage.count(bytes_read=reader.bytes_read, bytes_written=target.tell())
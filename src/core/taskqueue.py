@@ -0,0 +1,404 @@
+"""Task queue on a shared file system, so a batch can be split across worker processes on many hosts."""
+
+import json
+import os
+import secrets
+import socket
+import sys
+import threading
+import time
+from collections import deque
+
+# Add the src directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.batch import iter_convert_batch
+from core.converter import OutputSettings, as_recipe
+from core.naming import create_temp_path
+
+# Files per task; workers claim, heartbeat and report whole tasks
+TASK_SIZE = 64
+
+# Seconds without a heartbeat after which a task's lease expires and another worker may claim it
+LEASE_SECONDS = 60.0
+
+# Times a task is claimed before it is moved to failed/ (its workers kept dying or stalling)
+MAX_TASK_ATTEMPTS = 3
+
+MANIFEST_FILENAME = 'queue.json'
+SEALED_FILENAME = 'sealed'
+
+# Subdirectories of a queue. A task is one JSON file named '<sequence>-<attempt>.json' that
+# moves between them by atomic renames; a lease adds the worker: '<sequence>-<attempt>@<worker>.json'.
+# Reports in done/ are named like leases plus a random token. A lease being finished or
+# released moves to releasing/, where it only expires once its worker's heartbeat stops.
+PENDING_DIR = 'pending'
+LEASED_DIR = 'leased'
+RELEASING_DIR = 'releasing'
+DONE_DIR = 'done'
+FAILED_DIR = 'failed'
+WORKERS_DIR = 'workers'
+_QUEUE_DIRS = (PENDING_DIR, LEASED_DIR, RELEASING_DIR, DONE_DIR, FAILED_DIR, WORKERS_DIR)
+
+def _write_json(directory, filename, data):
+    """Writes a JSON file under a temporary name and renames it into place, so readers never see it partial."""
+    temp_path = create_temp_path(directory)
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(temp_path, os.path.join(directory, filename))
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def _read_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _parse_task_name(filename):
+    """Returns (sequence, attempt, worker id or None) of a task or lease file name."""
+    name, _, worker_id = filename[:-len('.json')].partition('@')
+    sequence, _, attempt = name.partition('-')
+    return int(sequence), int(attempt), worker_id or None
+
+def _task_name(sequence, attempt):
+    return f"{sequence:08d}-{attempt}.json"
+
+def create_task_queue(queue_dir, psd_paths, output_dir, output_settings, task_size=TASK_SIZE,
+                      lease_seconds=LEASE_SECONDS):
+    """
+    Coordinator: writes the PSD files into a new queue in queue_dir as tasks of task_size
+    files. psd_paths may be a lazy iterable; workers may start while tasks are still being
+    written and only stop once the queue is sealed at the end. Paths are stored absolute,
+    so every host must see the sources and output_dir at the same paths.
+    Returns (number of tasks, number of files).
+    """
+    if os.path.exists(os.path.join(queue_dir, MANIFEST_FILENAME)):
+        raise FileExistsError(f"'{queue_dir}' already holds a task queue")
+    for subdir in _QUEUE_DIRS:
+        os.makedirs(os.path.join(queue_dir, subdir), exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+    _write_json(queue_dir, MANIFEST_FILENAME, {
+        'output_dir': os.path.abspath(output_dir),
+        'recipe': [vars(variant) for variant in as_recipe(output_settings)],
+        'lease_seconds': lease_seconds,
+        'created': time.time(),
+    })
+
+    pending_dir = os.path.join(queue_dir, PENDING_DIR)
+    task_count = file_count = 0
+    chunk = []
+
+    def write_task():
+        _write_json(pending_dir, _task_name(task_count, 0), {'files': chunk})
+
+    for psd_path in psd_paths:
+        chunk.append(os.path.abspath(psd_path))
+        file_count += 1
+        if len(chunk) >= task_size:
+            write_task()
+            task_count += 1
+            chunk = []
+    if chunk:
+        write_task()
+        task_count += 1
+    _write_json(queue_dir, SEALED_FILENAME, {'tasks': task_count, 'files': file_count, 'sealed': time.time()})
+    return task_count, file_count
+
+def _count_tasks(directory):
+    """Returns the number of task files in a queue subdirectory (0 if it doesn't exist)."""
+    try:
+        return sum(1 for name in os.listdir(directory) if name.endswith('.json'))
+    except FileNotFoundError:
+        return 0
+
+def get_queue_status(queue_dir):
+    """Returns a dict with the number of tasks per state and of converted and failed files so far."""
+    status = {'sealed': os.path.exists(os.path.join(queue_dir, SEALED_FILENAME))}
+    for subdir in (PENDING_DIR, LEASED_DIR, FAILED_DIR):
+        status[subdir] = _count_tasks(os.path.join(queue_dir, subdir))
+    # Leases being finished are still leased
+    status[LEASED_DIR] += _count_tasks(os.path.join(queue_dir, RELEASING_DIR))
+    done = set()
+    status['converted_files'] = status['failed_files'] = 0
+    for entry in os.scandir(os.path.join(queue_dir, DONE_DIR)):
+        if not entry.name.endswith('.json'):
+            continue
+        report = _read_json(entry.path)
+        if report['complete']:
+            done.add(_parse_task_name(entry.name)[0])
+        for result in report['results']:
+            status['converted_files' if result['success'] else 'failed_files'] += 1
+    status[DONE_DIR] = len(done)
+    return status
+
+class QueueWorker:
+    """
+    Class to convert the tasks of a queue (see create_task_queue) on this host.
+    Any number of workers on any number of hosts may run against one queue on a
+    shared POSIX file system; no service is involved:
+    - a task is claimed by renaming it from pending/ to leased/; rename is atomic,
+      so exactly one worker wins and the others move on to the next task
+    - while a task is converted, a heartbeat thread touches its lease file; a lease
+      not touched for lease_seconds has expired and any worker renames it back to
+      pending/ for another attempt (or to failed/ after MAX_TASK_ATTEMPTS)
+    - to finish or release a task, its worker first moves the lease to releasing/,
+      which fails if the lease expired and was reclaimed; there it only expires
+      once the worker's heartbeat file stops being touched (the worker died)
+    - the results of a finished task are written to done/ before its lease is removed;
+      a stopped worker returns its unfinished files to pending/ and writes the
+      results it has to done/ as an incomplete report
+    Expiry compares a lease's modification time with that of the worker's own
+    heartbeat file, both set by the file server, so host clocks needn't agree.
+    Claimed files are fed to one local batch (see core.batch) as worker processes
+    free up, so a host converts max_workers files at a time across task boundaries.
+    A file whose worker stalls past its lease may be converted twice; the second
+    copy gets its own output name.
+    """
+    def __init__(self, queue_dir, max_workers=None, worker_id=None, poll_interval=5.0, memory_budget=None,
+                 metrics_sink=None, prefetch=0, retries=0):
+        manifest_path = os.path.join(queue_dir, MANIFEST_FILENAME)
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"'{queue_dir}' holds no task queue")
+        manifest = _read_json(manifest_path)
+        self.queue_dir = queue_dir
+        self.output_dir = manifest['output_dir']
+        self.recipe = [OutputSettings(**variant) for variant in manifest['recipe']]
+        self.lease_seconds = manifest['lease_seconds']
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}".replace('@', '_')
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.memory_budget = memory_budget
+        self.metrics_sink = metrics_sink
+        self.prefetch = prefetch
+        self.retries = retries
+
+        self._pending_dir = os.path.join(queue_dir, PENDING_DIR)
+        self._leased_dir = os.path.join(queue_dir, LEASED_DIR)
+        self._releasing_dir = os.path.join(queue_dir, RELEASING_DIR)
+        # Queues created before releasing/ existed
+        os.makedirs(self._releasing_dir, exist_ok=True)
+        self._heartbeat_path = os.path.join(queue_dir, WORKERS_DIR, self.worker_id)
+        self._candidates = deque()
+        self._last_reclaim = None
+        self._lock = threading.Lock()
+        self._held = {}  # sequence -> held task (see _claim)
+        self._task_of = {}  # psd_path -> deque of sequences of held tasks with the file
+
+    def _filesystem_time(self):
+        """Touches this worker's heartbeat file. Returns its modification time as set by the file server."""
+        with open(self._heartbeat_path, 'a'):
+            pass
+        os.utime(self._heartbeat_path)
+        return os.stat(self._heartbeat_path).st_mtime
+
+    def _heartbeat(self, stop):
+        interval = self.lease_seconds / 4
+        while not stop.wait(interval):
+            try:
+                self._filesystem_time()
+            except OSError as e:
+                print(f"  Queue heartbeat failed: {e}")
+            with self._lock:
+                held = list(self._held.values())
+            for task in held:
+                try:
+                    os.utime(task['lease_path'])
+                except FileNotFoundError:
+                    with self._lock:
+                        if task['sequence'] not in self._held:
+                            continue  # Finished meanwhile
+                        # Expired and claimed by another worker; its results are dropped
+                        task['lost'] = True
+                    print(f"  Lost the lease of task {task['sequence']}")
+
+    def _worker_is_alive(self, worker_id, now):
+        """Returns whether a worker's heartbeat file was touched within the lease time."""
+        try:
+            return now - os.stat(os.path.join(self.queue_dir, WORKERS_DIR, worker_id)).st_mtime < self.lease_seconds
+        except FileNotFoundError:
+            return False
+
+    def reclaim_expired(self):
+        """
+        Returns expired leases of any worker to pending/, or moves them to failed/, as well
+        as leases left in releasing/ by workers that died. Returns the number moved.
+        """
+        now = self._filesystem_time()
+        moved = 0
+        entries = [(entry, False) for entry in os.scandir(self._leased_dir)]
+        entries += [(entry, True) for entry in os.scandir(self._releasing_dir)]
+        for entry, releasing in entries:
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                sequence, attempt, worker_id = _parse_task_name(entry.name)
+                if releasing:
+                    if self._worker_is_alive(worker_id, now):
+                        continue
+                elif now - entry.stat().st_mtime < self.lease_seconds:
+                    continue
+                if attempt + 1 >= MAX_TASK_ATTEMPTS:
+                    target = os.path.join(self.queue_dir, FAILED_DIR, _task_name(sequence, attempt))
+                else:
+                    target = os.path.join(self._pending_dir, _task_name(sequence, attempt + 1))
+                os.rename(entry.path, target)
+            except FileNotFoundError:
+                # Finished, or reclaimed by another worker first
+                continue
+            print(f"  Lease of task {sequence} by {worker_id} expired; "
+                  f"{'giving up on it' if attempt + 1 >= MAX_TASK_ATTEMPTS else 'requeued'}")
+            moved += 1
+        return moved
+
+    def _claim(self):
+        """Claims the next pending task. Returns the held task, or None if there is none."""
+        now = time.monotonic()
+        if self._last_reclaim is None or now - self._last_reclaim >= self.lease_seconds / 2:
+            self._last_reclaim = now
+            if self.reclaim_expired():
+                self._candidates.clear()
+        for _ in range(2):
+            if not self._candidates:
+                self._candidates.extend(sorted(name for name in os.listdir(self._pending_dir)
+                                               if name.endswith('.json')))
+            while self._candidates:
+                name = self._candidates.popleft()
+                sequence, attempt, _ = _parse_task_name(name)
+                lease_path = os.path.join(self._leased_dir, f"{name[:-len('.json')]}@{self.worker_id}.json")
+                try:
+                    os.rename(os.path.join(self._pending_dir, name), lease_path)
+                except FileNotFoundError:
+                    continue
+                # The lease starts now, not when the coordinator wrote the task
+                os.utime(lease_path)
+                files = _read_json(lease_path)['files']
+                return {'sequence': sequence, 'attempt': attempt, 'lease_path': lease_path, 'files': files,
+                        'remaining': len(files), 'results': [], 'lost': False}
+        return None
+
+    def _iter_claimed_files(self, control):
+        """Yields the files of tasks claimed one at a time, as the batch asks for more work."""
+        while control is None or not control.is_cancelled:
+            task = self._claim()
+            if task is None:
+                return
+            with self._lock:
+                self._held[task['sequence']] = task
+                for psd_path in task['files']:
+                    self._task_of.setdefault(psd_path, deque()).append(task['sequence'])
+            if not task['files']:
+                self._finish(task)
+            for psd_path in task['files']:
+                yield psd_path
+
+    def _report(self, task, complete):
+        # A released task is claimed again with the same attempt number, possibly by this
+        # worker, so every report gets its own name rather than the lease's
+        filename = f"{task['sequence']:08d}-{task['attempt']}@{self.worker_id}-{secrets.token_hex(4)}.json"
+        _write_json(os.path.join(self.queue_dir, DONE_DIR), filename,
+                    {'worker': self.worker_id, 'complete': complete, 'results': task['results']})
+
+    def _take_lease(self, task):
+        """
+        Moves a held task's lease to releasing/, where other workers leave it alone while this
+        one is alive, so a lease reclaimed meanwhile is never written over and the task is never
+        requeued while it is being finished. Returns the new path, or None if the lease was lost.
+        """
+        with self._lock:
+            del self._held[task['sequence']]
+            if task['lost']:
+                return None
+        taken_path = os.path.join(self._releasing_dir, os.path.basename(task['lease_path']))
+        try:
+            os.rename(task['lease_path'], taken_path)
+        except FileNotFoundError:
+            print(f"  Lost the lease of task {task['sequence']}")
+            return None
+        return taken_path
+
+    def _finish(self, task):
+        """Writes the results of a finished task to done/ and releases its lease."""
+        taken_path = self._take_lease(task)
+        if taken_path is None:
+            return
+        self._report(task, True)
+        try:
+            os.remove(taken_path)
+        except FileNotFoundError:
+            # This worker stalled past its lease and another one requeued the task
+            print(f"  Lost the lease of task {task['sequence']}")
+
+    def _release(self, task):
+        """Returns a task with the files not yet converted to pending/, e.g. when the worker is stopped."""
+        taken_path = self._take_lease(task)
+        if taken_path is None:
+            return
+        done = {result['path'] for result in task['results']}
+        files = [psd_path for psd_path in task['files'] if psd_path not in done]
+        try:
+            # Rewriting the lease before renaming it keeps the task in exactly one directory
+            _write_json(self._releasing_dir, os.path.basename(taken_path), {'files': files})
+            os.rename(taken_path, os.path.join(self._pending_dir, _task_name(task['sequence'], task['attempt'])))
+        except FileNotFoundError:
+            print(f"  Lost the lease of task {task['sequence']}")
+        if task['results']:
+            self._report(task, False)
+
+    def _record(self, result):
+        with self._lock:
+            sequence = self._task_of[result.psd_path].popleft()
+            if not self._task_of[result.psd_path]:
+                del self._task_of[result.psd_path]
+            task = self._held[sequence]
+        task['results'].append({'path': result.psd_path, 'success': result.success, 'error': result.error,
+                                'outputs': result.output_paths})
+        task['remaining'] -= 1
+        if task['remaining'] == 0:
+            self._finish(task)
+
+    def is_drained(self):
+        """Returns True once the queue is sealed and no task is pending or leased."""
+        return (os.path.exists(os.path.join(self.queue_dir, SEALED_FILENAME))
+                and not _count_tasks(self._pending_dir)
+                and not _count_tasks(self._leased_dir)
+                and not _count_tasks(self._releasing_dir))
+
+    def run(self, control=None, callback=None):
+        """
+        Converts tasks until the queue is drained or the BatchControl is cancelled.
+        callback(result) is called for every converted file. Tasks still held when
+        the worker is cancelled are returned to the queue. Returns the number of files converted.
+        """
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(stop,), daemon=True)
+        self._filesystem_time()
+        heartbeat.start()
+        converted = 0
+        try:
+            while control is None or not control.is_cancelled:
+                before = converted
+                for result in iter_convert_batch(self._iter_claimed_files(control), self.output_dir, self.recipe,
+                                                 max_workers=self.max_workers, control=control,
+                                                 memory_budget=self.memory_budget, metrics_sink=self.metrics_sink,
+                                                 prefetch=self.prefetch, retries=self.retries):
+                    self._record(result)
+                    converted += 1
+                    if callback:
+                        callback(result)
+                if self.is_drained():
+                    break
+                if converted == before:
+                    # Nothing to claim: wait for other workers' tasks to finish or their leases to expire
+                    time.sleep(self.poll_interval)
+        finally:
+            # Released while the heartbeat still shows this worker alive (see reclaim_expired)
+            for task in list(self._held.values()):
+                self._release(task)
+            stop.set()
+            heartbeat.join()
+            try:
+                os.remove(self._heartbeat_path)
+            except OSError:
+                pass
+        return converted
@@ -0,0 +1,176 @@
+"""Thumbnails of PSD files for previews, cached on disk."""
+
+import hashlib
+import io
+import os
+import struct
+import sys
+import time
+
+from PIL import Image
+
+# Add the src directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.color import convert_to_srgb
+from core.converter import open_psd_image
+from core.flatten import has_alpha
+from core.naming import TEMP_PREFIX, create_temp_path
+from utils.metadata import read_image_resources
+
+# Image resources holding the JPEG thumbnail Photoshop saves with a document
+THUMBNAIL_RESOURCE_ID = 1036
+LEGACY_THUMBNAIL_RESOURCE_ID = 1033  # Photoshop 4.0, stored with red and blue swapped
+
+# Format, width, height, row bytes, total size, compressed size, bits per pixel and planes
+_THUMBNAIL_HEADER_SIZE = 28
+_THUMBNAIL_FORMAT_JPEG = 1
+
+# Size the thumbnail cache is pruned back to, least recently used entries first
+THUMBNAIL_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Cache entries are pruned down to this fraction of the limit, so pruning doesn't run on every write
+_PRUNE_TARGET = 0.8
+
+# Seconds after which a temporary file in the cache was left by a writer that died;
+# far longer than writing a thumbnail takes
+_TEMP_FILE_MAX_AGE = 3600
+
+def get_default_thumbnail_cache_dir():
+    """Returns the per-user directory thumbnails are cached in."""
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'psd_converter', 'thumbnails')
+
+def read_embedded_thumbnail(psd_path):
+    """
+    Returns the thumbnail stored in the PSD image resources as an RGB image, or None.
+    Only the resource section is read; the composite isn't decoded.
+    """
+    with open(psd_path, 'rb') as f:
+        resources = read_image_resources(f, (THUMBNAIL_RESOURCE_ID, LEGACY_THUMBNAIL_RESOURCE_ID))
+
+    for resource_id in (THUMBNAIL_RESOURCE_ID, LEGACY_THUMBNAIL_RESOURCE_ID):
+        data = resources.get(resource_id)
+        if not data or len(data) <= _THUMBNAIL_HEADER_SIZE:
+            continue
+        (thumbnail_format,) = struct.unpack('>I', data[:4])
+        if thumbnail_format != _THUMBNAIL_FORMAT_JPEG:
+            continue
+        image = Image.open(io.BytesIO(data[_THUMBNAIL_HEADER_SIZE:]))
+        image = image.convert('RGB')
+        if resource_id == LEGACY_THUMBNAIL_RESOURCE_ID:
+            red, green, blue = image.split()
+            image = Image.merge('RGB', (blue, green, red))
+        return image
+    return None
+
+def decode_thumbnail(psd_path, size):
+    """Decodes the composite and reduces it to fit size, for files without an embedded thumbnail."""
+    with open_psd_image(psd_path) as image:
+        # A box reduction first keeps this cheap for large documents
+        image.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        image = convert_to_srgb(image)
+    return image.convert('RGBA' if has_alpha(image) else 'RGB')
+
+class ThumbnailService:
+    """
+    Class to produce thumbnails of PSD files, cached on disk.
+    The embedded JPEG thumbnail is used when it is large enough, otherwise the
+    composite is decoded. Cache entries are keyed by the file's path, size and
+    modification time, so edited files get a new thumbnail while unchanged
+    files are never read again. The cache is kept under max_bytes by removing
+    the entries used least recently (a hit refreshes an entry's modification time).
+    """
+    def __init__(self, size=(64, 64), cache_dir=None, max_bytes=THUMBNAIL_CACHE_MAX_BYTES):
+        self.size = tuple(size)
+        self.cache_dir = cache_dir or get_default_thumbnail_cache_dir()
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._cache_bytes = self.prune()
+
+    def prune(self):
+        """
+        Removes the least recently used cache entries until the cache is below the limit,
+        and temporary files other processes left behind. Returns the bytes still cached.
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            try:
+                stat = entry.stat()
+                if entry.name.startswith(TEMP_PREFIX):
+                    if time.time() - stat.st_mtime > _TEMP_FILE_MAX_AGE:
+                        os.remove(entry.path)
+                    continue
+                if entry.name.endswith('.png'):
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        if self.max_bytes is None or total <= self.max_bytes:
+            return total
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes * _PRUNE_TARGET:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        return total
+
+    def _cache_path(self, psd_path, stat):
+        key = f"{os.path.abspath(psd_path)}|{stat.st_size}|{stat.st_mtime_ns}|{self.size[0]}x{self.size[1]}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.png')
+
+    def get(self, psd_path):
+        """Returns a thumbnail fitting the service's size, or None if the file can't be read."""
+        try:
+            cache_path = self._cache_path(psd_path, os.stat(psd_path))
+        except OSError:
+            return None
+
+        if os.path.exists(cache_path):
+            try:
+                image = Image.open(cache_path)
+                image.load()
+            except OSError:
+                pass  # Unreadable cache entry, or pruned meanwhile; make it again
+            else:
+                try:
+                    os.utime(cache_path)  # Recently used entries survive pruning
+                except OSError:
+                    pass
+                return image
+
+        try:
+            image = read_embedded_thumbnail(psd_path)
+            if image is None or max(image.size) < max(self.size):
+                image = decode_thumbnail(psd_path, self.size)
+            else:
+                image.thumbnail(self.size, Image.Resampling.LANCZOS)
+        except Exception as e:
+            print(f"  Could not create thumbnail for {os.path.basename(psd_path)}: {e}")
+            return None
+
+        temp_path = None
+        try:
+            # Write under a temporary name so a concurrent reader never sees a partial file
+            temp_path = create_temp_path(self.cache_dir)
+            image.save(temp_path, format='PNG')
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, cache_path)
+            self._cache_bytes += size
+            if self.max_bytes is not None and self._cache_bytes > self.max_bytes:
+                self._cache_bytes = self.prune()
+        except OSError as e:
+            print(f"  Could not cache thumbnail for {os.path.basename(psd_path)}: {e}")
+        finally:
+            if temp_path is not None and os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+        return image
@@ -0,0 +1,341 @@
+"""Watch-folder mode: converts PSD files as they are added or changed."""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# Add the src directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.batch import _convert_one, _future_result, get_default_worker_count
+from core.cache import ConversionCache
+from core.converter import as_recipe
+from core.scanner import is_psd_path, iter_psd_files
+
+# inotify event flags (see inotify(7))
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+# Writes in progress aren't watched (IN_MODIFY fires per write); the settle check follows them by stat
+_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_ONLYDIR
+_EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+# Seconds a worker pool may sit idle before its processes are stopped; a new
+# pool is started for the next change, so workers never run for days
+POOL_IDLE_SECONDS = 60.0
+
+class RescanNeeded(Exception):
+    """Raised by a monitor when events were lost and the directories must be scanned again."""
+
+def _load_libc():
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError("inotify is not available on this platform")
+    return libc
+
+class InotifyMonitor:
+    """
+    Class to report changed PSD files through Linux inotify.
+    Every directory under the watched folders gets a watch, including folders
+    created or moved in later; watches of removed folders are dropped when the
+    kernel reports them gone, so memory follows the folder count only.
+    """
+    def __init__(self, directories):
+        self._libc = _load_libc()
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._paths = {}  # watch descriptor -> directory
+        try:
+            for directory in directories:
+                self._watch_tree(directory)
+        except OSError:
+            self.close()
+            raise
+
+    def _watch(self, directory):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            # ENOSPC: the fs.inotify.max_user_watches limit is reached
+            raise OSError(error, f"Could not watch '{directory}': {os.strerror(error)}")
+        self._paths[wd] = directory
+
+    def _watch_tree(self, directory):
+        """Watches a directory and its subdirectories. Returns the PSD files already in them."""
+        found = []
+        pending = [directory]
+        while pending:
+            current = pending.pop()
+            self._watch(current)
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                pending.append(entry.path)
+                            elif is_psd_path(entry.name):
+                                found.append(entry.path)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return found
+
+    def read_changes(self, timeout):
+        """
+        Waits up to timeout seconds and returns the set of PSD paths written, created or moved in.
+        Raises RescanNeeded if the kernel's event queue overflowed.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        changed = set()
+        if not readable:
+            return changed
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+
+        overflowed = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_length].rstrip(b'\0'))
+            offset += name_length
+
+            if mask & _IN_Q_OVERFLOW:
+                overflowed = True
+                continue
+            if mask & _IN_IGNORED:
+                # The directory was removed or unmounted
+                self._paths.pop(wd, None)
+                continue
+            directory = self._paths.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    # Files may have landed in the folder before its watch was added
+                    try:
+                        changed.update(self._watch_tree(path))
+                    except OSError as e:
+                        print(f"  {e}")
+            elif is_psd_path(name):
+                changed.add(path)
+        if overflowed:
+            raise RescanNeeded()
+        return changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        self._paths.clear()
+
+class PollingMonitor:
+    """
+    Class to report changed PSD files by rescanning the folders at an interval.
+    Used where inotify isn't available, and for network shares, where changes
+    made by other machines don't raise inotify events. Keeps one (size, mtime)
+    entry per file, so memory follows the file count only.
+    """
+    def __init__(self, directories, interval=10.0):
+        self.directories = list(directories)
+        self.interval = interval
+        self._snapshot = self._scan()
+        self._next_scan = time.monotonic() + interval
+
+    def _scan(self):
+        snapshot = {}
+        for path in iter_psd_files(self.directories):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def read_changes(self, timeout):
+        """Waits up to timeout seconds and returns the set of PSD paths added or changed since the last scan."""
+        delay = self._next_scan - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(0, delay))
+        snapshot = self._scan()
+        changed = {path for path, signature in snapshot.items() if self._snapshot.get(path) != signature}
+        self._snapshot = snapshot
+        self._next_scan = time.monotonic() + self.interval
+        return changed
+
+    def close(self):
+        self._snapshot = {}
+
+def create_monitor(directories, use_inotify=True, poll_interval=10.0):
+    """Returns an InotifyMonitor where available, otherwise a PollingMonitor."""
+    if use_inotify and sys.platform.startswith('linux'):
+        try:
+            return InotifyMonitor(directories)
+        except OSError as e:
+            print(f"  inotify unavailable ({e}); polling every {poll_interval:g} seconds instead")
+    return PollingMonitor(directories, poll_interval)
+
+class FolderWatcher:
+    """
+    Class to keep an output folder in sync with PSD files in watched folders.
+    Files are converted once their size and modification time have been stable
+    for settle_seconds, so files still being copied or saved are never read half
+    written. The conversion cache always runs, so a changed PSD rewrites its
+    previous output files in place instead of adding '_N' copies, and files
+    already converted are skipped when the watcher starts.
+    """
+    def __init__(self, source_dirs, output_dir, output_settings, max_workers=None, settle_seconds=2.0,
+                 poll_interval=10.0, use_inotify=True, callback=None):
+        self.source_dirs = [os.path.abspath(path) for path in source_dirs]
+        self.output_dir = output_dir
+        self.recipe = as_recipe(output_settings)
+        self.max_workers = max(1, max_workers or get_default_worker_count())
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.callback = callback
+        self._unsettled = {}  # path -> ((size, mtime_ns), time the signature was first seen)
+        self._ready = deque()
+        self._queued = set()
+        self._running = {}  # future -> path
+        self._rerun = set()  # files changed again while being converted
+        self._executor = None
+        self._idle_since = time.monotonic()
+
+    def run(self, control=None):
+        """Watches until the BatchControl is cancelled. Pausing stops new conversions from starting."""
+        # SQLite connections must stay on the thread that opened them
+        cache = ConversionCache(self.output_dir, self.recipe)
+        monitor = create_monitor(self.source_dirs, self.use_inotify, self.poll_interval)
+        try:
+            print(f"Watching {', '.join(self.source_dirs)}")
+            self._queue_existing(cache)
+            while control is None or not control.is_cancelled:
+                try:
+                    for path in monitor.read_changes(self._wait_timeout()):
+                        self._mark_changed(path)
+                except RescanNeeded:
+                    print("  Missed file system events; scanning the watched folders again")
+                    self._queue_existing(cache)
+                self._settle()
+                if control is None or not control.is_paused:
+                    self._submit(cache)
+                self._collect(cache)
+                self._stop_idle_pool()
+        finally:
+            monitor.close()
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                for future in list(self._running):
+                    self._finish(future, cache)
+                self._executor = None
+            cache.close()
+
+    def _wait_timeout(self):
+        if self._unsettled:
+            return min(self.settle_seconds / 2, 1.0)
+        return 1.0
+
+    def _queue_existing(self, cache):
+        """Queues the files in the watched folders that aren't converted yet or changed since."""
+        for path in iter_psd_files(self.source_dirs):
+            try:
+                up_to_date, _ = cache.check(path)
+            except OSError:
+                continue
+            cache.discard(path)
+            if not up_to_date:
+                self._mark_changed(path)
+
+    def _mark_changed(self, path):
+        if path not in self._unsettled:
+            self._unsettled[path] = (None, 0.0)
+
+    def _settle(self):
+        """Moves files whose size and modification time stopped changing to the ready queue."""
+        now = time.monotonic()
+        for path, (signature, since) in list(self._unsettled.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Removed or renamed before it settled
+                del self._unsettled[path]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != signature:
+                self._unsettled[path] = (current, now)
+            elif now - since >= self.settle_seconds:
+                del self._unsettled[path]
+                if path in self._running.values():
+                    self._rerun.add(path)
+                elif path not in self._queued:
+                    self._queued.add(path)
+                    self._ready.append(path)
+
+    def _submit(self, cache):
+        """Starts conversions of ready files, keeping at most two per worker submitted."""
+        while self._ready and len(self._running) < self.max_workers * 2:
+            path = self._ready.popleft()
+            self._queued.discard(path)
+            try:
+                up_to_date, previous_outputs = cache.check(path)
+            except OSError:
+                continue
+            if up_to_date:
+                cache.discard(path)
+                continue
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            future = self._executor.submit(_convert_one, path, self.output_dir, self.recipe, previous_outputs)
+            self._running[future] = path
+
+    def _collect(self, cache):
+        if not self._running:
+            return
+        done, _ = wait(list(self._running), timeout=0, return_when=FIRST_COMPLETED)
+        for future in done:
+            self._finish(future, cache)
+        if done:
+            cache.commit()
+        if not self._running:
+            self._idle_since = time.monotonic()
+
+    def _finish(self, future, cache):
+        path = self._running.pop(future)
+        result = _future_result(future, path)
+        if result.success:
+            cache.record(path, result.output_paths)
+        else:
+            cache.discard(path)
+        if path in self._rerun:
+            self._rerun.discard(path)
+            self._mark_changed(path)
+        if self.callback:
+            self.callback(result)
+
+    def _stop_idle_pool(self):
+        if (self._executor is not None and not self._running and not self._ready
+                and time.monotonic() - self._idle_since >= POOL_IDLE_SECONDS):
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -2,6 +2,9 @@
 
 import os
 import sys
+import queue
+import threading
+import multiprocessing
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from PIL import Image, ImageTk
@@ -9,9 +12,20 @@ from PIL import Image, ImageTk
 # Add the src directory to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config.settings import COLORS, DEFAULT_OUTPUT_SETTINGS, SUPPORTED_FORMATS, APP_TITLE, APP_GEOMETRY
-from core.converter import OutputSettings, convert_psd_to_image
-from utils.metadata import get_file_creation_date_str
+from config.settings import (COLORS, DEFAULT_OUTPUT_SETTINGS, SUPPORTED_FORMATS, APP_TITLE, APP_GEOMETRY,
+                             MAX_WORKERS, MEMORY_BUDGET_MB, SKIP_UNCHANGED, PIPELINE_PREFETCH, DEDUP_MODE,
+                             BATCH_JOURNAL, BATCH_RETRIES, LONGEST_FIRST,
+                             LOG_UPDATE_INTERVAL_MS, LOG_MAX_LINES, THUMBNAIL_SIZE, THUMBNAIL_CACHE_DIR,
+                             THUMBNAIL_CACHE_MAX_MB)
+from core.converter import ENCODER_EFFORTS, OutputSettings
+from core.batch import BatchControl, convert_batch
+from core.cache import ConversionCache
+from core.dedup import DEDUP_MODES
+from core.journal import BatchJournal
+from core.planner import BatchPlan
+from utils.metrics import AggregateSink
+from core.scanner import iter_psd_files
+from core.thumbnails import ThumbnailService
 from utils.dependencies import ensure_dependencies
 
 class PSDConverterGUI:
@@ -24,6 +38,13 @@ class PSDConverterGUI:
         # Configure root window background
         self.root.configure(bg=COLORS['bg'])
         
+        # Thumbnails of source files, made on a background thread when their rows scroll into view
+        self.thumbnail_requests = queue.LifoQueue()  # Most recently shown rows first
+        self.thumbnail_thread = None
+        self.thumbnail_photos = {}  # Keeps the Tk images of source rows alive
+        self.requested_thumbnails = set()
+        self.thumbnail_update_pending = False
+        
         self._setup_icon()
         self._setup_styles()
         self._create_widgets()
@@ -31,6 +52,12 @@ class PSDConverterGUI:
         # Initialize source paths list
         self.source_paths = []
         
+        # Messages from the conversion thread, drained by the Tk event loop
+        self.message_queue = queue.Queue()
+        self.batch_control = None
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
+        self.root.after(LOG_UPDATE_INTERVAL_MS, self._process_message_queue)
+        
         # Ensure dependencies are installed
         ensure_dependencies()
 
@@ -112,6 +139,17 @@ class PSDConverterGUI:
             selectforeground=[('readonly', COLORS['fg'])],
             bordercolor=[('readonly', COLORS['border'])])
         
+        style.configure("Treeview",
+            background=COLORS['listbox'],
+            fieldbackground=COLORS['listbox'],
+            foreground=COLORS['fg'],
+            borderwidth=0,
+            rowheight=THUMBNAIL_SIZE + 4)
+            
+        style.map("Treeview",
+            background=[('selected', COLORS['accent'])],
+            foreground=[('selected', COLORS['fg'])])
+        
         style.configure("Horizontal.TProgressbar",
             background=COLORS['progress'],
             troughcolor=COLORS['button'],
@@ -145,22 +183,20 @@ class PSDConverterGUI:
         source_frame = ttk.LabelFrame(parent, text="Source Files/Folders")
         source_frame.pack(fill=tk.X, pady=5, padx=5)
         
-        # Create a frame for the listbox and buttons
-        listbox_frame = ttk.Frame(source_frame)
-        listbox_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        # Create a frame for the source list and buttons
+        list_frame = ttk.Frame(source_frame)
+        list_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         
-        # Configure listbox with scrollbar
-        listbox_scrollbar = ttk.Scrollbar(listbox_frame)
-        listbox_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        # Configure source list with scrollbar
+        self.source_scrollbar = ttk.Scrollbar(list_frame)
+        self.source_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
-        self.source_listbox = tk.Listbox(listbox_frame, height=5,
-            bg=COLORS['listbox'],
-            fg=COLORS['fg'],
-            selectbackground=COLORS['accent'],
-            selectforeground=COLORS['fg'],
-            yscrollcommand=listbox_scrollbar.set)
-        self.source_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        listbox_scrollbar.config(command=self.source_listbox.yview)
+        # A tree without columns is a list whose rows can show an image
+        self.source_tree = ttk.Treeview(list_frame, height=3, show='tree', selectmode='browse',
+                                        yscrollcommand=self._on_source_scroll)
+        self.source_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.source_scrollbar.config(command=self.source_tree.yview)
+        self.source_tree.bind('<Configure>', lambda event: self._schedule_thumbnails())
         
         # Buttons frame
         source_buttons_frame = ttk.Frame(source_frame)
@@ -194,6 +230,12 @@ class PSDConverterGUI:
         format_combo.pack(side=tk.LEFT, padx=5)
         format_combo.bind('<<ComboboxSelected>>', self._on_format_change)
         
+        ttk.Label(format_frame, text="Effort:").pack(side=tk.LEFT)
+        # 'default' writes the same files as earlier versions (see core.converter.DEFAULT_EFFORTS)
+        self.effort_var = tk.StringVar(value=DEFAULT_OUTPUT_SETTINGS['effort'] or 'default')
+        ttk.Combobox(format_frame, textvariable=self.effort_var, values=('default',) + ENCODER_EFFORTS,
+                     state="readonly", width=10).pack(side=tk.LEFT, padx=5)
+        
         # Quality slider
         quality_frame = ttk.Frame(output_frame)
         quality_frame.pack(fill=tk.X, padx=5, pady=5)
@@ -228,15 +270,32 @@ class PSDConverterGUI:
         options_frame.pack(fill=tk.X, padx=5, pady=5)
         
         self.lossless_var = tk.BooleanVar(value=False)
-        self.optimize_var = tk.BooleanVar(value=True)
         self.detailed_output_var = tk.BooleanVar(value=False)
+        self.skip_unchanged_var = tk.BooleanVar(value=SKIP_UNCHANGED)
+        self.resume_var = tk.BooleanVar(value=False)
+        self.embed_profile_var = tk.BooleanVar(value=DEFAULT_OUTPUT_SETTINGS['embed_profile'])
+        self.export_layers_var = tk.BooleanVar(value=DEFAULT_OUTPUT_SETTINGS['export_layers'])
         
         ttk.Checkbutton(options_frame, text="Lossless", variable=self.lossless_var).pack(side=tk.LEFT, padx=5)
-        ttk.Checkbutton(options_frame, text="Optimize", variable=self.optimize_var).pack(side=tk.LEFT, padx=5)
         ttk.Checkbutton(options_frame, text="Detailed Output", variable=self.detailed_output_var).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(options_frame, text="Skip Unchanged", variable=self.skip_unchanged_var).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(options_frame, text="Resume", variable=self.resume_var).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(options_frame, text="Embed sRGB Profile", variable=self.embed_profile_var).pack(side=tk.LEFT, padx=5)
+        
+        # Layer export options
+        layer_frame = ttk.Frame(output_frame)
+        layer_frame.pack(fill=tk.X, padx=5, pady=5)
+        ttk.Checkbutton(layer_frame, text="Export Layers", variable=self.export_layers_var).pack(side=tk.LEFT, padx=5)
+        
+        # Identical source files are converted once; their copies get links or copies of the output
+        ttk.Label(layer_frame, text="Duplicates:").pack(side=tk.LEFT)
+        self.dedup_var = tk.StringVar(value=DEDUP_MODE or "convert")
+        ttk.Combobox(layer_frame, textvariable=self.dedup_var, values=("convert",) + DEDUP_MODES, state="readonly",
+                     width=10).pack(side=tk.LEFT, padx=5)
         
         # Add Start Conversion button under output settings
-        ttk.Button(output_frame, text="Start Conversion", command=self.start_conversion).pack(fill=tk.X, padx=5, pady=10)
+        self.start_button = ttk.Button(output_frame, text="Start Conversion", command=self.start_conversion)
+        self.start_button.pack(fill=tk.X, padx=5, pady=10)
 
     def _create_progress_section(self, parent):
         progress_frame = ttk.LabelFrame(parent, text="Progress")
@@ -271,7 +330,11 @@ class PSDConverterGUI:
         button_container = ttk.Frame(control_frame)
         button_container.pack(fill=tk.X, padx=5)
         
-        # Only keep Clear All button at the bottom
+        self.pause_button = ttk.Button(button_container, text="Pause", command=self.toggle_pause, state=tk.DISABLED)
+        self.pause_button.pack(side=tk.LEFT, padx=5)
+        self.cancel_button = ttk.Button(button_container, text="Cancel", command=self.cancel_conversion, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+        
         ttk.Button(button_container, text="Clear All", command=self.clear_all).pack(side=tk.RIGHT, padx=5)
 
     def _on_format_change(self, event=None):
@@ -294,25 +357,76 @@ class PSDConverterGUI:
     def add_file(self):
         files = filedialog.askopenfilenames(
             title="Select PSD Files",
-            filetypes=[("Photoshop Files", "*.psd")]
+            filetypes=[("Photoshop Files", "*.psd *.psb")]
         )
         for file in files:
             if file not in self.source_paths:
                 self.source_paths.append(file)
-                self.source_listbox.insert(tk.END, file)
+                self.source_tree.insert('', tk.END, text=file)
+        self._schedule_thumbnails()
     
     def add_folder(self):
         folder = filedialog.askdirectory(title="Select Folder with PSD Files")
         if folder and folder not in self.source_paths:
             self.source_paths.append(folder)
-            self.source_listbox.insert(tk.END, folder)
+            self.source_tree.insert('', tk.END, text=folder)
     
     def remove_source(self):
-        selection = self.source_listbox.curselection()
+        selection = self.source_tree.selection()
         if selection:
-            index = selection[0]
-            self.source_listbox.delete(index)
+            item = selection[0]
+            index = self.source_tree.index(item)
+            self.source_tree.delete(item)
             self.source_paths.pop(index)
+            self.thumbnail_photos.pop(item, None)
+            self.requested_thumbnails.discard(item)
+    
+    def _on_source_scroll(self, first, last):
+        self.source_scrollbar.set(first, last)
+        self._schedule_thumbnails()
+    
+    def _schedule_thumbnails(self):
+        """Requests thumbnails for the visible rows once the list has settled"""
+        if not self.thumbnail_update_pending:
+            self.thumbnail_update_pending = True
+            self.root.after_idle(self._request_visible_thumbnails)
+    
+    def _request_visible_thumbnails(self):
+        self.thumbnail_update_pending = False
+        item = self.source_tree.identify_row(1)
+        # Rows scrolled out of view have no bounding box
+        while item and self.source_tree.bbox(item):
+            if item not in self.requested_thumbnails:
+                self.requested_thumbnails.add(item)
+                path = self.source_tree.item(item, 'text')
+                if os.path.isfile(path):
+                    self.thumbnail_requests.put((item, path))
+            item = self.source_tree.next(item)
+        
+        if self.thumbnail_thread is None and not self.thumbnail_requests.empty():
+            self.thumbnail_thread = threading.Thread(target=self._run_thumbnails, daemon=True)
+            self.thumbnail_thread.start()
+    
+    def _run_thumbnails(self):
+        """Makes requested thumbnails on a background thread, reporting through the message queue"""
+        try:
+            service = ThumbnailService((THUMBNAIL_SIZE, THUMBNAIL_SIZE), THUMBNAIL_CACHE_DIR,
+                                       THUMBNAIL_CACHE_MAX_MB * 1024 * 1024)
+        except OSError as e:
+            print(f"Thumbnails disabled: {e}")
+            return
+        while True:
+            item, path = self.thumbnail_requests.get()
+            image = service.get(path)
+            if image is not None:
+                self.message_queue.put(('thumbnail', item, image))
+    
+    def _show_thumbnail(self, item, image):
+        # The row may have been removed while its thumbnail was made
+        if self.source_tree.exists(item):
+            photo = ImageTk.PhotoImage(image)
+            self.thumbnail_photos[item] = photo
+            self.source_tree.item(item, image=photo)
     
     def select_output_dir(self):
         directory = filedialog.askdirectory(title="Select Output Directory")
@@ -320,22 +434,77 @@ class PSDConverterGUI:
             self.output_dir_var.set(directory)
     
     def log_message(self, message):
-        """Log a message to both the status text and console if detailed output is enabled"""
-        self.status_text.insert(tk.END, message + "\n")
-        self.status_text.see(tk.END)
-        self.root.update()
+        """Queue a message for the status text; safe to call from any thread"""
+        self.message_queue.put(('log', message))
         
         if self.output_settings.detailed_output:
             print(message)
     
+    def _process_message_queue(self):
+        """Apply queued log lines and progress updates in one batch per frame"""
+        lines = []
+        try:
+            while True:
+                kind, *payload = self.message_queue.get_nowait()
+                if kind == 'log':
+                    lines.append(payload[0])
+                elif kind == 'progress':
+                    self.progress_var.set(payload[0])
+                elif kind == 'done':
+                    self._on_conversion_done(*payload)
+                elif kind == 'thumbnail':
+                    self._show_thumbnail(*payload)
+        except queue.Empty:
+            pass
+        
+        if lines:
+            # Only the newest lines can end up in the widget
+            text = "\n".join(lines[-LOG_MAX_LINES:]) + "\n"
+            self.status_text.insert(tk.END, text)
+            line_count = int(self.status_text.index('end-1c').split('.')[0]) - 1
+            if line_count > LOG_MAX_LINES:
+                self.status_text.delete(1.0, f"{line_count - LOG_MAX_LINES + 1}.0")
+            self.status_text.see(tk.END)
+        
+        self.root.after(LOG_UPDATE_INTERVAL_MS, self._process_message_queue)
+    
     def clear_all(self):
         self.source_paths.clear()
-        self.source_listbox.delete(0, tk.END)
+        self.source_tree.delete(*self.source_tree.get_children())
+        self.thumbnail_photos.clear()
+        self.requested_thumbnails.clear()
         self.output_dir_var.set("")
         self.progress_var.set(0)
         self.status_text.delete(1.0, tk.END)
     
+    def toggle_pause(self):
+        if not self.batch_control:
+            return
+        if self.batch_control.is_paused:
+            self.batch_control.resume()
+            self.pause_button.config(text="Pause")
+            self.log_message("Resumed.")
+        else:
+            self.batch_control.pause()
+            self.pause_button.config(text="Resume")
+            self.log_message("Paused after the files currently being converted.")
+    
+    def cancel_conversion(self):
+        if self.batch_control:
+            self.batch_control.cancel()
+            self.pause_button.config(state=tk.DISABLED)
+            self.cancel_button.config(state=tk.DISABLED)
+            self.log_message("Cancelling after the files currently being converted...")
+    
+    def _on_close(self):
+        if self.batch_control:
+            self.batch_control.cancel()
+        self.root.destroy()
+    
     def start_conversion(self):
+        if self.batch_control:
+            return
+        
         if not self.source_paths:
             messagebox.showwarning("Warning", "Please add at least one source file or folder.")
             return
@@ -360,8 +529,11 @@ class PSDConverterGUI:
         self.output_settings.quality = self.quality_var.get()
         self.output_settings.scale = self.scale_var.get()
         self.output_settings.lossless = self.lossless_var.get()
-        self.output_settings.optimize = self.optimize_var.get()
+        self.output_settings.effort = None if self.effort_var.get() == 'default' else self.effort_var.get()
+        self.output_settings.optimize = self.output_settings.effort != 'fast'
         self.output_settings.detailed_output = self.detailed_output_var.get()
+        self.output_settings.embed_profile = self.embed_profile_var.get()
+        self.output_settings.export_layers = self.export_layers_var.get()
         
         # Log initial settings if detailed output is enabled
         if self.output_settings.detailed_output:
@@ -370,51 +542,90 @@ class PSDConverterGUI:
             self.log_message(f"Quality: {self.output_settings.quality}%")
             self.log_message(f"Scale: {self.output_settings.scale}%")
             self.log_message(f"Lossless: {self.output_settings.lossless}")
-            self.log_message(f"Optimize: {self.output_settings.optimize}")
+            self.log_message(f"Effort: {self.output_settings.effort or 'default'}")
             self.log_message("-" * 30)
         
-        total_files = 0
-        for path in self.source_paths:
-            if os.path.isfile(path):
-                if path.lower().endswith(".psd"):
-                    total_files += 1
+        self.batch_control = BatchControl()
+        self.start_button.config(state=tk.DISABLED)
+        self.pause_button.config(state=tk.NORMAL, text="Pause")
+        self.cancel_button.config(state=tk.NORMAL)
+        
+        worker = threading.Thread(
+            target=self._run_conversion,
+            args=(list(self.source_paths), output_dir, self.skip_unchanged_var.get(), self.batch_control,
+                  self.dedup_var.get() if self.dedup_var.get() in DEDUP_MODES else None, self.resume_var.get()),
+            daemon=True)
+        worker.start()
+    
+    def _run_conversion(self, source_paths, output_dir, skip_unchanged, control, dedup=None, resume=False):
+        """Runs the batch on a worker thread, reporting through the message queue"""
+        def on_file_done(result, processed_files, total):
+            if not result.success:
+                status = "Failed"
             else:
-                for root, _, files in os.walk(path):
-                    total_files += sum(1 for f in files if f.lower().endswith(".psd"))
+                status = "Skipped (unchanged)" if result.skipped else "Converted"
+            self.log_message(f"{status}: {result.psd_path}")
+            if result.error:
+                self.log_message(f"  Error: {result.error}")
+            self.message_queue.put(('progress', (processed_files / total) * 100))
+        
+        results = []
+        memory_budget = MEMORY_BUDGET_MB * 1024 * 1024 if MEMORY_BUDGET_MB else None
+        # Stage timings are only collected for the detailed log
+        metrics_sink = AggregateSink() if self.output_settings.detailed_output else None
+        plan = BatchPlan([self.output_settings]) if LONGEST_FIRST else None
+        try:
+            # SQLite connections must stay on the thread that opened them
+            cache = ConversionCache(output_dir, self.output_settings) if skip_unchanged else None
+            journal = BatchJournal(output_dir, self.output_settings, resume=resume) \
+                if BATCH_JOURNAL or resume else None
+            try:
+                results = convert_batch(iter_psd_files(source_paths), output_dir, self.output_settings,
+                                        max_workers=MAX_WORKERS, callback=on_file_done, cache=cache,
+                                        control=control, memory_budget=memory_budget, metrics_sink=metrics_sink,
+                                        prefetch=PIPELINE_PREFETCH, dedup=dedup, journal=journal,
+                                        retries=BATCH_RETRIES, plan=plan)
+            finally:
+                if cache:
+                    cache.close()
+                if journal:
+                    journal.close()
+        except Exception as e:
+            self.log_message(f"\nConversion stopped: {e}")
+
+        stage_lines = metrics_sink.format_summary() if metrics_sink else []
+        if stage_lines:
+            self.log_message("\nTime per stage:")
+            for line in stage_lines:
+                self.log_message(line)
+        plan_lines = plan.format_summary() if plan and self.output_settings.detailed_output else []
+        if plan_lines:
+            self.log_message("\nPredicted against actual time:")
+            for line in plan_lines:
+                self.log_message(line)
+        
+        successful_conversions = sum(1 for result in results if result.success)
+        self.message_queue.put(('done', successful_conversions, len(results), control.is_cancelled))
+    
+    def _on_conversion_done(self, successful_conversions, total_files, cancelled):
+        self.batch_control = None
+        self.start_button.config(state=tk.NORMAL)
+        self.pause_button.config(state=tk.DISABLED, text="Pause")
+        self.cancel_button.config(state=tk.DISABLED)
         
-        if total_files == 0:
+        if total_files == 0 and not cancelled:
             messagebox.showinfo("Info", "No PSD files found in the selected locations.")
             return
         
-        processed_files = 0
-        successful_conversions = 0
-        
-        for source_path in self.source_paths:
-            if os.path.isfile(source_path):
-                if source_path.lower().endswith(".psd"):
-                    self.log_message(f"\nProcessing: {source_path}")
-                    creation_date = get_file_creation_date_str(source_path)
-                    if convert_psd_to_image(source_path, output_dir, self.output_settings, creation_date):
-                        successful_conversions += 1
-                    processed_files += 1
-                    self.progress_var.set((processed_files / total_files) * 100)
-            else:
-                for root, _, files in os.walk(source_path):
-                    for file in files:
-                        if file.lower().endswith(".psd"):
-                            full_path = os.path.join(root, file)
-                            self.log_message(f"\nProcessing: {full_path}")
-                            creation_date = get_file_creation_date_str(full_path)
-                            if convert_psd_to_image(full_path, output_dir, self.output_settings, creation_date):
-                                successful_conversions += 1
-                            processed_files += 1
-                            self.progress_var.set((processed_files / total_files) * 100)
-        
-        self.log_message(f"\nConversion complete!")
+        title = "Conversion cancelled" if cancelled else "Conversion complete"
+        self.log_message(f"\n{title}!")
         self.log_message(f"Successfully converted: {successful_conversions} of {total_files} files")
-        messagebox.showinfo("Complete", f"Conversion complete!\nSuccessfully converted: {successful_conversions} of {total_files} files")
+        messagebox.showinfo("Cancelled" if cancelled else "Complete",
+                            f"{title}!\nSuccessfully converted: {successful_conversions} of {total_files} files")
 
 def main():
+    # Required for the worker processes of frozen (PyInstaller) builds
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = PSDConverterGUI(root)
     root.mainloop()
@@ -1,10 +1,111 @@
 """Utility functions for handling file metadata."""
 
 import os
+import re
+import struct
 from datetime import datetime
-from xml.etree import ElementTree
 from dateutil import parser as date_parser
-from psd_tools import PSDImage
+
+from utils.metrics import NULL_METRICS
+
+# Photoshop image resource ID holding the XMP metadata packet
+XMP_RESOURCE_ID = 1060
+
+# Size of the fixed PSD/PSB file header
+PSD_HEADER_SIZE = 26
+
+# XMP date tags, matched as either an element or an attribute
+_PHOTOSHOP_DATE_CREATED_RE = re.compile(
+    rb'photoshop:DateCreated(?:\s*=\s*["\']([^"\']+)["\']|\s*>\s*([^<]+)<)')
+_DC_DATE_RE = re.compile(
+    rb'<dc:date>\s*(?:<rdf:(?:Seq|Bag|Alt)>\s*<rdf:li[^>]*>)?\s*([^<]+)<')
+
+# ISO-8601 date and time as written by Photoshop, e.g. 2021-03-04T05:06:07.12+01:00
+_ISO_DATE_RE = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.\d+)?)?)?'
+    r'(?:Z|[+-]\d{2}:?\d{2})?$')
+
+class PSDHeader:
+    """Class to hold the fixed header fields of a PSD/PSB file."""
+    def __init__(self, version, channels, height, width, depth, color_mode):
+        self.version = version  # 1 for PSD, 2 for PSB
+        self.channels = channels
+        self.height = height
+        self.width = width
+        self.depth = depth  # Bits per channel
+        self.color_mode = color_mode
+
+def _read_header(fp):
+    """Reads and validates the header at the current position of an open PSD/PSB file."""
+    header = fp.read(PSD_HEADER_SIZE)
+    if len(header) < PSD_HEADER_SIZE or header[:4] != b'8BPS':
+        raise ValueError("not a PSD file")
+    version, channels, height, width, depth, color_mode = struct.unpack('>H6xHIIHH', header[4:])
+    return PSDHeader(version, channels, height, width, depth, color_mode)
+
+def read_psd_header(psd_file_path):
+    """Reads the dimensions, channel count, bit depth and color mode of a PSD/PSB file."""
+    with open(psd_file_path, 'rb') as f:
+        return _read_header(f)
+
+def read_image_resource(fp, resource_id):
+    """
+    Reads the data of one image resource block from an open PSD/PSB file.
+    Only the header, color mode section and resource block headers are read.
+    Returns None if the resource is not present.
+    """
+    return read_image_resources(fp, (resource_id,)).get(resource_id)
+
+def read_image_resources(fp, resource_ids):
+    """
+    Reads the data of several image resource blocks from an open PSD/PSB file in one pass.
+    Returns a dict mapping each resource ID found to its data.
+    """
+    resource_ids = set(resource_ids)
+    found = {}
+    _read_header(fp)
+
+    # Skip the color mode data section
+    (color_mode_length,) = struct.unpack('>I', fp.read(4))
+    fp.seek(color_mode_length, os.SEEK_CUR)
+
+    (resources_length,) = struct.unpack('>I', fp.read(4))
+    position = fp.tell()
+    end = position + resources_length
+    while position + 12 <= end:
+        # Signature, resource ID and the length byte of the Pascal-string name
+        _, block_id, name_length = struct.unpack('>4sHB', fp.read(7))
+        # The name, including its length byte, is padded to an even size
+        fp.seek(name_length + (name_length + 1) % 2, os.SEEK_CUR)
+        (data_length,) = struct.unpack('>I', fp.read(4))
+        if block_id in resource_ids:
+            found[block_id] = fp.read(data_length)
+            if len(found) == len(resource_ids):
+                break
+            # Skip the padding byte of odd-sized data
+            position = fp.seek(data_length & 1, os.SEEK_CUR)
+        else:
+            position = fp.seek(data_length + (data_length & 1), os.SEEK_CUR)
+    return found
+
+def read_xmp_metadata(psd_file_path):
+    """Reads the raw XMP packet from a PSD/PSB file without parsing the rest of it."""
+    with open(psd_file_path, 'rb') as f:
+        return read_image_resource(f, XMP_RESOURCE_ID)
+
+def format_xmp_date(date_string):
+    """
+    Formats an XMP date value as 'YYYY-MM-DD_HHMMSS'.
+    Plain ISO-8601 values are handled directly; anything else goes through dateutil.
+    """
+    match = _ISO_DATE_RE.match(date_string)
+    if match:
+        year, month, day, hour, minute, second = (int(part or 0) for part in match.groups())
+        try:
+            return datetime(year, month, day, hour, minute, second).strftime("%Y-%m-%d_%H%M%S")
+        except ValueError:
+            pass
+    return date_parser.parse(date_string).strftime("%Y-%m-%d_%H%M%S")
 
 def parse_xmp_creation_date(xmp_string):
     """
@@ -12,51 +113,41 @@ def parse_xmp_creation_date(xmp_string):
     Tries photoshop:DateCreated first, then dc:date.
     """
     try:
-        namespaces = {
-            'x': 'adobe:ns:meta/',
-            'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#',
-            'photoshop': 'http://ns.adobe.com/photoshop/1.0/',
-            'dc': 'http://purl.org/dc/elements/1.1/',
-            'xmp': 'http://ns.adobe.com/xap/1.0/'
-        }
-
-        root = ElementTree.fromstring(xmp_string)
-        
+        if isinstance(xmp_string, str):
+            xmp_string = xmp_string.encode('utf-8')
+
         # Try photoshop:DateCreated
-        date_created_element = root.find(".//photoshop:DateCreated", namespaces)
-        if date_created_element is not None and date_created_element.text:
-            dt_obj = date_parser.parse(date_created_element.text)
-            return dt_obj.strftime("%Y-%m-%d_%H%M%S")
+        match = _PHOTOSHOP_DATE_CREATED_RE.search(xmp_string)
+        if match:
+            date_value = match.group(1) or match.group(2)
+            return format_xmp_date(date_value.decode('utf-8').strip())
 
         # Fallback to dc:date
-        dc_date_elements = root.findall(".//dc:date", namespaces)
-        if dc_date_elements:
-            dt_obj = date_parser.parse(dc_date_elements[0].text)
-            return dt_obj.strftime("%Y-%m-%d_%H%M%S")
-            
-    except (ElementTree.ParseError, Exception) as e:
+        match = _DC_DATE_RE.search(xmp_string)
+        if match:
+            return format_xmp_date(match.group(1).decode('utf-8').strip())
+
+    except Exception as e:
         print(f"    Could not parse date from XMP: {e}")
     return None
 
-def get_file_creation_date_str(psd_file_path):
+def get_creation_date_str(psd_file_path, xmp_metadata):
     """
-    Gets the creation date from PSD metadata (XMP) or falls back to file system's ctime.
+    Gets the creation date from already-read XMP metadata or falls back to file system's ctime.
     Returns a string formatted as 'YYYY-MM-DD_HHMMSS'.
     """
-    try:
-        psd_image = PSDImage.open(psd_file_path)
-        if psd_image.xmp_metadata:
-            date_from_xmp = parse_xmp_creation_date(psd_image.xmp_metadata)
-            if date_from_xmp:
-                print(f"  Successfully extracted XMP creation date for {os.path.basename(psd_file_path)}")
-                return date_from_xmp
-            print(f"  XMP metadata found for {os.path.basename(psd_file_path)}, but no recognized creation date tag.")
-        else:
-            print(f"  No XMP metadata found in {os.path.basename(psd_file_path)}.")
-    except Exception as e:
-        print(f"  Could not read or parse PSD metadata for {os.path.basename(psd_file_path)}: {e}")
+    if xmp_metadata:
+        date_from_xmp = parse_xmp_creation_date(xmp_metadata)
+        if date_from_xmp:
+            print(f"  Successfully extracted XMP creation date for {os.path.basename(psd_file_path)}")
+            return date_from_xmp
+        print(f"  XMP metadata found for {os.path.basename(psd_file_path)}, but no recognized creation date tag.")
+    else:
+        print(f"  No XMP metadata found in {os.path.basename(psd_file_path)}.")
+    return get_fallback_date_str(psd_file_path)
 
-    # Fallback to file system timestamp
+def get_fallback_date_str(psd_file_path):
+    """Gets the file system's ctime formatted as 'YYYY-MM-DD_HHMMSS'."""
     print(f"  Falling back to file system timestamp for {os.path.basename(psd_file_path)}.")
     try:
         timestamp = os.path.getctime(psd_file_path)
@@ -64,4 +155,18 @@ def get_file_creation_date_str(psd_file_path):
         return dt_object.strftime("%Y-%m-%d_%H%M%S")
     except Exception as e:
         print(f"  Could not get file system timestamp for {os.path.basename(psd_file_path)}: {e}")
-        return datetime.now().strftime("%Y-%m-%d_%H%M%S") + "_fallback" 
\ No newline at end of file
+        return datetime.now().strftime("%Y-%m-%d_%H%M%S") + "_fallback"
+
+def get_file_creation_date_str(psd_file_path, metrics=NULL_METRICS):
+    """
+    Gets the creation date from PSD metadata (XMP) or falls back to file system's ctime.
+    Returns a string formatted as 'YYYY-MM-DD_HHMMSS'.
+    """
+    try:
+        with metrics.stage('metadata') as stage:
+            xmp_metadata = read_xmp_metadata(psd_file_path)
+            stage.count(bytes_read=len(xmp_metadata or b''))
+            return get_creation_date_str(psd_file_path, xmp_metadata)
+    except Exception as e:
+        print(f"  Could not read or parse PSD metadata for {os.path.basename(psd_file_path)}: {e}")
+    return get_fallback_date_str(psd_file_path)
@@ -0,0 +1,170 @@
+"""Per-stage timing and counters for the conversion path."""
+
+import json
+import logging
+import math
+import threading
+import time
+
+_logger = logging.getLogger("psd_converter.metrics")
+
+class _StageTimer:
+    """Context manager that times one stage and records it with its counters."""
+    def __init__(self, metrics, name, counters):
+        self._metrics = metrics
+        self._name = name
+        self.counters = counters
+
+    def count(self, **counters):
+        """Adds counters (e.g. bytes_read, bytes_written, pixels) to the stage."""
+        self.counters.update(counters)
+
+    def __enter__(self):
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._metrics.add(self._name, time.perf_counter() - self._wall_start,
+                          time.thread_time() - self._cpu_start, **self.counters)
+
+class _NullStageTimer:
+    """Stage timer used when metrics are disabled. Does nothing."""
+    counters = {}
+
+    def count(self, **counters):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_NULL_STAGE_TIMER = _NullStageTimer()
+
+class FileMetrics:
+    """
+    Class to hold the stage timings of one converted file.
+    Each stage is a plain dict so it can be returned from a worker process.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.stages = []
+
+    def stage(self, name, **counters):
+        """Returns a context manager that times a stage: with metrics.stage('decode') as stage: ..."""
+        return _StageTimer(self, name, counters)
+
+    def add(self, name, wall_seconds, cpu_seconds, **counters):
+        self.stages.append(dict(stage=name, wall_seconds=wall_seconds, cpu_seconds=cpu_seconds, **counters))
+
+class _NullMetrics:
+    """Stand-in for FileMetrics when instrumentation is disabled."""
+    enabled = False
+    stages = []
+
+    def stage(self, name, **counters):
+        return _NULL_STAGE_TIMER
+
+    def add(self, name, wall_seconds, cpu_seconds, **counters):
+        pass
+
+NULL_METRICS = _NullMetrics()
+
+def percentile(sorted_values, fraction):
+    """Returns the nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+class LoggingSink:
+    """Writes each file's stages to the 'psd_converter.metrics' logger."""
+    def __init__(self, level=logging.INFO):
+        self.level = level
+
+    def record(self, psd_path, stages):
+        for stage in stages:
+            counters = ", ".join(f"{key}={value}" for key, value in stage.items()
+                                 if key not in ('stage', 'wall_seconds', 'cpu_seconds'))
+            _logger.log(self.level, "%s %s: %.1f ms wall, %.1f ms cpu%s", psd_path, stage['stage'],
+                        stage['wall_seconds'] * 1000, stage['cpu_seconds'] * 1000,
+                        f" ({counters})" if counters else "")
+
+    def close(self):
+        pass
+
+class JsonLinesSink:
+    """Appends one JSON object per file and stage to a file."""
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def record(self, psd_path, stages):
+        for stage in stages:
+            self._file.write(json.dumps(dict(path=psd_path, **stage)) + "\n")
+
+    def close(self):
+        self._file.close()
+
+class AggregateSink:
+    """Collects stage timings in memory and summarizes them per stage."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wall = {}
+        self._cpu = {}
+        self._counters = {}
+
+    def record(self, psd_path, stages):
+        with self._lock:
+            for stage in stages:
+                name = stage['stage']
+                self._wall.setdefault(name, []).append(stage['wall_seconds'])
+                self._cpu.setdefault(name, []).append(stage['cpu_seconds'])
+                totals = self._counters.setdefault(name, {})
+                for key, value in stage.items():
+                    if key not in ('stage', 'wall_seconds', 'cpu_seconds') and isinstance(value, (int, float)):
+                        totals[key] = totals.get(key, 0) + value
+
+    def summary(self):
+        """
+        Returns {stage: {count, p50_ms, p95_ms, total_ms, cpu_total_ms, <counter totals>}}
+        with wall times in milliseconds.
+        """
+        with self._lock:
+            summary = {}
+            for name, wall in self._wall.items():
+                wall = sorted(wall)
+                summary[name] = dict(
+                    count=len(wall),
+                    p50_ms=round(percentile(wall, 0.50) * 1000, 3),
+                    p95_ms=round(percentile(wall, 0.95) * 1000, 3),
+                    total_ms=round(sum(wall) * 1000, 3),
+                    cpu_total_ms=round(sum(self._cpu[name]) * 1000, 3),
+                    **self._counters[name])
+            return summary
+
+    def format_summary(self):
+        """Returns the summary as printable lines."""
+        lines = []
+        for name, stage in self.summary().items():
+            lines.append(f"  {name:<16} p50 {stage['p50_ms']:>9.1f} ms   p95 {stage['p95_ms']:>9.1f} ms"
+                         f"   total {stage['total_ms'] / 1000:>8.2f} s ({stage['count']} runs)")
+        return lines
+
+    def close(self):
+        pass
+
+class MultiSink:
+    """Forwards records to several sinks."""
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def record(self, psd_path, stages):
+        for sink in self.sinks:
+            sink.record(psd_path, stages)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
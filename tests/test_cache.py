@@ -0,0 +1,80 @@
+"""Tests for the conversion manifest."""
+
+import os
+import sqlite3
+import sys
+
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'src'))
+sys.path.append(os.path.join(ROOT, 'benchmarks'))
+
+from core.batch import convert_batch
+from core.cache import CACHE_FILENAME, ConversionCache
+from core.converter import OutputSettings
+from synthetic import write_psd
+
+def _convert(psd_paths, output_dir, output_settings):
+    with ConversionCache(str(output_dir), output_settings) as cache:
+        return convert_batch([str(path) for path in psd_paths], str(output_dir), output_settings, max_workers=1,
+                             cache=cache)
+
+def test_changed_settings_rewrite_outputs_in_place(tmp_path):
+    psd_path = tmp_path / 'a.psd'
+    write_psd(str(psd_path), 32, 32)
+    output_dir = tmp_path / 'out'
+    first = _convert([psd_path], output_dir, OutputSettings(format='png'))[0]
+
+    second = _convert([psd_path], output_dir, OutputSettings(format='png', effort='fast'))[0]
+
+    assert not second.skipped
+    assert second.output_paths == first.output_paths
+    assert [name for name in os.listdir(output_dir) if name.endswith('.png')] == [os.path.basename(first.output_path)]
+
+def test_unchanged_file_is_skipped(tmp_path):
+    psd_path = tmp_path / 'a.psd'
+    write_psd(str(psd_path), 32, 32)
+    output_dir = tmp_path / 'out'
+    first = _convert([psd_path], output_dir, OutputSettings(format='png'))[0]
+    mtime_ns = os.stat(first.output_path).st_mtime_ns
+
+    second = _convert([psd_path], output_dir, OutputSettings(format='png'))[0]
+
+    assert second.skipped and second.success
+    assert second.output_paths == first.output_paths
+    assert os.stat(first.output_path).st_mtime_ns == mtime_ns
+
+def test_changed_source_is_converted_again_in_place(tmp_path):
+    psd_path = tmp_path / 'a.psd'
+    write_psd(str(psd_path), 32, 32)
+    output_dir = tmp_path / 'out'
+    first = _convert([psd_path], output_dir, OutputSettings(format='png'))[0]
+    write_psd(str(psd_path), 48, 16)
+    # Make sure the change shows even on file systems with coarse timestamps
+    stat = os.stat(psd_path)
+    os.utime(psd_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    second = _convert([psd_path], output_dir, OutputSettings(format='png'))[0]
+
+    assert not second.skipped and second.success
+    assert second.output_paths == first.output_paths
+    with Image.open(second.output_path) as output:
+        assert output.size == (48, 16)
+    assert [name for name in os.listdir(output_dir) if name.endswith('.png')] == [os.path.basename(first.output_path)]
+
+def test_rows_of_dropped_variants_are_deleted(tmp_path):
+    psd_path = tmp_path / 'a.psd'
+    write_psd(str(psd_path), 32, 32)
+    output_dir = tmp_path / 'out'
+    recipe = [OutputSettings(format='png'), OutputSettings(format='png', scale=50, name_suffix='_small')]
+    _convert([psd_path], output_dir, recipe)
+
+    _convert([psd_path], output_dir, recipe[:1])
+
+    connection = sqlite3.connect(str(output_dir / CACHE_FILENAME))
+    try:
+        variants = [row[0] for row in connection.execute("SELECT variant FROM conversions")]
+    finally:
+        connection.close()
+    assert variants == [0]
@@ -0,0 +1,59 @@
+"""Tests for duplicate detection and linking."""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import core.dedup
+from core.converter import OutputSettings, collect_errors
+from core.dedup import Deduplicator, link_file
+from core.naming import remove_temp_files
+from core.result import ConversionResult
+
+def test_link_file_replaces_target_without_leaving_temp_files(tmp_path):
+    source = tmp_path / 'source.png'
+    source.write_bytes(b'new')
+    target = tmp_path / 'target.png'
+    target.write_bytes(b'old')
+
+    assert link_file(str(source), str(target), 'hardlink') in ('hardlink', 'copy')
+    assert target.read_bytes() == b'new'
+    assert sorted(os.listdir(tmp_path)) == ['source.png', 'target.png']
+    assert remove_temp_files(str(tmp_path)) == 0
+
+def test_held_back_duplicates_are_reported_when_the_batch_stops(tmp_path):
+    for name in ('a.psd', 'b.psd'):
+        (tmp_path / name).write_bytes(b'8BPS same content')
+    deduplicator = Deduplicator('copy')
+    work = [(str(tmp_path / name), None) for name in ('a.psd', 'b.psd')]
+
+    passed = list(deduplicator.filter_work(work, str(tmp_path / 'out'), [OutputSettings(format='png')]))
+
+    assert passed == [work[0]]
+    results = deduplicator.drain()
+    assert [result.psd_path for result in results] == [work[1][0]]
+    assert results[0].skipped and not results[0].success
+    assert 'a.psd' in results[0].error
+    assert deduplicator.drain() == []
+
+def test_failed_materialize_removes_the_allocated_name_and_reports_the_error(tmp_path, monkeypatch):
+    out_dir = tmp_path / 'out'
+    out_dir.mkdir()
+    original_output = out_dir / 'original.png'
+    original_output.write_bytes(b'png')
+    duplicate = tmp_path / 'b.psd'
+    duplicate.write_bytes(b'8BPS same content')
+    original = ConversionResult(str(tmp_path / 'a.psd'), True, output_paths=[str(original_output)])
+
+    def failing_link_file(source_path, target_path, mode):
+        raise OSError('disk full')
+    monkeypatch.setattr(core.dedup, 'link_file', failing_link_file)
+
+    with collect_errors() as errors:
+        result = Deduplicator('copy').materialize(
+            original, str(duplicate), None, str(out_dir), [OutputSettings(format='png')])
+
+    assert not result.success
+    assert errors == ['disk full']
+    assert os.listdir(out_dir) == ['original.png']
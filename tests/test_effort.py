@@ -0,0 +1,19 @@
+"""Tests for the encoder effort tiers."""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from core.converter import OutputSettings, _get_save_kwargs
+
+def test_default_effort_keeps_the_earlier_encoding():
+    assert _get_save_kwargs(OutputSettings(format='png')) == {'format': 'PNG', 'optimize': True}
+    assert _get_save_kwargs(OutputSettings(format='png', optimize=False)) == {'format': 'PNG', 'compress_level': 6}
+    assert _get_save_kwargs(OutputSettings(format='tiff')) == {'format': 'TIFF', 'compression': 'tiff_lzw'}
+    assert _get_save_kwargs(OutputSettings(format='tiff', optimize=False)) == {'format': 'TIFF', 'compression': 'raw'}
+    assert _get_save_kwargs(OutputSettings(format='jpg', optimize=False))['optimize'] is False
+
+def test_chosen_effort_overrides_optimize():
+    assert _get_save_kwargs(OutputSettings(format='png', effort='balanced')) == {'format': 'PNG', 'compress_level': 6}
+    assert _get_save_kwargs(OutputSettings(format='webp', optimize=False, effort='smallest'))['method'] == 6
@@ -0,0 +1,40 @@
+"""Tests for reading and scaling down 16-bit grayscale images."""
+
+import os
+import sys
+
+from PIL import Image, ImageChops
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'src'))
+sys.path.append(os.path.join(ROOT, 'benchmarks'))
+
+from core import streaming
+from core.converter import OutputSettings, collect_errors, convert_psd_to_images
+from core.flatten import to_8bit
+from synthetic import COLOR_MODE_GRAYSCALE, COMPRESSION_RLE, write_psd
+
+def test_to_8bit_scales_16bit_values():
+    image = Image.frombytes('I;16B', (3, 1), bytes([0x00, 0x00, 0x80, 0x00, 0xff, 0xff]))
+    result = to_8bit(image)
+    assert result.mode == 'L'
+    assert [result.getpixel((x, 0)) for x in range(3)] == [0, 128, 255]
+
+def test_16bit_grayscale_psd_converts_like_the_streaming_reader(tmp_path):
+    psd_path = str(tmp_path / 'gray16.psd')
+    write_psd(psd_path, 64, 48, color_mode=COLOR_MODE_GRAYSCALE, channels=1, depth=16, compression=COMPRESSION_RLE)
+    output_dir = str(tmp_path / 'out')
+
+    with collect_errors() as errors:
+        assert convert_psd_to_images(psd_path, output_dir, [OutputSettings(format='png')])
+    assert errors == []
+
+    (output_name,) = os.listdir(output_dir)
+    with Image.open(os.path.join(output_dir, output_name)) as output:
+        output.load()
+    with open(psd_path, 'rb') as source:
+        reader = streaming.MergedImageReader(source)
+        expected = reader.read_rows(0, reader.height)
+    assert output.mode == 'L'
+    assert output.size == (64, 48)
+    assert ImageChops.difference(output, expected).getextrema()[1] <= 1
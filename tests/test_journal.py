@@ -0,0 +1,30 @@
+"""Tests for the batch journal."""
+
+import os
+import sqlite3
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from core.batch import convert_batch
+from core.converter import OutputSettings
+from core.journal import FAILED, JOURNAL_FILENAME, BatchJournal
+
+def test_failed_file_is_journaled_with_its_error(tmp_path):
+    psd_path = tmp_path / 'bad.psd'
+    psd_path.write_bytes(b'8BPS not really a PSD')
+    output_dir = tmp_path / 'out'
+    output_settings = OutputSettings(format='png')
+
+    with BatchJournal(str(output_dir), output_settings) as journal:
+        results = convert_batch([str(psd_path)], str(output_dir), output_settings, max_workers=1,
+                                journal=journal, retries=1)
+
+    assert not results[0].success
+    assert results[0].error
+    connection = sqlite3.connect(str(output_dir / JOURNAL_FILENAME))
+    state, attempts, error = connection.execute("SELECT state, attempts, error FROM files").fetchone()
+    connection.close()
+    assert state == FAILED
+    assert attempts == 2
+    assert error
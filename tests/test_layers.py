@@ -0,0 +1,31 @@
+"""Tests for layer export."""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'src'))
+sys.path.append(os.path.join(ROOT, 'benchmarks'))
+
+from core.batch import convert_batch
+from core.converter import OutputSettings
+from synthetic import write_psd
+
+def _export(tmp_path, layer_names):
+    psd_path = str(tmp_path / 'layered.psd')
+    write_psd(psd_path, 64, 48, layers=2)
+    output_dir = tmp_path / 'out'
+    output_settings = OutputSettings(format='png', export_layers=True, layer_names=layer_names)
+    return convert_batch([psd_path], str(output_dir), output_settings, max_workers=1)[0], output_dir
+
+def test_layers_are_exported_to_a_folder(tmp_path):
+    result, output_dir = _export(tmp_path, None)
+    assert result.success
+    assert os.path.isdir(result.output_path)
+    assert os.listdir(result.output_path)
+
+def test_no_matching_layer_fails_without_a_folder(tmp_path):
+    result, output_dir = _export(tmp_path, ['missing_*'])
+    assert not result.success
+    assert 'missing_*' in result.error
+    assert not output_dir.exists() or os.listdir(output_dir) == []
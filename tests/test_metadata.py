@@ -0,0 +1,60 @@
+"""Tests for reading image resources and the XMP creation date."""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'src'))
+sys.path.append(os.path.join(ROOT, 'benchmarks'))
+
+from synthetic import make_thumbnail_resource, make_xmp, write_psd
+from utils.metadata import XMP_RESOURCE_ID, parse_xmp_creation_date, read_image_resources
+
+ICC_PROFILE_RESOURCE_ID = 1039
+THUMBNAIL_RESOURCE_ID = 1036
+
+def _description(content, attributes=''):
+    return (
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+        '<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/"'
+        f' xmlns:photoshop="http://ns.adobe.com/photoshop/1.0/"{attributes}>{content}'
+        '</rdf:Description></rdf:RDF></x:xmpmeta>')
+
+def test_date_created_element():
+    assert parse_xmp_creation_date(make_xmp('2021-03-04T05:06:07.12+01:00')) == '2021-03-04_050607'
+
+def test_date_created_attribute():
+    xmp = _description('', ' photoshop:DateCreated="2019-12-31T23:59"')
+    assert parse_xmp_creation_date(xmp) == '2019-12-31_235900'
+
+def test_dc_date_is_the_fallback():
+    xmp = _description('<dc:date><rdf:Seq><rdf:li>2020-02-29T12:00:01Z</rdf:li></rdf:Seq></dc:date>')
+    assert parse_xmp_creation_date(xmp) == '2020-02-29_120001'
+
+def test_date_created_wins_over_dc_date():
+    xmp = _description('<dc:date><rdf:Seq><rdf:li>2020-02-29</rdf:li></rdf:Seq></dc:date>',
+                       ' photoshop:DateCreated="2018-01-02"')
+    assert parse_xmp_creation_date(xmp) == '2018-01-02_000000'
+
+def test_non_iso_dates_go_through_dateutil():
+    assert parse_xmp_creation_date(make_xmp('March 4, 2021 5:06:07 AM')) == '2021-03-04_050607'
+
+def test_malformed_or_missing_dates_give_none():
+    assert parse_xmp_creation_date(make_xmp('2021-13-45T99:99:99')) is None
+    assert parse_xmp_creation_date(make_xmp('not a date')) is None
+    assert parse_xmp_creation_date(_description('<dc:format>image/png</dc:format>')) is None
+
+def test_read_image_resources_reads_only_the_requested_blocks(tmp_path):
+    psd_path = str(tmp_path / 'a.psd')
+    # An odd-sized profile checks that the padding byte after its data is skipped
+    icc = b'\x01\x02\x03'
+    xmp = make_xmp()
+    write_psd(psd_path, 8, 8, xmp=xmp, icc=icc, thumbnail=(1, 1, b'\xff\xd8\xff\xd9'))
+
+    with open(psd_path, 'rb') as f:
+        resources = read_image_resources(f, (ICC_PROFILE_RESOURCE_ID, XMP_RESOURCE_ID, 1234))
+    assert resources == {ICC_PROFILE_RESOURCE_ID: icc, XMP_RESOURCE_ID: xmp}
+
+    with open(psd_path, 'rb') as f:
+        resources = read_image_resources(f, (THUMBNAIL_RESOURCE_ID,))
+    assert resources == {THUMBNAIL_RESOURCE_ID: make_thumbnail_resource(1, 1, b'\xff\xd8\xff\xd9')}
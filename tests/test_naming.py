@@ -0,0 +1,45 @@
+"""Tests for unique output name allocation."""
+
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from core.naming import OutputNameAllocator, allocate_directory
+
+def _allocate_concurrently(allocators, count):
+    """Allocates the same base name count times from several threads, cycling through allocators."""
+    start = threading.Barrier(8)
+
+    def allocate(index):
+        if index < 8:
+            start.wait()
+        return allocators[index % len(allocators)].allocate('2021-03-04_050607', 'png')
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        return list(executor.map(allocate, range(count)))
+
+def test_concurrent_allocations_get_distinct_suffixes(tmp_path):
+    (tmp_path / '2021-03-04_050607.png').write_bytes(b'existing')
+
+    paths = _allocate_concurrently([OutputNameAllocator(str(tmp_path))], 40)
+
+    names = sorted(os.path.basename(path) for path in paths)
+    assert names == sorted(f'2021-03-04_050607_{counter}.png' for counter in range(1, 41))
+    assert all(os.path.getsize(path) == 0 for path in paths)
+
+def test_allocators_sharing_a_directory_never_hand_out_the_same_name(tmp_path):
+    # Separate allocators stand in for other processes; only the exclusive create keeps them apart
+    allocators = [OutputNameAllocator(str(tmp_path)) for _ in range(3)]
+
+    paths = _allocate_concurrently(allocators, 30)
+
+    assert len(set(paths)) == 30
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(path) for path in paths)
+
+def test_allocate_directory_skips_taken_names(tmp_path):
+    (tmp_path / 'layers').mkdir()
+    assert allocate_directory(str(tmp_path), 'layers') == str(tmp_path / 'layers_1')
+    assert allocate_directory(str(tmp_path), 'layers') == str(tmp_path / 'layers_2')
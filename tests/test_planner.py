@@ -0,0 +1,44 @@
+"""Tests for longest-first batch planning."""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'src'))
+sys.path.append(os.path.join(ROOT, 'benchmarks'))
+
+from core.converter import OutputSettings
+from core.planner import BatchPlan
+from synthetic import write_psd
+
+def _write(tmp_path, sizes):
+    paths = []
+    for index, size in enumerate(sizes):
+        paths.append(str(tmp_path / f'{index}.psd'))
+        write_psd(paths[-1], size, size)
+    return paths
+
+def test_files_are_ordered_within_the_window(tmp_path):
+    paths = _write(tmp_path, [8, 16, 64, 32, 128])
+    plan = BatchPlan([OutputSettings(format='png')], window=3)
+
+    order = [item[0] for item in plan.order((path, None) for path in paths)]
+
+    # 64 was dispatched before 128 was scanned; everything still held waits for 128
+    assert order == [paths[2], paths[4], paths[3], paths[1], paths[0]]
+    assert [row[0] for row in plan.report()] == order
+
+def test_window_holds_files_from_the_start(tmp_path):
+    paths = _write(tmp_path, [8, 16, 32])
+    plan = BatchPlan([OutputSettings(format='png')], window=3)
+    scanned = []
+
+    def scan():
+        for path in paths:
+            scanned.append(path)
+            yield path, None
+
+    ordered = plan.order(scan())
+    assert next(ordered)[0] == paths[2]
+    assert scanned == paths
+    ordered.close()
@@ -0,0 +1,54 @@
+"""Tests for strip-streaming conversion."""
+
+import os
+import sys
+
+import pytest
+from PIL import Image, ImageChops
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'src'))
+sys.path.append(os.path.join(ROOT, 'benchmarks'))
+
+from core import streaming
+from core.converter import OutputSettings
+from synthetic import COLOR_MODE_GRAYSCALE, COLOR_MODE_RGB, COMPRESSION_RLE, write_psd
+
+def _stream(tmp_path, monkeypatch, color_mode, channels, output_format, scale):
+    """Streams a synthetic PSD in several strips. Returns (output image, whole composite resized at once)."""
+    monkeypatch.setattr(streaming, 'STREAM_STRIP_ROWS', 64)
+    psd_path = str(tmp_path / 'source.psd')
+    write_psd(psd_path, 640, 480, color_mode=color_mode, channels=channels, compression=COMPRESSION_RLE)
+    output_path = str(tmp_path / f'output.{output_format}')
+    streaming.stream_psd_to_file(psd_path, output_path, OutputSettings(format=output_format, scale=scale))
+    with open(psd_path, 'rb') as source:
+        reader = streaming.MergedImageReader(source)
+        composite = reader.read_rows(0, reader.height)
+    with Image.open(output_path) as output:
+        output.load()
+    return output, composite.resize(output.size, Image.Resampling.LANCZOS)
+
+def _max_difference(first, second):
+    extrema = ImageChops.difference(first, second).getextrema()
+    return max(high for _, high in extrema) if isinstance(extrema[0], tuple) else extrema[1]
+
+def test_grayscale_alpha_is_kept(tmp_path, monkeypatch):
+    output, expected = _stream(tmp_path, monkeypatch, COLOR_MODE_GRAYSCALE, 2, 'png', 100)
+    assert output.mode == 'LA'
+    assert _max_difference(output, expected) == 0
+    assert output.getchannel('A').getextrema() != (255, 255)
+
+@pytest.mark.parametrize('scale', [37, 71])
+def test_opaque_strips_match_whole_resize(tmp_path, monkeypatch, scale):
+    output, expected = _stream(tmp_path, monkeypatch, COLOR_MODE_RGB, 3, 'tiff', scale)
+    assert _max_difference(output, expected) <= 1
+
+@pytest.mark.parametrize('color_mode, channels, premultiplied', [
+    (COLOR_MODE_RGB, 4, 'RGBa'),
+    (COLOR_MODE_GRAYSCALE, 2, 'La'),
+])
+@pytest.mark.parametrize('scale', [37, 71])
+def test_transparent_strips_match_whole_resize(tmp_path, monkeypatch, color_mode, channels, premultiplied, scale):
+    output, expected = _stream(tmp_path, monkeypatch, color_mode, channels, 'tiff', scale)
+    assert _max_difference(output.getchannel('A'), expected.getchannel('A')) <= 1
+    assert _max_difference(output.convert(premultiplied), expected.convert(premultiplied)) <= 2
@@ -0,0 +1,82 @@
+"""Tests for the shared-filesystem task queue."""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from core.converter import OutputSettings
+from core.taskqueue import (DONE_DIR, LEASED_DIR, PENDING_DIR, RELEASING_DIR, QueueWorker, create_task_queue,
+                            get_queue_status)
+
+def _queue(tmp_path, file_count):
+    queue_dir = str(tmp_path / 'queue')
+    create_task_queue(queue_dir, [str(tmp_path / f'{index}.psd') for index in range(file_count)],
+                      str(tmp_path / 'out'), OutputSettings(format='png'), task_size=file_count)
+    return queue_dir
+
+def _hold(worker):
+    worker._filesystem_time()  # Starts the worker's heartbeat file
+    task = worker._claim()
+    worker._held[task['sequence']] = task
+    return task
+
+def test_release_of_a_reclaimed_lease_leaves_it_alone(tmp_path):
+    queue_dir = _queue(tmp_path, 2)
+    worker = QueueWorker(queue_dir, worker_id='a')
+    task = _hold(worker)
+    # Another worker reclaims the expired lease and claims the task again
+    reclaimed_path = os.path.join(queue_dir, LEASED_DIR, '00000000-1@b.json')
+    os.rename(task['lease_path'], reclaimed_path)
+
+    worker._release(task)
+
+    assert os.listdir(os.path.join(queue_dir, PENDING_DIR)) == []
+    assert os.listdir(os.path.join(queue_dir, LEASED_DIR)) == ['00000000-1@b.json']
+
+def test_reports_of_a_task_claimed_again_are_kept(tmp_path):
+    queue_dir = _queue(tmp_path, 2)
+    worker = QueueWorker(queue_dir, worker_id='a')
+    task = _hold(worker)
+    task['results'].append({'path': task['files'][0], 'success': True, 'error': None, 'outputs': []})
+    worker._release(task)
+
+    # Claimed again by the same worker with the same attempt number
+    task = _hold(worker)
+    assert task['files'] == [str(tmp_path / '1.psd')]
+    task['results'].append({'path': task['files'][0], 'success': False, 'error': 'bad', 'outputs': []})
+    worker._finish(task)
+
+    assert len(os.listdir(os.path.join(queue_dir, DONE_DIR))) == 2
+    status = get_queue_status(queue_dir)
+    assert (status[DONE_DIR], status['converted_files'], status['failed_files']) == (1, 1, 1)
+    assert os.listdir(os.path.join(queue_dir, LEASED_DIR)) == []
+
+def test_lease_being_finished_is_left_alone_while_its_worker_lives(tmp_path):
+    queue_dir = _queue(tmp_path, 1)
+    worker = QueueWorker(queue_dir, worker_id='a')
+    task = _hold(worker)
+    os.utime(task['lease_path'], (0, 0))  # Long expired, but not reclaimed yet
+    taken_path = worker._take_lease(task)
+
+    assert QueueWorker(queue_dir, worker_id='b').reclaim_expired() == 0
+    assert os.path.exists(taken_path)
+
+def test_reclaim_during_finish_loses_the_lease_without_failing(tmp_path, monkeypatch):
+    queue_dir = _queue(tmp_path, 1)
+    worker = QueueWorker(queue_dir, worker_id='a')
+    other = QueueWorker(queue_dir, worker_id='b')
+    task = _hold(worker)
+    report = worker._report
+
+    def stall_then_report(task, complete):
+        # The worker stalls past its lease while writing the report and is taken for dead
+        os.utime(worker._heartbeat_path, (0, 0))
+        assert other.reclaim_expired() == 1
+        report(task, complete)
+    monkeypatch.setattr(worker, '_report', stall_then_report)
+
+    worker._finish(task)
+
+    assert os.listdir(os.path.join(queue_dir, PENDING_DIR)) == ['00000000-1.json']
+    assert os.listdir(os.path.join(queue_dir, RELEASING_DIR)) == []
@@ -0,0 +1,50 @@
+"""Tests for the thumbnail cache."""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'src'))
+sys.path.append(os.path.join(ROOT, 'benchmarks'))
+
+from PIL import Image
+
+from core.thumbnails import ThumbnailService
+from synthetic import write_psd
+
+def _cache_entries(cache_dir):
+    return sorted(name for name in os.listdir(cache_dir) if name.endswith('.png'))
+
+def test_cache_is_pruned_least_recently_used_first(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    paths = []
+    for index in range(3):
+        paths.append(str(tmp_path / f'{index}.psd'))
+        write_psd(paths[-1], 64, 64)
+    service = ThumbnailService((32, 32), cache_dir)
+    for psd_path in paths:
+        assert service.get(psd_path) is not None
+    assert len(_cache_entries(cache_dir)) == 3
+    first, second, third = (service._cache_path(path, os.stat(path)) for path in paths)
+    for cache_path, used in ((first, 30), (second, 10), (third, 20)):
+        os.utime(cache_path, (used, used))
+
+    # Pruning stops below 80% of the limit, which here leaves room for exactly two entries
+    kept_bytes = os.path.getsize(first) + os.path.getsize(third)
+    ThumbnailService((32, 32), cache_dir, max_bytes=kept_bytes / 0.8)
+
+    assert os.path.exists(first)
+    assert not os.path.exists(second)
+    assert os.path.exists(third)
+
+def test_failed_cache_write_leaves_no_temp_file(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    psd_path = str(tmp_path / 'a.psd')
+    write_psd(psd_path, 64, 64)
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(Image.Image, 'save', fail)
+
+    assert ThumbnailService((32, 32), cache_dir).get(psd_path) is not None
+    assert os.listdir(cache_dir) == []